@@ -4,15 +4,91 @@ from bisect import bisect_left
 
 import constants
 import util
+import mask_pool
+import artifacts
+import render
+import engines
 
 
 cache_qr_mat = {}
+cache_coords = {}
+
+# mmap-ed precomputed templates and placement order, None if not built or stale (python artifacts.py build)
+artifact = artifacts.load()
+
+def placement_coords(version):
+    '''
+    Data module coordinates of the version in placement order
+    '''
+    if version not in cache_coords and artifact is not None:
+        cache_coords[version] = artifact.placement_coords(version)
+    elif version not in cache_coords:
+        q = QRcode(version = version)
+        q.setup_template(True, None)
+        cache_coords[version] = util.placement_coords(q.modules)
+    return cache_coords[version]
+
+def generator_poly(err_cnt):
+    '''
+    Generator polynomial coefficients, a view into the artifact file if built
+    '''
+    if artifact is not None:
+        return artifact.generator_poly(err_cnt)
+    return util.generator_poly(err_cnt)
+
+def make_many(payloads, err_corr = constants.ERR_CORR_M, version = None, **options):
+    '''
+    Matrices of many payloads in input order, vectorized per version (needs numpy)
+    See batch.make_many for options
+    '''
+    import batch
+    return batch.make_many(payloads, err_corr, version, **options)
+
+def iter_encode(payloads, err_corr = constants.ERR_CORR_M, version = None, **options):
+    '''
+    Lazily yield the matrix of each payload, scratch buffers reused per version
+    See stream.iter_encode for options
+    '''
+    import stream
+    return stream.iter_encode(payloads, err_corr, version, **options)
+
+def compile_plan(version, err_corr = constants.ERR_CORR_M, mask_pattern = None, mode = None):
+    '''
+    Callable payload -> matrix (or rendered bytes) with version, err_corr, mask and mode pinned
+    See plan.compile_plan
+    '''
+    import plan
+    return plan.compile_plan(version, err_corr, mask_pattern, mode)
+
+def make_structured(data, err_corr = constants.ERR_CORR_M, **options):
+    '''
+    QRcode objects of up to 16 Structured Append symbols holding data
+    See structured.make for options
+    '''
+    import structured
+    return structured.make(data, err_corr, **options)
+
+def save_many(payloads, target, err_corr = constants.ERR_CORR_M, **options):
+    '''
+    Render payloads into a directory, .tar, .zip or .pack file with a background writer
+    See sink.save_many for options
+    '''
+    import sink
+    return sink.save_many(payloads, target, err_corr, **options)
+
+def make_small(data, err_corr = None, **options):
+    '''
+    Micro QR symbol (M1-M4) when data fits one, else a QRcode, made
+    See micro.make_small
+    '''
+    import micro
+    return micro.make_small(data, err_corr, **options)
 
 class QRcode:
     def __init__(self, version = None,
                 err_corr = constants.ERR_CORR_M,
                 box_size = 10, border = 4,
-                mask_pattern = None):
+                mask_pattern = None, parallel = None, compress = False, engine = None):
         if box_size < 0 or border < 0:
             raise ValueError('Expect box size and border > 0.')
         self.version = version and int(version)
@@ -20,6 +96,9 @@ class QRcode:
         self.box_size = int(box_size)
         self.border = int(border)
         self.mask_pattern = mask_pattern
+        self.parallel = parallel # None -> decided by constants.PARALLEL_MASK_VERSION
+        self.compress = compress # True -> deflate byte payloads when it lowers the version, see compress.py
+        self.engine = engines.resolve(engine, parallel) # see engines.py
         self.clear()
 
     def clear(self):
@@ -30,16 +109,27 @@ class QRcode:
         self.modules_cnt = 0 # No of modules/side
         self.data_cache = None
         self.data_list = []
+        self.compressed = None # segments encoded instead of data_list, see compress
+        self.render_cache = {} # (format, box size) -> bytes
 
     def add_data(self, data):
         '''
         Add data to QRcode
         '''
-        if isinstance(data, util.QRData):
+        if isinstance(data, (util.QRData, util.StructuredAppend)):
             self.data_list.append(data)
         else:
             self.data_list.append(util.QRData(data))
+        self.compressed = None
         self.data_cache = None
+        self.render_cache = {}
+
+    @property
+    def segments(self):
+        '''
+        Segments encoded in the symbol: the compressed ones if make chose them, else data_list
+        '''
+        return self.data_list if self.compressed is None else self.compressed
 
     def make(self, fit = True):
         '''
@@ -47,9 +137,21 @@ class QRcode:
         Data Ananlysis + Data Encodation + Error Correction Coing + Strutrue final Message + Placement in Matrix
         :param fit: True -> use best_fit to find an optimal size(version)
         '''
+        self.render_cache = {}
+        if self.compress and (fit or self.version == None):
+            import compress
+            segments = compress.compress_segments(self.data_list, self.err_corr, self.version)
+            self.compressed = None if segments is self.data_list else segments
+            self.data_cache = None
         if fit or(self.version == None):
             self.best_fit(start=self.version)
-        if self.mask_pattern is None:
+        if self.engine != 'reference':
+            if self.version < 1 or self.version > 40:
+                raise ValueError('Invalid version')
+            self.modules, self.data_cache = engines.make(
+                self.engine, self.version, self.err_corr, self.segments, self.mask_pattern)
+            self.modules_cnt = self.version*4 + 17
+        elif self.mask_pattern is None:
             self.makeImpl(False, self.best_mask_pattern())
         else:
             self.makeImpl(False, self.mask_pattern)
@@ -65,14 +167,15 @@ class QRcode:
         
         bits_number = util.bits_number_for_version(start)
         buffer = util.BitBuffer()
-        for data in self.data_list:
+        for data in self.segments:
             buffer.put(data.mode, 4)
             buffer.put(len(data), bits_number[data.mode])
             data.write(buffer)
         
         bits_needed = len(buffer)
+        limits = util.BIT_LIMIT_TABLE[self.err_corr] if artifact is None else artifact.bit_limit(self.err_corr)
         self.version = bisect_left(
-            util.BIT_LIMIT_TABLE[self.err_corr], bits_needed, start
+            limits, bits_needed, start
         )
 
         if self.version > 40:
@@ -87,6 +190,11 @@ class QRcode:
         '''
         Find the optimal mask pattern
         '''
+        if self.parallel or (self.parallel is None
+                and self.version >= constants.PARALLEL_MASK_VERSION):
+            self.makeImpl(True, None)
+            return mask_pool.best_mask_pattern(self.modules, self.version)
+
         mask_pattern = 0
         min_lost_needed = 0
         
@@ -104,11 +212,26 @@ class QRcode:
     def makeImpl(self, test, mask_pattern):
         '''
         Make mat
+        mask_pattern None -> data placed without mask
+        '''
+        self.setup_template(test, mask_pattern)
+
+        if self.data_cache == None:
+            self.data_cache = util.put_data(self.version, self.err_corr, self.segments)
+
+        self.mapping(self.data_cache, mask_pattern)
+
+    def setup_template(self, test, mask_pattern):
+        '''
+        Function patterns, type info and version info, data modules left None
         '''
         if self.version < 1 or self.version > 40:
             raise ValueError('Invalid version')
         self.modules_cnt = self.version*4 + 17
 
+        if self.version not in cache_qr_mat and artifact is not None:
+            cache_qr_mat[self.version] = artifact.template_mat(self.version)
+
         if self.version in cache_qr_mat:
             self.modules = util.copy_mat(cache_qr_mat[self.version])
         else:
@@ -133,11 +256,6 @@ class QRcode:
         if self.version >= 7:
             self.setup_version_info(test)
 
-        if self.data_cache == None:
-            self.data_cache = util.put_data(self.version, self.err_corr, self.data_list)
-
-        self.mapping(self.data_cache, mask_pattern)
-
     def setup_finder_pattern(self, row, col):
         '''
         Set the finder pattern for localization
@@ -204,8 +322,10 @@ class QRcode:
         calculate data and error correction info 
         setup type information
         '''
-        data = (self.err_corr << 3) | mask_pattern 
-        data_BCH = util.BCH_code_generator(data)
+        if artifact is not None:
+            data_BCH = artifact.format_info(self.err_corr, mask_pattern or 0)
+        else:
+            data_BCH = util.BCH_code_generator((self.err_corr << 3) | (mask_pattern or 0))
 
         # vertical
         for r in range(15):
@@ -234,7 +354,10 @@ class QRcode:
         '''
         Setup the qr code about version info for high version
         '''
-        data_BCH = util.BCH_code_version_info(self.version)
+        if artifact is not None:
+            data_BCH = artifact.version_info(self.version)
+        else:
+            data_BCH = util.BCH_code_version_info(self.version)
 
         for r in range(18):
             mod = (not test and ((data_BCH >> r) & 1) == 1)
@@ -314,18 +437,47 @@ class QRcode:
         return mat
 
         
-    def make_image(self, name = None, save_dir = None):
+    def buffer(self):
+        '''
+        matrix.SymbolBuffer of the bordered symbol, copied from modules once per make
+        '''
+        if self.data_cache == None:
+            self.make()
+        if 'buffer' not in self.render_cache:
+            import matrix
+            self.render_cache['buffer'] = matrix.SymbolBuffer(self.modules, self.border)
+        return self.render_cache['buffer']
+
+    def render(self, fmt = 'png', box_size = None):
+        '''
+        Render the symbol as bytes in fmt (png, svg, eps, pdf)
+        Made once from the module matrix and cached per (format, box size)
+        '''
+        box_size = self.box_size if box_size is None else int(box_size)
+        key = (fmt, box_size)
+        if key not in self.render_cache:
+            self.render_cache[key] = render.render_bytes(self, fmt, box_size)
+        return self.render_cache[key]
+
+    def renders(self, box_sizes, formats = ('png',)):
+        '''
+        Lazy renders at several box sizes and formats, keyed by (format, box size)
+        '''
+        return render.Renders(self, box_sizes, formats)
+
+    def make_image(self, name = None, save_dir = None, sink = None):
         '''
         Make QRcode image
         param: name without suffix
+        param: sink: sink.Sink to hand the PNG to instead of saving it in save_dir
         '''
 
-        mat = self.get_mat()
+        buffer = self.buffer()
 
         if save_dir == None:
             save_dir = 'MyQrCode'
         
-        if not os.path.exists(save_dir):
+        if sink is None and not os.path.exists(save_dir):
             os.mkdir(save_dir)
 
         if name == None:
@@ -334,7 +486,7 @@ class QRcode:
                 name = name[:15]
         
         import numpy as np
-        array = np.array(mat, int)
+        array = np.asarray(buffer)
 
         
         # delete margain
@@ -347,7 +499,13 @@ class QRcode:
 
         # save fig
         plt.imshow(array, 'gray_r')
-        fig.savefig(save_dir + '/' + name + '.png')
+        if sink is None:
+            fig.savefig(save_dir + '/' + name + '.png')
+        else:
+            import io
+            out = io.BytesIO()
+            fig.savefig(out, format = 'png')
+            sink.write(name + '.png', out.getvalue())
         plt.close()
 
         # plt.imsave(fname = save_dir + '/' + name + '.png', arr = mat, cmap = 'gray_r', dpi = 500)
@@ -366,9 +524,6 @@ if __name__ == '__main__':
     # q2.add_data('information theory')
     # q2.make_image(name = 'information theory')
 
-    # from pyzbar import pyzbar
-    # from PIL import Image
-
-    # result = pyzbar.decode(Image.open('MyQrCode/xinxilun.png'), symbols=[pyzbar.ZBarSymbol.QRCODE])
-    # print(result)
-    # print(result[0][0])
+    # round-trip check without an external scanner
+    import decoder
+    print(decoder.decode(q2.modules).data.decode('utf-8'))
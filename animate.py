@@ -0,0 +1,118 @@
+'''
+Animated output of a sequence of module matrices (all of one version)
+Frames are written as they come, nothing but the current frame is kept.
+'''
+import struct
+import zlib
+from itertools import islice
+
+import render
+
+
+def _frame_size(modules, box_size, border):
+    return (len(modules) + 2 * border) * box_size
+
+def write_apng(frames, f, count, fps = 10, box_size = 4, border = 4):
+    '''
+    Write frames (module matrices) as a looping 1-bit APNG to binary file f
+    count: number of frames, needed up front by the acTL chunk
+    '''
+    sequence = 0
+    written = 0
+    for modules in islice(frames, count):
+        mat = render.MatrixSource(modules, box_size, border).get_mat()
+        size = len(mat) * box_size
+        if written == 0:
+            f.write(b'\x89PNG\r\n\x1a\n')
+            render._png_chunk(f, b'IHDR', struct.pack('>IIBBBBB', size, size, 1, 0, 0, 0, 0))
+            render._png_chunk(f, b'acTL', struct.pack('>II', count, 0))
+        render._png_chunk(f, b'fcTL', struct.pack('>IIIIIHHBB',
+            sequence, size, size, 0, 0, 1, fps, 0, 0))
+        sequence += 1
+        data = zlib.compress(b''.join(b'\x00' + line for line in render.png_rows(mat, box_size)), 6)
+        if written == 0:
+            render._png_chunk(f, b'IDAT', data)
+        else:
+            render._png_chunk(f, b'fdAT', struct.pack('>I', sequence) + data)
+            sequence += 1
+        written += 1
+    if written != count:
+        raise ValueError('Expected {} frames, got {}'.format(count, written))
+    render._png_chunk(f, b'IEND', b'')
+
+
+def _lzw(pixels):
+    '''
+    GIF LZW data of 2-color pixels (bytes of 0/1), minimum code size 2
+    '''
+    clear, end = 4, 5
+    out = bytearray()
+    bit_buffer = bit_count = 0
+
+    def emit(code, width):
+        nonlocal bit_buffer, bit_count
+        bit_buffer |= code << bit_count
+        bit_count += width
+        while bit_count >= 8:
+            out.append(bit_buffer & 0xff)
+            bit_buffer >>= 8
+            bit_count -= 8
+
+    width = 3
+    table = {}
+    next_code = 6
+    emit(clear, width)
+    prefix = pixels[0]
+    for pixel in pixels[1:]:
+        key = (prefix, pixel)
+        if key in table:
+            prefix = table[key]
+            continue
+        emit(prefix, width)
+        if next_code == 4096:
+            emit(clear, width)
+            table = {}
+            next_code = 6
+            width = 3
+        else:
+            table[key] = next_code
+            if next_code == 1 << width and width < 12:
+                width += 1
+            next_code += 1
+        prefix = pixel
+    emit(prefix, width)
+    emit(end, width)
+    if bit_count:
+        out.append(bit_buffer & 0xff)
+    return bytes(out)
+
+def write_gif(frames, f, count, fps = 10, box_size = 4, border = 4):
+    '''
+    Write the first count frames (module matrices) as a looping 2-color GIF to binary file f
+    '''
+    delay = max(1, round(100 / fps)) # hundredths of a second
+    size = None
+    written = 0
+    for modules in islice(frames, count):
+        mat = render.MatrixSource(modules, box_size, border).get_mat()
+        if size is None:
+            size = len(mat) * box_size
+            f.write(b'GIF89a' + struct.pack('<HHBBB', size, size, 0x80, 0, 0))
+            f.write(b'\xff\xff\xff\x00\x00\x00') # white, black
+            f.write(b'\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00') # loop forever
+        f.write(struct.pack('<BBBBHBB', 0x21, 0xf9, 4, 0, delay, 0, 0))
+        f.write(struct.pack('<BHHHHB', 0x2c, 0, 0, size, size, 0))
+        pixels = bytearray()
+        for row in mat:
+            line = bytes(b for module in row for b in (1 if module else 0,) * box_size)
+            pixels += line * box_size
+        data = _lzw(pixels)
+        f.write(b'\x02')
+        for i in range(0, len(data), 255):
+            block = data[i:i + 255]
+            f.write(bytes((len(block),)) + block)
+        f.write(b'\x00')
+        written += 1
+    if written != count:
+        raise ValueError('Expected {} frames, got {}'.format(count, written))
+    f.write(b'\x3b')
@@ -1,9 +1,109 @@
-from flask import Flask, redirect, render_template, request, url_for
-import QRcode
+from flask import Flask, Response, abort, g, redirect, render_template, request, url_for
+from functools import lru_cache
+import io
 import os
+import time
+import zipfile
+import QRcode
+import constants
+import metrics
+import render
+import scheduler
 
 app = Flask(__name__)
 
+MAX_BOX_SIZE = 40
+MAX_BULK = 10000
+ERR_CORRS = (constants.ERR_CORR_L, constants.ERR_CORR_M, constants.ERR_CORR_Q, constants.ERR_CORR_H)
+BULK_CHUNK = 16 # symbols per bulk job, interactive jobs get in between
+
+# QRCODE_SCHEDULER=off runs generation on the request threads directly
+SCHEDULER = None if os.environ.get('QRCODE_SCHEDULER') == 'off' else scheduler.Scheduler()
+
+REQUESTS = metrics.Counter('qrcode_http_requests_total', 'HTTP requests.', ('route', 'method', 'status'))
+LATENCY = metrics.Histogram('qrcode_http_request_duration_seconds', 'HTTP request latency.', ('route',))
+IN_FLIGHT = metrics.Gauge('qrcode_http_requests_in_flight', 'HTTP requests in progress.', ('route',))
+STAGE = metrics.Histogram('qrcode_stage_duration_seconds', 'Time spent to encode or render a symbol.', ('stage',))
+CACHE = metrics.Counter('qrcode_cache_requests_total', 'Cache lookups.', ('cache', 'result'))
+CACHE_RATIO = metrics.Gauge('qrcode_cache_hit_ratio', 'Cache hits / lookups.', ('cache',))
+QUEUED = metrics.Gauge('qrcode_scheduler_queued_jobs', 'Jobs waiting in the scheduler.', ('priority',))
+DROPPED = metrics.Counter('qrcode_scheduler_dropped_jobs_total', 'Jobs dropped at their queue deadline.', ('priority',))
+
+@lru_cache(maxsize = 256)
+def get_qrcode(data, err_corr):
+    '''
+    One encoded symbol per (data, err_corr), its renders are cached on it
+    '''
+    q = QRcode.QRcode(err_corr = err_corr)
+    q.add_data(data)
+    with STAGE.time(stage = 'encode'):
+        q.make()
+    return q
+
+@metrics.REGISTRY.on_collect
+def collect_cache():
+    info = get_qrcode.cache_info()
+    CACHE.set(info.hits, cache = 'symbol', result = 'hit')
+    CACHE.set(info.misses, cache = 'symbol', result = 'miss')
+    for cache in ('symbol', 'render'):
+        hits = CACHE.get(cache = cache, result = 'hit')
+        lookups = hits + CACHE.get(cache = cache, result = 'miss')
+        CACHE_RATIO.set(hits / lookups if lookups else 0.0, cache = cache)
+
+@metrics.REGISTRY.on_collect
+def collect_scheduler():
+    if SCHEDULER is None:
+        return
+    for priority, count in SCHEDULER.queued().items():
+        QUEUED.set(count, priority = priority)
+        DROPPED.set(SCHEDULER.dropped.get(priority, 0), priority = priority)
+
+def client_of(request):
+    return request.headers.get('X-Client-Id', request.remote_addr)
+
+def err_corr_of(request):
+    '''
+    err_corr query argument, 400 unless one of ERR_CORRS
+    '''
+    try:
+        err_corr = int(request.args.get('err_corr', constants.ERR_CORR_M))
+    except ValueError:
+        abort(400)
+    if err_corr not in ERR_CORRS:
+        abort(400)
+    return err_corr
+
+def schedule(priority, func, *args, cost = 1.0):
+    '''
+    Run func through the scheduler, 503 if it waited past its deadline
+    '''
+    if SCHEDULER is None:
+        return func(*args)
+    try:
+        return SCHEDULER.run(priority, client_of(request), func, *args, cost = cost)
+    except scheduler.DeadlineExceeded:
+        abort(503)
+
+def route_of(request):
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_timer():
+    g.start = time.perf_counter()
+    IN_FLIGHT.inc(route = route_of(request))
+
+@app.after_request
+def count_request(response):
+    REQUESTS.inc(route = route_of(request), method = request.method, status = response.status_code)
+    return response
+
+@app.teardown_request
+def stop_timer(exc):
+    if 'start' in g:
+        route = route_of(request)
+        LATENCY.observe(time.perf_counter() - g.start, route = route)
+        IN_FLIGHT.dec(route = route)
+
 def render_index(request, template, result):
     if request.method == 'POST':
         data = request.form['data']
@@ -17,15 +117,66 @@ def render_result(request, template, result):
         return redirect(url_for(result, data = data))
 
     data = request.args.get('data')
-    err_corr = request.args.get('err_corr')
-    basedir = os.path.abspath(os.path.dirname(__file__))
-    print(basedir)
+    err_corr = err_corr_of(request)
 
-    q = QRcode.QRcode(err_corr = int(err_corr))
-    q.add_data(data)
-    q.make_image(name='1',save_dir='static')
+    schedule(scheduler.INTERACTIVE, get_qrcode, data, err_corr)
+
+    return render_template(template, data = data, err_corr = err_corr)
+
+def render_image(request, fmt):
+    if fmt not in render.MIMETYPES:
+        abort(404)
+    data = request.args.get('data', '')
+    err_corr = err_corr_of(request)
+    box_size = request.args.get('box_size', type = int)
+    if box_size is not None and not 1 <= box_size <= MAX_BOX_SIZE:
+        abort(400)
+
+    body = schedule(scheduler.INTERACTIVE, render_symbol, data, err_corr, fmt, box_size)
+    return Response(body, mimetype = render.MIMETYPES[fmt])
+
+def render_symbol(data, err_corr, fmt, box_size):
+    q = get_qrcode(data, err_corr)
+    if (fmt, q.box_size if box_size is None else box_size) in q.render_cache:
+        CACHE.inc(cache = 'render', result = 'hit')
+        return q.render(fmt, box_size)
+    CACHE.inc(cache = 'render', result = 'miss')
+    with STAGE.time(stage = 'render'):
+        return q.render(fmt, box_size)
 
-    return render_template(template, data = data, name = basedir + '/MyQrCode/1.png')
+def render_bulk(request):
+    '''
+    One payload per line of the request body -> zip of PNG codes, made as low-priority jobs
+    '''
+    payloads = request.get_data(as_text = True).splitlines()
+    err_corr = err_corr_of(request)
+    box_size = request.args.get('box_size', 4, type = int)
+    if not payloads or len(payloads) > MAX_BULK or not 1 <= box_size <= MAX_BOX_SIZE:
+        abort(400)
+
+    def make_chunk(chunk):
+        with STAGE.time(stage = 'bulk'):
+            return QRcode.make_many(chunk, err_corr, fmt = 'png', box_size = box_size)
+
+    chunks = [payloads[i:i + BULK_CHUNK] for i in range(0, len(payloads), BULK_CHUNK)]
+    if SCHEDULER is None:
+        images = [make_chunk(chunk) for chunk in chunks]
+    else:
+        client = client_of(request)
+        futures = [SCHEDULER.submit(scheduler.BULK, client, make_chunk, chunk, cost = len(chunk))
+            for chunk in chunks]
+        try:
+            images = [future.result() for future in futures]
+        except scheduler.DeadlineExceeded:
+            for future in futures:
+                future.cancel()
+            abort(503)
+
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_STORED) as archive:
+        for index, image in enumerate(image for chunk in images for image in chunk):
+            archive.writestr('{:06d}.png'.format(index), image)
+    return Response(out.getvalue(), mimetype = 'application/zip')
 
 @app.route('/', methods = ['POST','GET'])
 def index():
@@ -35,5 +186,17 @@ def index():
 def result():
     return render_result(request, 'result.html', 'result')
 
+@app.route('/image/<fmt>')
+def image(fmt):
+    return render_image(request, fmt)
+
+@app.route('/bulk', methods = ['POST'])
+def bulk():
+    return render_bulk(request)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.expose(), content_type = metrics.CONTENT_TYPE)
+
 if __name__ == '__main__':
     app.run(debug=True, port=8081)
\ No newline at end of file
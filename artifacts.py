@@ -0,0 +1,236 @@
+'''
+Precomputed per-version artifacts in one read-only binary file
+Build:  python artifacts.py build [path]
+Every process maps the file with mmap, so all workers share one page-cache copy.
+Tables read as ints or numpy arrays are used in place (format/version info, bit limits,
+generator polynomials, and the GF tables, placement order, reserved bitmap and mask
+planes of batch.layout). The list-of-lists engines mutate their modules, so QRcode
+still decodes the template and placement order of a version once per process.
+
+Layout (little endian, all offsets aligned to 8 bytes)
+    header   MAGIC, FORMAT_VERSION, number of entries, constants_hash()
+    entries  name(32s) typecode(c) offset(I) count(I)
+    payload  raw arrays
+'''
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+import constants
+import util
+
+
+MAGIC = b'QRART'
+FORMAT_VERSION = 3
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'qr_artifacts.bin')
+
+_HEADER = struct.Struct('<5sBH32s')
+_ENTRY = struct.Struct('<32scII')
+
+# cell values of the function pattern template
+TEMPLATE_LIGHT = 0
+TEMPLATE_DARK = 1
+TEMPLATE_EMPTY = 2
+_CELL = (False, True, None)
+
+
+def constants_hash():
+    '''
+    SHA-256 of the values in constants, a file built from other tables is stale
+    '''
+    values = sorted((name, value) for name, value in vars(constants).items() if name.isupper())
+    return hashlib.sha256(repr(values).encode('utf-8')).digest()
+
+def _collect():
+    '''
+    Compute every artifact, return list of (name, typecode, values)
+    '''
+    import QRcode
+
+    # compute from scratch, never from a previously built file
+    QRcode.artifact = None
+    QRcode.cache_qr_mat.clear()
+    QRcode.cache_coords.clear()
+
+    entries = []
+    for version in range(1, 41):
+        modules_cnt = version*4 + 17
+        q = QRcode.QRcode(version = version)
+
+        # function patterns only, as cached in QRcode.cache_qr_mat
+        q.setup_template(True, None)
+        template = QRcode.cache_qr_mat[version]
+        entries.append(('template/{}'.format(version), 'B', [
+            TEMPLATE_EMPTY if cell is None else int(cell)
+            for row in template for cell in row]))
+
+        # function patterns + type info + version info
+        entries.append(('reserved/{}'.format(version), 'B', [
+            int(cell is not None) for row in q.modules for cell in row]))
+
+        coords = util.placement_coords(q.modules)
+        entries.append(('coords/{}'.format(version), 'H', [
+            r*modules_cnt + c for r, c in coords]))
+
+        # the eight mask planes one after the other, over data modules only
+        entries.append(('mask/{}'.format(version), 'B', [
+            int(cell is None and bool(util.mask_function(mask_pattern)(r, c)))
+            for mask_pattern in range(8)
+            for r, row in enumerate(q.modules) for c, cell in enumerate(row)]))
+
+    entries.append(('format_info', 'H', [
+        util.BCH_code_generator((err_corr << 3) | mask_pattern)
+        for err_corr in range(4) for mask_pattern in range(8)]))
+    entries.append(('version_info', 'I', [0] * 7 + [
+        util.BCH_code_version_info(version) for version in range(7, 41)]))
+    entries.append(('bit_limit', 'I', [
+        bits for row in util.BIT_LIMIT_TABLE for bits in row]))
+    entries.append(('gf_exp', 'B', util.exponents))
+    entries.append(('gf_log', 'B', util.log))
+
+    err_counts = set()
+    for version in range(1, 41):
+        for err_corr in range(4):
+            for block in util.rs_blocks(version, err_corr):
+                err_counts.add(block.total_count - block.data_count)
+    for err_cnt in sorted(err_counts):
+        entries.append(('rs_poly/{}'.format(err_cnt), 'B', util.generator_poly(err_cnt)))
+
+    return entries
+
+def build(path = DEFAULT_PATH):
+    '''
+    Write the artifact file, replace the old one atomically
+    '''
+    entries = _collect()
+
+    offset = _HEADER.size + _ENTRY.size * len(entries)
+    table = []
+    payload = []
+    for name, typecode, values in entries:
+        offset = (offset + 7) & ~7
+        raw = struct.pack('<{}{}'.format(len(values), typecode), *values)
+        table.append(_ENTRY.pack(name.encode('ascii'), typecode.encode('ascii'), offset, len(values)))
+        payload.append((offset, raw))
+        offset += len(raw)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(entries), constants_hash()))
+        f.write(b''.join(table))
+        for offset, raw in payload:
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(raw)
+    os.replace(tmp_path, path)
+    return path
+
+
+class Artifacts:
+    '''
+    Read-only view of an artifact file
+    Entries are memoryviews into the mapped file, only template_mat and
+    placement_coords build new lists from them
+    '''
+    def __init__(self, path = DEFAULT_PATH):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+
+        try:
+            magic, format_version, count, digest = _HEADER.unpack_from(self.mmap, 0)
+            if magic != MAGIC or format_version != FORMAT_VERSION:
+                raise ValueError('Invalid artifact file {}, rebuild it.'.format(path))
+            if digest != constants_hash():
+                raise ValueError('Artifact file {} was built from other constants, rebuild it.'.format(path))
+
+            self.entries = {}
+            for i in range(count):
+                name, typecode, offset, length = _ENTRY.unpack_from(
+                    self.mmap, _HEADER.size + i*_ENTRY.size)
+                typecode = typecode.decode('ascii')
+                end = offset + length*struct.calcsize(typecode)
+                if end > len(self.mmap):
+                    raise ValueError('Truncated artifact file {}, rebuild it.'.format(path))
+                self.entries[name.rstrip(b'\0').decode('ascii')] = self.view[offset:end].cast(typecode)
+        except (struct.error, UnicodeDecodeError):
+            raise ValueError('Corrupt artifact file {}, rebuild it.'.format(path))
+
+    def __getitem__(self, name):
+        return self.entries[name]
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def template(self, version):
+        return self.entries['template/{}'.format(version)]
+
+    def reserved(self, version):
+        return self.entries['reserved/{}'.format(version)]
+
+    def coords(self, version):
+        return self.entries['coords/{}'.format(version)]
+
+    def mask_planes(self, version):
+        '''
+        8 x modules_cnt**2 bytes, 1 where the mask inverts a data module
+        '''
+        return self.entries['mask/{}'.format(version)]
+
+    def format_info(self, err_corr, mask_pattern):
+        return self.entries['format_info'][(err_corr << 3) | mask_pattern]
+
+    def version_info(self, version):
+        return self.entries['version_info'][version]
+
+    def bit_limit(self, err_corr):
+        '''
+        Data bits per version (index 0 unused) as util.BIT_LIMIT_TABLE[err_corr]
+        '''
+        return self.entries['bit_limit'][err_corr*41:(err_corr + 1)*41]
+
+    def generator_poly(self, err_cnt):
+        return self.entries['rs_poly/{}'.format(err_cnt)]
+
+    def template_mat(self, version):
+        '''
+        Function pattern template as QRcode modules, None for empty modules
+        '''
+        modules_cnt = version*4 + 17
+        template = self.template(version)
+        return [
+            [_CELL[cell] for cell in template[r*modules_cnt:(r + 1)*modules_cnt]]
+            for r in range(modules_cnt)
+        ]
+
+    def placement_coords(self, version):
+        '''
+        Data module coordinates in placement order
+        '''
+        modules_cnt = version*4 + 17
+        return [divmod(index, modules_cnt) for index in self.coords(version)]
+
+
+def load(path = None):
+    '''
+    Map the artifact file
+    path None -> $QRCODE_ARTIFACTS or DEFAULT_PATH, return None if missing, stale or corrupt
+    '''
+    if path is not None:
+        return Artifacts(path)
+    path = os.environ.get('QRCODE_ARTIFACTS', DEFAULT_PATH)
+    if not os.path.exists(path):
+        return None
+    try:
+        return Artifacts(path)
+    except ValueError:
+        # computed lazily until rebuilt
+        return None
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'build':
+        print('Usage: python artifacts.py build [path]')
+        sys.exit(1)
+    print(build(*sys.argv[2:3]))
@@ -0,0 +1,242 @@
+'''
+Asyncio (ASGI) variant of the web page, same routes as app.py
+Run with any ASGI server, e.g.  uvicorn asgi_app:app --port 8081
+QRcode generation runs in a bounded process pool off the event loop:
+    - a request whose client disconnects cancels its queued work
+    - requests beyond MAX_PENDING are rejected with 503 (backpressure)
+'''
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from urllib.parse import parse_qs, urlencode
+
+import jinja2
+
+import constants
+import render
+
+
+MAX_WORKERS = os.cpu_count() or 1
+MAX_PENDING = 4 * MAX_WORKERS
+MAX_BOX_SIZE = 40
+RENDER_CACHE_SIZE = 256
+ERR_CORRS = (constants.ERR_CORR_L, constants.ERR_CORR_M, constants.ERR_CORR_Q, constants.ERR_CORR_H)
+
+ROUTES = {
+    'index': '/',
+    'result': '/result',
+    'image': '/image/{fmt}',
+}
+
+# Runs in the worker processes
+
+@lru_cache(maxsize = 256)
+def get_qrcode(data, err_corr):
+    '''
+    One encoded symbol per (data, err_corr) in each worker, renders cached on it
+    '''
+    import QRcode
+    q = QRcode.QRcode(err_corr = err_corr)
+    q.add_data(data)
+    q.make()
+    return q
+
+def generate(data, err_corr, fmt, box_size):
+    return get_qrcode(data, err_corr).render(fmt, box_size)
+
+
+class Overloaded(Exception):
+    pass
+
+class Generator:
+    '''
+    Bounded process pool, at most max_pending jobs queued or running
+    '''
+    def __init__(self, max_workers = MAX_WORKERS, max_pending = MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.lock = threading.Lock() # pending is lowered from the pool's thread
+        self.executor = None
+
+    def start(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers = self.max_workers)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures = True)
+            self.executor = None
+
+    async def submit(self, func, *args):
+        '''
+        Run func in the pool, cancelling the awaiting task cancels the job if not started
+        A started job still counts as pending until it ends
+        '''
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise Overloaded()
+            self.pending += 1
+        try:
+            self.start()
+            future = self.executor.submit(func, *args)
+        except BaseException:
+            with self.lock:
+                self.pending -= 1
+            raise
+        future.add_done_callback(self.done)
+        return await asyncio.wrap_future(future)
+
+    def done(self, future):
+        with self.lock:
+            self.pending -= 1
+
+
+def url_for(endpoint, **values):
+    path = ROUTES[endpoint]
+    query = {k: v for k, v in values.items() if '{' + k + '}' not in path}
+    path = path.format(**values)
+    return path + ('?' + urlencode(query) if query else '')
+
+templates = jinja2.Environment(
+    loader = jinja2.FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')),
+    autoescape = jinja2.select_autoescape(['html']),
+)
+templates.globals['url_for'] = url_for
+
+
+async def send_response(send, status, body, content_type = 'text/html; charset=utf-8', headers = ()):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', content_type.encode('ascii')),
+            (b'content-length', str(len(body)).encode('ascii')),
+        ] + [(k.encode('ascii'), v.encode('ascii')) for k, v in headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+async def wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+class App:
+    '''
+    ASGI application
+    '''
+    def __init__(self, generator = None):
+        self.generator = generator or Generator()
+        self.render_cache = OrderedDict() # (data, err_corr, fmt, box_size) -> bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.generator.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.generator.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        path = scope['path']
+        args = {k: v[0] for k, v in parse_qs(scope['query_string'].decode('latin-1')).items()}
+
+        if path in (ROUTES['index'], ROUTES['result']):
+            if scope['method'] == 'POST':
+                body = await read_body(receive)
+                if body is None:
+                    return
+                form = {k: v[0] for k, v in parse_qs(body.decode('utf-8')).items()}
+                location = url_for('result', data = form.get('data', ''))
+                await send_response(send, 302, '', headers = [('location', location)])
+            elif path == ROUTES['index']:
+                await send_response(send, 200, templates.get_template('index.html').render())
+            else:
+                await self.result(send, args)
+        elif path.startswith('/image/'):
+            await self.image(receive, send, path[len('/image/'):], args)
+        else:
+            await send_response(send, 404, 'Not Found', 'text/plain')
+
+    async def result(self, send, args):
+        try:
+            err_corr = int(args.get('err_corr', constants.ERR_CORR_M))
+        except ValueError:
+            return await send_response(send, 400, 'Bad Request', 'text/plain')
+        if err_corr not in ERR_CORRS:
+            return await send_response(send, 400, 'Bad Request', 'text/plain')
+        page = templates.get_template('result.html').render(
+            data = args.get('data', ''), err_corr = err_corr)
+        await send_response(send, 200, page)
+
+    async def image(self, receive, send, fmt, args):
+        if fmt not in render.MIMETYPES:
+            return await send_response(send, 404, 'Not Found', 'text/plain')
+        try:
+            err_corr = int(args.get('err_corr', constants.ERR_CORR_M))
+            box_size = int(args['box_size']) if 'box_size' in args else None
+        except ValueError:
+            return await send_response(send, 400, 'Bad Request', 'text/plain')
+        if err_corr not in ERR_CORRS or box_size is not None and not 1 <= box_size <= MAX_BOX_SIZE:
+            return await send_response(send, 400, 'Bad Request', 'text/plain')
+
+        key = (args.get('data', ''), err_corr, fmt, box_size)
+        if key in self.render_cache:
+            self.render_cache.move_to_end(key)
+            return await send_response(send, 200, self.render_cache[key], render.MIMETYPES[fmt])
+
+        try:
+            body = await self.generate_or_cancel(receive, key)
+        except Overloaded:
+            return await send_response(send, 503, 'Busy', 'text/plain', [('retry-after', '1')])
+        except (ValueError, OverflowError) as e:
+            return await send_response(send, 400, str(e), 'text/plain')
+        if body is None: # client gone
+            return
+
+        self.render_cache[key] = body
+        if len(self.render_cache) > RENDER_CACHE_SIZE:
+            self.render_cache.popitem(last = False)
+        await send_response(send, 200, body, render.MIMETYPES[fmt])
+
+    async def generate_or_cancel(self, receive, key):
+        '''
+        Generate in the pool, give up and cancel the job if the client disconnects first
+        '''
+        work = asyncio.ensure_future(self.generator.submit(generate, *key))
+        disconnect = asyncio.ensure_future(wait_disconnect(receive))
+        done, _ = await asyncio.wait({work, disconnect}, return_when = asyncio.FIRST_COMPLETED)
+        if work in done:
+            disconnect.cancel()
+            return work.result()
+        work.cancel()
+        return None
+
+
+app = App()
@@ -0,0 +1,238 @@
+'''
+Vectorized batch engine behind QRcode.make_many
+Payloads are grouped by version; for each group the Reed-Solomon parity, data
+placement, the N x 8 x S x S stack of masked candidates and their penalties are
+computed with whole-array numpy operations. Same matrices as QRcode.make.
+'''
+from functools import lru_cache
+
+import numpy as np
+
+import constants
+import util
+
+
+# upper bound of the masked candidate stack, in bytes
+BATCH_MEMORY = 64 << 20
+
+# finder-like patterns of lost_count_3, the column scan does not check the last module of PATTERN_1
+PATTERN_1 = np.array([1, 0, 1, 1, 1, 0, 1, 0, 0, 0, 0], bool)
+PATTERN_2 = np.array([0, 0, 0, 0, 1, 0, 1, 1, 1, 0, 1], bool)
+
+
+@lru_cache(maxsize = None)
+def gf_mul_table():
+    '''
+    256 x 256 products over GF(256)
+    '''
+    import QRcode
+    if QRcode.artifact is not None:
+        exp = np.frombuffer(QRcode.artifact['gf_exp'], np.uint8)
+        log = np.frombuffer(QRcode.artifact['gf_log'], np.uint8).astype(np.int64)
+    else:
+        exp = np.array(util.exponents, np.uint8)
+        log = np.array(util.log, np.int64)
+    table = exp[(log[:, None] + log[None, :]) % 255]
+    table[0, :] = 0
+    table[:, 0] = 0
+    return table
+
+@lru_cache(maxsize = None)
+def parity_matrix(data_cnt, err_cnt):
+    '''
+    data_cnt x err_cnt matrix, row i = error correction codewords of the unit codeword e_i
+    '''
+    rows = []
+    for i in range(data_cnt):
+        unit = [0] * data_cnt
+        unit[i] = 1
+        rows.append(util.ecc_codewords(unit, err_cnt))
+    return np.array(rows, np.uint8)
+
+@lru_cache(maxsize = None)
+def layout(version, err_corr):
+    '''
+    Everything about (version, err_corr) that does not depend on the payload
+    '''
+    import QRcode
+    modules_cnt = version*4 + 17
+    blocks = util.rs_blocks(version, err_corr)
+
+    # interleave: final codeword k = concat(data blocks, ecc blocks)[order[k]]
+    data_pos, ecc_pos = [], []
+    offset = 0
+    for block in blocks:
+        data_pos.append(list(range(offset, offset + block.data_count)))
+        offset += block.data_count
+    for block in blocks:
+        err_cnt = block.total_count - block.data_count
+        ecc_pos.append(list(range(offset, offset + err_cnt)))
+        offset += err_cnt
+    order = []
+    for table in (data_pos, ecc_pos):
+        for i in range(max(map(len, table))):
+            for positions in table:
+                if i < len(positions):
+                    order.append(positions[i])
+
+    q = QRcode.QRcode(version = version, err_corr = err_corr)
+    q.setup_template(True, None)
+    if QRcode.artifact is not None:
+        # placement order and mask planes are views into the mapped file
+        coord_index = np.frombuffer(QRcode.artifact.coords(version), np.uint16)
+        is_data = np.frombuffer(QRcode.artifact.reserved(version), np.uint8).reshape(modules_cnt, modules_cnt) == 0
+        mask_planes = np.frombuffer(QRcode.artifact.mask_planes(version), bool).reshape(8, modules_cnt, modules_cnt)
+    else:
+        coords = QRcode.placement_coords(version)
+        coord_index = np.array([r*modules_cnt + c for r, c in coords], np.intp)
+        is_data = np.array([[cell is None for cell in row] for row in q.modules])
+        rows, cols = np.indices((modules_cnt, modules_cnt))
+        mask_planes = np.array([
+            np.vectorize(util.mask_function(i))(rows, cols) for i in range(8)], bool) & is_data
+    test_template = np.array([[bool(cell) for cell in row] for row in q.modules])
+
+    final_templates = []
+    for mask_pattern in range(8):
+        q.setup_template(False, mask_pattern)
+        final_templates.append([[bool(cell) for cell in row] for row in q.modules])
+
+    return {
+        'blocks': blocks,
+        'order': np.array(order, np.intp),
+        'coord_index': coord_index,
+        'is_data': is_data,
+        'test_template': test_template,
+        'final_templates': np.array(final_templates, bool),
+        'mask_planes': mask_planes,
+    }
+
+
+def ecc_many(data, blocks):
+    '''
+    data: N x total data codewords, return N x all codewords (data blocks then ecc blocks)
+    '''
+    table = gf_mul_table()
+    parts = [data]
+    offset = 0
+    for block in blocks:
+        err_cnt = block.total_count - block.data_count
+        matrix = parity_matrix(block.data_count, err_cnt)
+        parity = np.zeros((len(data), err_cnt), np.uint8)
+        for i in range(block.data_count):
+            parity ^= table[data[:, offset + i][:, None], matrix[i][None, :]]
+        parts.append(parity)
+        offset += block.data_count
+    return np.concatenate(parts, axis = 1)
+
+def lost_many(stack):
+    '''
+    util.lost_calculator of every matrix in stack (... x S x S), vectorized
+    '''
+    n = stack.shape[-1]
+    points = np.zeros(stack.shape[:-2], np.int64)
+
+    # N1: run of L >= 5 -> L + N1 - 5 = (L - 4) windows of 5 + (N1 - 1) per run
+    for lines in (stack, np.swapaxes(stack, -1, -2)):
+        same = lines[..., 1:] == lines[..., :-1]
+        window = same[..., :-3] & same[..., 1:-2] & same[..., 2:-1] & same[..., 3:]
+        starts = window.copy()
+        starts[..., 1:] &= ~same[..., :-4]
+        points += window.sum(axis = (-1, -2)) + (constants.MASK_EVAL_N1 - 1) * starts.sum(axis = (-1, -2))
+
+    # N2: 2 x 2 blocks of one color
+    top = stack[..., :-1, :-1]
+    block = (top == stack[..., :-1, 1:]) & (top == stack[..., 1:, :-1]) & (top == stack[..., 1:, 1:])
+    points += constants.MASK_EVAL_N2 * block.sum(axis = (-1, -2))
+
+    # N3: 1:1:3:1:1 in rows, and in columns with the same rule as lost_count_3
+    def matches(lines, pattern, length):
+        hit = np.ones(lines.shape[:-1] + (n - 10,), bool)
+        for k in range(length):
+            hit &= lines[..., k:n - 10 + k] == pattern[k]
+        return hit.sum(axis = (-1, -2))
+    columns = np.swapaxes(stack, -1, -2)
+    points += constants.MASK_EVAL_N3 * (
+        matches(stack, PATTERN_1, 11) + matches(stack, PATTERN_2, 11)
+        + matches(columns, PATTERN_1, 10) + matches(columns, PATTERN_2, 11))
+
+    # N4
+    percent = stack.sum(axis = (-1, -2)) / n / n * 100
+    points += constants.MASK_EVAL_N4 * np.floor(np.abs(percent - 50)).astype(np.int64) // 5
+    return points
+
+
+def fit(payload, err_corr, version):
+    '''
+    Version and padded data codewords of one payload, as QRcode.make chooses
+    '''
+    import QRcode
+    q = QRcode.QRcode(version = version, err_corr = err_corr)
+    q.add_data(payload)
+    q.best_fit(start = version)
+    buffer = util.put_segments(q.version, q.segments)
+    util.put_padding(buffer, util.rs_blocks(q.version, err_corr))
+    return q.version, buffer.buffer
+
+def codewords_many(data, version, err_corr):
+    '''
+    data: N x data codewords of one version, return N x final interleaved codewords
+    '''
+    info = layout(version, err_corr)
+    return ecc_many(data, info['blocks'])[:, info['order']]
+
+def make_group(data, version, err_corr, mask_pattern = None):
+    '''
+    data: N x data codewords of one version, return N x S x S bool matrices
+    '''
+    return place_group(codewords_many(data, version, err_corr), version, err_corr, mask_pattern)
+
+def place_group(codewords, version, err_corr, mask_pattern = None):
+    '''
+    codewords: N x final codewords of one version, return N x S x S bool matrices
+    '''
+    info = layout(version, err_corr)
+    modules_cnt = version*4 + 17
+
+    bits = np.unpackbits(codewords, axis = 1)
+    coord_index = info['coord_index'][:bits.shape[1]]
+    unmasked = np.broadcast_to(info['test_template'].ravel(), (len(codewords), modules_cnt**2)).copy()
+    unmasked[:, coord_index] = bits[:, :len(coord_index)].astype(bool)
+    unmasked = unmasked.reshape(len(codewords), modules_cnt, modules_cnt)
+
+    if mask_pattern is None:
+        stack = unmasked[:, None] ^ info['mask_planes'][None]
+        choice = np.argmin(lost_many(stack), axis = 1)
+    else:
+        choice = np.full(len(codewords), mask_pattern)
+
+    masked = unmasked ^ info['mask_planes'][choice]
+    return np.where(info['is_data'], masked, info['final_templates'][choice])
+
+def make_many(payloads, err_corr = constants.ERR_CORR_M, version = None,
+            mask_pattern = None, fmt = None, box_size = 10, border = 4):
+    '''
+    Matrices (S x S bool arrays) of payloads in input order
+    fmt given -> rendered bytes instead (see render.WRITERS)
+    '''
+    fitted = [fit(payload, err_corr, version) for payload in payloads]
+    groups = {}
+    for index, (fitted_version, _) in enumerate(fitted):
+        groups.setdefault(fitted_version, []).append(index)
+
+    results = [None] * len(fitted)
+    for fitted_version, indexes in groups.items():
+        modules_cnt = fitted_version*4 + 17
+        chunk = max(1, BATCH_MEMORY // (8 * 4 * modules_cnt * modules_cnt))
+        for start in range(0, len(indexes), chunk):
+            part = indexes[start:start + chunk]
+            data = np.array([fitted[i][1] for i in part], np.uint8)
+            for i, matrix in zip(part, make_group(data, fitted_version, err_corr, mask_pattern)):
+                results[i] = matrix
+
+    if fmt is not None:
+        import render
+        results = [
+            render.render_bytes(render.MatrixSource(matrix, box_size, border), fmt, box_size)
+            for matrix in results
+        ]
+    return results
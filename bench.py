@@ -0,0 +1,506 @@
+'''
+Benchmarks of the QRcode module
+Usage: python bench.py <name> [options]
+'''
+import argparse
+import time
+
+import constants
+import QRcode
+
+
+def timeit(func, repeat = 3):
+    '''
+    Best wall time of func over repeat runs
+    '''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        cost = time.perf_counter() - start
+        if best is None or cost < best:
+            best = cost
+    return best
+
+def bench_mask(args):
+    '''
+    Serial vs parallel mask evaluation for each version
+    Helps to choose constants.PARALLEL_MASK_VERSION
+    '''
+    import mask_pool
+    mask_pool.get_pool() # start workers outside the timing
+
+    print('version  serial(s)  parallel(s)  speedup')
+    for version in range(args.start, 41, args.step):
+        def make(parallel):
+            q = QRcode.QRcode(version = version, parallel = parallel, engine = 'reference')
+            q.add_data('0123456789' * version)
+            q.make(fit = False)
+        serial = timeit(lambda: make(False), args.repeat)
+        parallel = timeit(lambda: make(True), args.repeat)
+        print('{:7d}  {:9.4f}  {:11.4f}  {:7.2f}'.format(
+            version, serial, parallel, serial / parallel))
+    print('current threshold: version', constants.PARALLEL_MASK_VERSION)
+
+def bench_startup(args):
+    '''
+    Time to get every version template and placement order ready in a fresh process
+    with and without the mmap-ed artifact file
+    '''
+    import os
+    import subprocess
+    import sys
+    import artifacts
+
+    code = (
+        'import time, QRcode; start = time.perf_counter()\n'
+        'for v in range(1, 41):\n'
+        '    QRcode.QRcode(version = v).setup_template(True, None); QRcode.placement_coords(v)\n'
+        'print(time.perf_counter() - start)'
+    )
+    if not os.path.exists(artifacts.DEFAULT_PATH):
+        artifacts.build()
+    for label, path in (('lazy cache', os.devnull + '.missing'), ('artifacts', artifacts.DEFAULT_PATH)):
+        env = dict(os.environ, QRCODE_ARTIFACTS = path)
+        out = subprocess.run([sys.executable, '-c', code], env = env,
+            capture_output = True, text = True, check = True).stdout
+        print('{:12s} {:8.4f}s'.format(label, float(out)))
+
+def bench_vector(args):
+    '''
+    Path count and size of merged vector output vs naive per-module output
+    '''
+    import io
+    import render
+
+    print('version  format  merge  paths  bytes   path-reduction  byte-reduction  time(s)')
+    for version in range(args.start, 41, args.step):
+        q = QRcode.QRcode(version = version, box_size = 4)
+        q.add_data('0123456789' * version)
+        q.make(fit = False)
+        for name, writer in sorted(render.VECTOR_WRITERS.items()):
+            naive = io.BytesIO()
+            naive_paths = writer(q, naive, None)
+            for merge in ('run', 'rect'):
+                out = io.BytesIO()
+                paths = writer(q, out, merge)
+                cost = timeit(lambda: writer(q, io.BytesIO(), merge), args.repeat)
+                print('{:7d}  {:6s}  {:5s}  {:5d}  {:6d}  {:14.1%}  {:14.1%}  {:7.4f}'.format(
+                    version, name, merge, paths, len(out.getvalue()),
+                    1 - paths / naive_paths, 1 - len(out.getvalue()) / len(naive.getvalue()), cost))
+
+def bench_serial(args):
+    '''
+    Serial-number batch: full QRcode.make vs incremental.SerialEncoder
+    '''
+    import incremental
+
+    print('prefix  version  full(codes/s)  incremental(codes/s)  speedup')
+    for prefix in ('SN-', 'https://example.com/p?id=', 'x' * 300):
+        payloads = [prefix + '{:08d}'.format(serial * 7919) for serial in range(args.count)]
+
+        def full():
+            for payload in payloads:
+                q = QRcode.QRcode()
+                q.add_data(payload)
+                q.make()
+
+        def incr():
+            encoder = incremental.SerialEncoder(payloads[0])
+            for payload in payloads:
+                encoder.make(payload)
+
+        version = incremental.SerialEncoder(payloads[0]).version
+        full_cost = timeit(full, args.repeat)
+        incr_cost = timeit(incr, args.repeat)
+        print('{:6d}  {:7d}  {:13.1f}  {:20.1f}  {:7.2f}'.format(len(prefix), version,
+            args.count / full_cost, args.count / incr_cost, full_cost / incr_cost))
+
+def bench_batch(args):
+    '''
+    One QRcode at a time vs QRcode.make_many
+    '''
+    print('payload         count  serial(codes/s)  make_many(codes/s)  speedup')
+    for label, make_payload in (
+            ('numeric id', lambda i: '{:012d}'.format(i * 7919)),
+            ('url', lambda i: 'https://example.com/p?id={:08d}'.format(i)),
+            ('text 200B', lambda i: 'x' * 192 + '{:08d}'.format(i))):
+        payloads = [make_payload(i) for i in range(args.count)]
+
+        def serial():
+            for payload in payloads:
+                q = QRcode.QRcode()
+                q.add_data(payload)
+                q.make()
+
+        serial_cost = timeit(serial, args.repeat)
+        batch_cost = timeit(lambda: QRcode.make_many(payloads), args.repeat)
+        print('{:14s}  {:5d}  {:15.1f}  {:18.1f}  {:7.2f}'.format(label, args.count,
+            args.count / serial_cost, args.count / batch_cost, serial_cost / batch_cost))
+
+
+def bench_stream(args):
+    '''
+    One QRcode at a time vs QRcode.iter_encode, throughput and peak traced memory
+    '''
+    import tracemalloc
+
+    def payloads(count):
+        return ('https://example.com/p?id={:08d}'.format(i) for i in range(count))
+
+    def serial(count):
+        for payload in payloads(count):
+            q = QRcode.QRcode()
+            q.add_data(payload)
+            q.make()
+
+    def stream(count):
+        for _ in QRcode.iter_encode(payloads(count)):
+            pass
+
+    print('method       count  codes/s  peak(KiB)')
+    for label, func in (('serial', serial), ('iter_encode', stream)):
+        for count in (args.count, args.count * 4):
+            cost = timeit(lambda: func(count), args.repeat)
+            tracemalloc.start()
+            func(count)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print('{:11s}  {:5d}  {:7.1f}  {:9.1f}'.format(label, count, count / cost, peak / 1024))
+
+def bench_decode(args):
+    '''
+    Encode vs in-process decode (matrix and PNG) throughput for each version
+    '''
+    import io
+    import decoder
+    import render
+
+    print('version  encode(codes/s)  decode(codes/s)  decode png(codes/s)')
+    for version in range(args.start, 41, args.step):
+        q = QRcode.QRcode(version = version, box_size = 4)
+        q.add_data('0123456789' * version)
+        q.make(fit = False)
+        png = render.render_bytes(q, 'png')
+
+        def encode():
+            for _ in range(args.count):
+                other = QRcode.QRcode(version = version)
+                other.add_data('0123456789' * version)
+                other.make(fit = False)
+
+        def decode():
+            for _ in range(args.count):
+                decoder.decode(q.modules)
+
+        def decode_png():
+            for _ in range(args.count):
+                decoder.decode_png(io.BytesIO(png))
+
+        costs = [timeit(func, args.repeat) for func in (encode, decode, decode_png)]
+        print('{:7d}  {:15.1f}  {:15.1f}  {:19.1f}'.format(version, *(args.count / cost for cost in costs)))
+
+def bench_structured(args):
+    '''
+    Near-limit payload: single symbol vs Structured Append plans, estimated vs measured cost
+    '''
+    import os
+    import structured
+
+    data = bytes(range(32, 127)) * 24 # 2280 bytes, version 40-M as one symbol
+    workers = min(8, os.cpu_count() or 1)
+    chosen = len(structured.split(data, constants.ERR_CORR_M, workers = workers))
+    print('parts  version  area     estimate  time(s)')
+    for parts in (1, 2, 4, 8, 16):
+        chunks = structured.split(data, constants.ERR_CORR_M, parts, workers)
+        versions = structured.fit_parts(chunks, constants.ERR_CORR_M)
+        estimate, area = structured.plan_cost(versions, workers)
+        cost = timeit(lambda: structured.make(data, constants.ERR_CORR_M, parts), args.repeat)
+        print('{:5d}  {:7d}  {:7d}  {:8d}  {:7.3f}{}'.format(parts, max(versions), area, estimate, cost,
+            '  <- chosen' if parts == chosen else ''))
+
+def bench_fountain(args):
+    '''
+    Frames per second of the fountain stream: QRcode per frame vs the fixed-version
+    stream, with mask search and with a fixed mask, then APNG and GIF output
+    '''
+    import io
+    import itertools
+    import animate
+    import fountain
+
+    data = bytes(range(256)) * 64
+    print('version  method                frames/s')
+    for version in (5, 10, 20):
+        def qrcode_frames():
+            encoder = fountain.Encoder(data, version)
+            for packet in itertools.islice(encoder.packets(), args.count):
+                q = QRcode.QRcode(err_corr = constants.ERR_CORR_L)
+                q.add_data(packet)
+                q.make()
+
+        def stream(mask_pattern):
+            for _ in itertools.islice(fountain.frames(data, version, mask_pattern = mask_pattern), args.count):
+                pass
+
+        def apng():
+            animate.write_apng(fountain.frames(data, version, mask_pattern = 0), io.BytesIO(), args.count)
+
+        def gif():
+            animate.write_gif(fountain.frames(data, version, mask_pattern = 0), io.BytesIO(), args.count)
+
+        for label, func in (('QRcode per frame', qrcode_frames), ('stream', lambda: stream(None)),
+                ('stream, fixed mask', lambda: stream(0)), ('apng, fixed mask', apng), ('gif, fixed mask', gif)):
+            print('{:7d}  {:20s}  {:8.1f}'.format(version, label, args.count / timeit(func, args.repeat)))
+
+def bench_compress(args):
+    '''
+    Version and make() time of typical payloads, plain vs QRcode(compress = True)
+    '''
+    import json
+
+    corpus = {
+        'json record': json.dumps({'id': 1024, 'name': 'Alice Smith', 'email': 'alice@example.com',
+            'status': 'active', 'items': [{'code': 'A-1', 'count': 2}, {'code': 'B-7', 'count': 1}]}),
+        'json list': json.dumps([{'id': i, 'name': 'user{}'.format(i), 'status': 'active'} for i in range(20)]),
+        'url': 'https://example.com/products/view.php?id=123456&utm_source=newsletter&utm_medium=email',
+        'text': 'If I rest, I rust. ' * 40,
+        'csv': '\n'.join('{},{},{:.2f}'.format(i, 'item{}'.format(i), i * 1.25) for i in range(60)),
+    }
+    print('payload      bytes  version  compressed  plain(s)  compress(s)  saved')
+    for label, payload in corpus.items():
+        def make(compress):
+            q = QRcode.QRcode(compress = compress)
+            q.add_data(payload)
+            q.make()
+            return q.version
+        versions = make(False), make(True)
+        plain = timeit(lambda: make(False), args.repeat)
+        compressed = timeit(lambda: make(True), args.repeat)
+        print('{:11s}  {:5d}  {:7d}  {:10d}  {:8.4f}  {:11.4f}  {:5.1%}'.format(label, len(payload.encode()),
+            versions[0], versions[1], plain, compressed, 1 - compressed / plain))
+
+def bench_jobstore(args):
+    '''
+    Codes per second of a SQLite job store batch by number of worker processes
+    '''
+    import os
+    import tempfile
+    import jobstore
+
+    payloads = ['SN-{:08d}'.format(i) for i in range(args.count * 10)]
+    print('workers  codes/s  (cpus: {})'.format(os.cpu_count()))
+    for workers in (1, 2, 4):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'jobs.db')
+            jobstore.create(path, 'bench', payloads, os.path.join(tmp, 'out'), chunk_size = 100)
+            start = time.perf_counter()
+            jobstore.run(path, 'bench', workers)
+            cost = time.perf_counter() - start
+        print('{:7d}  {:7.1f}'.format(workers, len(payloads) / cost))
+
+def bench_plan(args):
+    '''
+    Pinned version and mask: QRcode.make(fit = False) per engine vs a compiled plan
+    '''
+    import engines
+    import util
+
+    print('version  ' + '  '.join('{:>9s}'.format(engine) for engine in engines.available()) + '       plan  speedup')
+    for version in range(args.start, 41, args.step):
+        payload = 'x' * (util.BIT_LIMIT_TABLE[constants.ERR_CORR_M][version] // 16)
+
+        def make(engine):
+            q = QRcode.QRcode(version = version, mask_pattern = 3, engine = engine)
+            q.add_data(payload)
+            q.make(fit = False)
+
+        costs = [timeit(lambda: make(engine), args.repeat) for engine in engines.available()]
+        encode = QRcode.compile_plan(version, constants.ERR_CORR_M, 3, constants.EIGHT_BIT_BYTE_MODE)
+        compiled = timeit(lambda: encode(payload), args.repeat)
+        print('{:7d}  '.format(version) + '  '.join('{:9.5f}'.format(cost) for cost in costs)
+            + '  {:9.5f}  {:7.1f}'.format(compiled, min(costs) / compiled))
+
+def bench_micro(args):
+    '''
+    Short numeric IDs: full QR symbols per engine vs Micro QR, make + png render
+    '''
+    import engines
+    import micro
+
+    ids = ['{:08d}'.format(i * 7919) for i in range(args.count)]
+
+    def make(factory):
+        for data in ids:
+            q = factory()
+            q.add_data(data)
+            q.make()
+            q.render('png', 4)
+
+    print('symbol        size  codes/s')
+    for engine in engines.available():
+        cost = timeit(lambda: make(lambda: QRcode.QRcode(engine = engine)), args.repeat)
+        print('{:12s}  {:4d}  {:7.1f}'.format('QR ' + engine, 21, len(ids) / cost))
+    q = micro.make_small(ids[0])
+    cost = timeit(lambda: make(micro.MicroQRcode), args.repeat)
+    print('{:12s}  {:4d}  {:7.1f}'.format('Micro ' + q.name, q.modules_cnt, len(ids) / cost))
+
+def bench_sink(args):
+    '''
+    Rendering with a synchronous write (and fsync) per file vs the background sinks
+    '''
+    import os
+    import shutil
+    import tempfile
+    import sink
+
+    payloads = ['https://example.com/p?id={:08d}'.format(i) for i in range(args.count * 2)]
+
+    def synchronous(target, fsync):
+        for index, image in enumerate(QRcode.iter_encode(payloads, fmt = 'png', box_size = 4)):
+            if not os.path.exists(target):
+                os.mkdir(target)
+            with open(os.path.join(target, '{:08d}.png'.format(index)), 'wb') as f:
+                f.write(image)
+                if fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def render_only(target, fsync):
+        for _ in QRcode.iter_encode(payloads, fmt = 'png', box_size = 4):
+            pass
+
+    def background(extension):
+        return lambda target, fsync: sink.save_many(payloads, target + extension, fsync = fsync, box_size = 4)
+
+    print('writer       fsync  codes/s')
+    for label, func in (('render only', render_only), ('per file', synchronous),
+            ('directory', background('')), ('tar', background('.tar')),
+            ('zip', background('.zip')), ('pack', background('.pack'))):
+        for fsync in (False, True):
+            costs = []
+            for _ in range(args.repeat):
+                tmp = tempfile.mkdtemp()
+                start = time.perf_counter()
+                func(os.path.join(tmp, 'out'), fsync)
+                costs.append(time.perf_counter() - start)
+                shutil.rmtree(tmp)
+            print('{:11s}  {:5s}  {:7.1f}'.format(label, str(fsync), len(payloads) / min(costs)))
+
+def bench_packers(args):
+    '''
+    Numeric and alphanumeric segment bits: field by field vs packers (LUT, numpy)
+    '''
+    import random
+    import packers
+    import util
+
+    def fields(mode, data):
+        buffer = util.BitBuffer()
+        if mode == constants.NUMERIC_MODE:
+            for i in range(0, len(data), 3):
+                chars = data[i:i+3]
+                buffer.put(int(chars), constants.NUMBER_LENGTH[len(chars)])
+        else:
+            for i in range(0, len(data), 2):
+                chars = data[i:i+2]
+                if len(chars) > 1:
+                    buffer.put(constants.ALPHANUMERIC_NUM.find(chars[0]) * 45
+                        + constants.ALPHANUMERIC_NUM.find(chars[1]), 11)
+                else:
+                    buffer.put(constants.ALPHANUMERIC_NUM.find(chars[0]), 6)
+        return buffer
+
+    rng = random.Random(0)
+    numpy_min = packers.NUMPY_MIN
+    print('mode          chars  fields(us)     lut(us)   numpy(us)')
+    for mode, alphabet in ((constants.NUMERIC_MODE, b'0123456789'),
+            (constants.ALPHANUMERIC_MODE, constants.ALPHANUMERIC_NUM)):
+        for length in (8, 16, 64, 256, 1024, 4096):
+            data = bytes(rng.choice(alphabet) for _ in range(length))
+            loops = max(1, 20000 // length)
+            base = timeit(lambda: [fields(mode, data) for _ in range(loops)], args.repeat) / loops
+            packers.NUMPY_MIN = 1 << 30
+            lut = timeit(lambda: [packers.pack(mode, data) for _ in range(loops)], args.repeat) / loops
+            packers.NUMPY_MIN = 0
+            vector = timeit(lambda: [packers.pack(mode, data) for _ in range(loops)], args.repeat) / loops
+            packers.NUMPY_MIN = numpy_min
+            print('{:12s}  {:5d}  {:10.1f}  {:10.1f}  {:10.1f}'.format(
+                'numeric' if mode == constants.NUMERIC_MODE else 'alphanumeric', length,
+                base * 1e6, lut * 1e6, vector * 1e6))
+
+def bench_scan(args):
+    '''
+    Image reader on a sheet of 24 codes: clean page, a degraded scan (low contrast, blur,
+    noise) and the page rotated by 30 and 60 degrees
+    '''
+    import numpy as np
+    import scan
+    import sheet
+
+    page = sheet.Sheet(columns = 4, rows = 6, cell = 300, caption_size = 0)
+    payloads = ['PROOF-{:04d}-'.format(i) + '0123456789' * (i % 9) for i in range(page.columns * page.rows)]
+    for payload in payloads:
+        q = QRcode.QRcode()
+        q.add_data(payload)
+        q.make()
+        page.add(q)
+    clean = page.pixels.copy()
+
+    # contrast 60-200, 3x3 box blur, gaussian noise
+    values = 60 + clean / 255 * 140
+    values = sum(np.roll(np.roll(values, dy, 0), dx, 1) for dy in (-1, 0, 1) for dx in (-1, 0, 1)) / 9
+    values += np.random.default_rng(0).normal(0, 10, values.shape)
+    degraded = np.clip(values, 0, 255).astype(np.uint8)
+    pages = [('clean', clean), ('degraded', degraded)]
+
+    # rotated about the center onto a light canvas, nearest pixel
+    side = int(np.hypot(page.width, page.height)) + 1
+    y, x = np.mgrid[0:side, 0:side] - (side - 1) / 2
+    for degrees in (30, 60):
+        angle = np.radians(degrees)
+        source_x = np.rint(np.cos(angle) * x + np.sin(angle) * y + (page.width - 1) / 2).astype(int)
+        source_y = np.rint(-np.sin(angle) * x + np.cos(angle) * y + (page.height - 1) / 2).astype(int)
+        inside = (source_x >= 0) & (source_x < page.width) & (source_y >= 0) & (source_y < page.height)
+        rotated = np.full((side, side), sheet.LIGHT, np.uint8)
+        rotated[inside] = clean[source_y[inside], source_x[inside]]
+        pages.append(('rotated {}'.format(degrees), rotated))
+
+    print('page        size        read  binarize(ms)  pages/s  codes/s')
+    for name, pixels in pages:
+        found = scan.scan(pixels)
+        expected = set(p.encode('ascii') for p in payloads)
+        read = len(expected.intersection(f.result.data for f in found))
+        binarize = timeit(lambda: scan.binarize(pixels), args.repeat)
+        cost = timeit(lambda: scan.scan(pixels), args.repeat)
+        print('{:10s}  {:9s}  {:2d}/{:2d}  {:12.1f}  {:7.2f}  {:7.1f}'.format(name,
+            '{}x{}'.format(pixels.shape[1], pixels.shape[0]), read, len(payloads), binarize * 1000, 1 / cost, read / cost))
+
+BENCHES = {
+    'mask': bench_mask,
+    'startup': bench_startup,
+    'vector': bench_vector,
+    'serial': bench_serial,
+    'batch': bench_batch,
+    'stream': bench_stream,
+    'decode': bench_decode,
+    'structured': bench_structured,
+    'fountain': bench_fountain,
+    'compress': bench_compress,
+    'jobstore': bench_jobstore,
+    'plan': bench_plan,
+    'micro': bench_micro,
+    'sink': bench_sink,
+    'packers': bench_packers,
+    'scan': bench_scan,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'QRcode benchmarks')
+    parser.add_argument('name', choices = sorted(BENCHES))
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--start', type = int, default = 1)
+    parser.add_argument('--step', type = int, default = 4)
+    parser.add_argument('--count', type = int, default = 200)
+    args = parser.parse_args()
+    BENCHES[args.name](args)
@@ -0,0 +1,107 @@
+'''
+Opt-in transparent compression of byte payloads (QRcode(compress = True))
+The data of a symbol holding a byte-mode segment is deflated, with and without a
+small preset dictionary, and the shortest form is used only when it lowers the
+version. Compressed payloads start with an application-level header:
+    0xFF 'Q' 'Z' method
+0xFF never starts UTF-8 text, but binary payloads can start with the header, so
+decoding is opt-in too: only symbols made with compress = True are decompressed, and
+those encode data starting with the header compressed even when it does not shrink.
+
+    data = decoder.decode(modules, compressed = True).data
+'''
+import zlib
+
+import constants
+import util
+
+
+MAGIC = b'\xffQZ'
+DEFLATE = b'd'
+PRESET = b'p'
+
+# common tokens of JSON, URLs and text, most frequent last (closest to the data)
+PRESET_DICT = (
+    b' the and of to in is for on with that this from'
+    b'true false null 0123456789'
+    b'.html .php .json ?id= &id= utm_source= www. .com/ .org/ http://'
+    b'"type": "name": "value": "data": "id": "user": "email": "date": "time": '
+    b'"status": "url": "text": "title": "price": "count": "items": "code": '
+    b'https://'
+)
+
+
+def deflate(data, zdict = None):
+    if zdict is None:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    else:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict = zdict)
+    return compressor.compress(data) + compressor.flush()
+
+def decompress(data):
+    '''
+    Original bytes of a payload made with compression, plain payloads returned as they are
+    Only for symbols made with compress = True, other binary data may start with MAGIC
+    '''
+    if not data.startswith(MAGIC):
+        return data
+    method, body = data[3:4], data[4:]
+    if method == DEFLATE:
+        return zlib.decompressobj(-15).decompress(body)
+    elif method == PRESET:
+        return zlib.decompressobj(-15, zdict = PRESET_DICT).decompress(body)
+    raise ValueError('Unknown compression method {!r}'.format(method))
+
+def smallest(data):
+    '''
+    Shortest compressed form of data, or data itself if none is shorter
+    Data starting with MAGIC is always compressed, decompress would misread it
+    '''
+    best = min(candidates(data), key = len)
+    return best if len(best) < len(data) or data.startswith(MAGIC) else data
+
+def candidates(data):
+    '''
+    Compressed forms of data with their header
+    '''
+    return [
+        MAGIC + DEFLATE + deflate(data),
+        MAGIC + PRESET + deflate(data, PRESET_DICT),
+    ]
+
+def fit(data_list, err_corr, start = None):
+    '''
+    Version QRcode.best_fit chooses for data_list
+    '''
+    import QRcode
+    q = QRcode.QRcode(err_corr = err_corr)
+    q.data_list = list(data_list)
+    return q.best_fit(start = start)
+
+def compress_segments(data_list, err_corr, start = None):
+    '''
+    data_list, or one compressed byte segment if that gives a lower version
+    Only lists holding a byte-mode segment are tried; the whole data is compressed
+    so that the decoded payload is one header and one deflate stream.
+    Lists with a Structured Append header are left alone, structured.make compresses
+    the whole payload before splitting it.
+    '''
+    if any(isinstance(data, util.StructuredAppend) for data in data_list):
+        return data_list
+    if not any(data.mode == constants.EIGHT_BIT_BYTE_MODE for data in data_list):
+        return data_list
+    try:
+        version = fit(data_list, err_corr, start)
+    except OverflowError:
+        version = 41
+    data = b''.join(data.data for data in data_list)
+    best = min(candidates(data), key = len)
+    segment = util.QRData(best, constants.EIGHT_BIT_BYTE_MODE)
+    if data.startswith(MAGIC):
+        return [segment] # plain, decompress would misread it
+    try:
+        if fit([segment], err_corr, start) < version:
+            return [segment]
+    except OverflowError:
+        pass
+    return data_list
@@ -11,6 +11,7 @@ NUMERIC_MODE = 1 << 0
 ALPHANUMERIC_MODE = 1 << 1
 EIGHT_BIT_BYTE_MODE = 1 << 2
 KANJI_MODE= 1 << 3
+STRUCTURED_APPEND_MODE = NUMERIC_MODE | ALPHANUMERIC_MODE # header, not a data mode
 
 MODE_INDICATORS = (NUMERIC_MODE,
                 ALPHANUMERIC_MODE,
@@ -26,6 +27,7 @@ MODE_SIZE_SMALL = {
     ALPHANUMERIC_MODE: 9, # alphanumeric data (digits 0-9; upper case letter A-Z; none other characters: \space, $%*_-./:)
     EIGHT_BIT_BYTE_MODE: 8, # 8-bit byte data
     KANJI_MODE: 8, # 13-bit Kanji characters
+    STRUCTURED_APPEND_MODE: 0, # no character count
 }
 MODE_SIZE_MEDIUM = {
     # 10 to 26
@@ -33,6 +35,7 @@ MODE_SIZE_MEDIUM = {
     ALPHANUMERIC_MODE: 11,
     EIGHT_BIT_BYTE_MODE: 16,
     KANJI_MODE: 10,
+    STRUCTURED_APPEND_MODE: 0, # no character count
 }
 MODE_SIZE_LARGE = {
     # 27 to 40
@@ -40,6 +43,7 @@ MODE_SIZE_LARGE = {
     ALPHANUMERIC_MODE: 13,
     EIGHT_BIT_BYTE_MODE: 16,
     KANJI_MODE: 12,
+    STRUCTURED_APPEND_MODE: 0, # no character count
 }
 
 # The number of bits for numeric delimited data lengths.
@@ -350,6 +354,24 @@ G18 = (
     (1 << 2) | (1 << 0))
 G15_MASK = (1 << 14) | (1 << 12) | (1 << 10) | (1 << 4) | (1 << 1)
 
+# Micro QR (M1-M4)
+# character count bits per version M1..M4, None if the mode is not allowed
+MICRO_MODE_SIZE = {
+    NUMERIC_MODE: (3, 4, 5, 6),
+    ALPHANUMERIC_MODE: (None, 3, 4, 5),
+    EIGHT_BIT_BYTE_MODE: (None, None, 4, 5),
+    KANJI_MODE: (None, None, 3, 4),
+}
+# mode indicator values, written in version - 1 bits
+MICRO_MODE_INDICATORS = {
+    NUMERIC_MODE: 0,
+    ALPHANUMERIC_MODE: 1,
+    EIGHT_BIT_BYTE_MODE: 2,
+    KANJI_MODE: 3,
+}
+MICRO_MASKS = (1, 4, 6, 7) # QR mask pattern of Micro QR masks 00-11
+G15_MICRO_MASK = (1 << 14) | (1 << 10) | (1 << 6) | (1 << 2) | (1 << 0)
+
 PAD0 = 0xEC
 PAD1 = 0x11
 
@@ -383,4 +405,10 @@ rsPoly = {
 MASK_EVAL_N1 = 3
 MASK_EVAL_N2 = 3
 MASK_EVAL_N3 = 40
-MASK_EVAL_N4 = 10
\ No newline at end of file
+MASK_EVAL_N4 = 10
+
+# Lowest version whose mask patterns are evaluated in parallel processes
+PARALLEL_MASK_VERSION = 25
+
+# Structured Append: at most 16 symbols, position and total in 4 bits each
+MAX_STRUCTURED_APPEND = 16
@@ -0,0 +1,429 @@
+'''
+In-process QR decoder for round-trip checks
+Reads a module matrix (or a clean PNG written by render.write_png): format info,
+unmask, de-interleave per util.rs_blocks, Reed-Solomon decoding
+(syndromes, Berlekamp-Massey, Chien search, Forney) and segment parsing.
+
+    result = decoder.decode(q.modules)
+    result.data, result.errors
+'''
+import struct
+import zlib
+from collections import namedtuple
+from functools import lru_cache
+from operator import add
+
+import constants
+import util
+
+
+class DecodeError(ValueError):
+    pass
+
+class Decoded(namedtuple('Decoded', 'version err_corr mask_pattern segments data errors structured_append')):
+    '''
+    segments: util.QRData list, data: their bytes joined, errors: corrected codewords
+    structured_append: util.StructuredAppend header or None
+    '''
+    __slots__ = ()
+
+
+# GF(256) arithmetic over util.exponents / util.log
+def _mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return util.exponents[(util.log[a] + util.log[b]) % 255]
+
+def _div(a, b):
+    if a == 0:
+        return 0
+    return util.exponents[(util.log[a] - util.log[b]) % 255]
+
+def _eval(poly, x):
+    '''
+    poly lowest degree first
+    '''
+    y = 0
+    for coef in reversed(poly):
+        y = _mul(y, x) ^ coef
+    return y
+
+
+def syndromes(codewords, err_cnt):
+    '''
+    S_i = c(a^i), c with codewords[0] as the highest degree coefficient
+    '''
+    result = []
+    for i in range(err_cnt):
+        x = util.exponents[i]
+        y = 0
+        for coef in codewords:
+            y = _mul(y, x) ^ coef
+        result.append(y)
+    return result
+
+def berlekamp_massey(synd):
+    '''
+    Error locator polynomial, lowest degree first
+    '''
+    locator, prev = [1], [1]
+    errors, shift, prev_d = 0, 1, 1
+    for n in range(len(synd)):
+        d = synd[n]
+        for i in range(1, errors + 1):
+            d ^= _mul(locator[i], synd[n - i])
+        if d == 0:
+            shift += 1
+            continue
+        scale = _div(d, prev_d)
+        update = [0] * shift + [_mul(scale, coef) for coef in prev]
+        new = [a ^ b for a, b in zip(locator + [0] * (len(update) - len(locator)),
+            update + [0] * (len(locator) - len(update)))]
+        if 2 * errors <= n:
+            prev, prev_d = locator, d
+            errors = n + 1 - errors
+            shift = 1
+        else:
+            shift += 1
+        locator = new
+    return locator[:errors + 1], errors
+
+def rs_correct(codewords, err_cnt):
+    '''
+    Correct one block in place, return the number of corrected codewords
+    '''
+    synd = syndromes(codewords, err_cnt)
+    if not any(synd):
+        return 0
+    locator, errors = berlekamp_massey(synd)
+    if 2 * errors > err_cnt:
+        raise DecodeError('Too many errors')
+
+    # Chien search: locator(a^-p) == 0 -> error at degree p
+    n = len(codewords)
+    positions = [p for p in range(n) if _eval(locator, util.exponents[(255 - p) % 255]) == 0]
+    if len(positions) != errors:
+        raise DecodeError('Uncorrectable block')
+
+    # Forney: e = X * omega(X^-1) / locator'(X^-1), first root a^0
+    omega = [0] * err_cnt
+    for i, s in enumerate(synd):
+        for j, coef in enumerate(locator):
+            if i + j < err_cnt:
+                omega[i + j] ^= _mul(s, coef)
+    derivative = [locator[i] if i % 2 == 1 else 0 for i in range(1, len(locator))]
+    for p in positions:
+        x = util.exponents[p]
+        x_inv = util.exponents[(255 - p) % 255]
+        magnitude = _mul(x, _div(_eval(omega, x_inv), _eval(derivative, x_inv)))
+        codewords[n - 1 - p] ^= magnitude
+
+    if any(syndromes(codewords, err_cnt)):
+        raise DecodeError('Uncorrectable block')
+    return errors
+
+
+def _format_bits(modules):
+    '''
+    Both copies of the type info, bit order of QRcode.setup_type_info
+    '''
+    modules_cnt = len(modules)
+    vertical = horizontal = 0
+    for i in range(15):
+        if i < 6:
+            r = i
+        elif i < 8:
+            r = i + 1
+        else:
+            r = modules_cnt - 15 + i
+        vertical |= bool(modules[r][8]) << i
+        if i < 8:
+            c = modules_cnt - i - 1
+        elif i < 9:
+            c = 15 - i
+        else:
+            c = 15 - i - 1
+        horizontal |= bool(modules[8][c]) << i
+    return vertical, horizontal
+
+def read_format(modules):
+    '''
+    (err_corr, mask_pattern) of the nearest valid type info, up to 3 bit errors
+    '''
+    best, distance = None, 4
+    for copy in _format_bits(modules):
+        for info, code in enumerate(_format_codes()):
+            d = bin(copy ^ code).count('1')
+            if d < distance:
+                best, distance = info, d
+    if best is None:
+        raise DecodeError('Unreadable type info')
+    return best >> 3, best & 7
+
+@lru_cache(maxsize = None)
+def _format_codes():
+    return tuple(util.BCH_code_generator(info) for info in range(32))
+
+@lru_cache(maxsize = None)
+def _mask_bits(version, mask_pattern):
+    import QRcode
+    mask_func = util.mask_function(mask_pattern)
+    return tuple(bool(mask_func(r, c)) for r, c in QRcode.placement_coords(version))
+
+def read_codewords(modules, version, mask_pattern):
+    '''
+    Unmasked codewords in placement order
+    '''
+    import QRcode
+    coords = QRcode.placement_coords(version)
+    mask_bits = _mask_bits(version, mask_pattern)
+    data = bytearray(len(coords) // 8)
+    for k in range(len(data) * 8):
+        r, c = coords[k]
+        if bool(modules[r][c]) != mask_bits[k]:
+            data[k >> 3] |= 0x80 >> (k & 7)
+    return data
+
+def deinterleave(codewords, blocks):
+    '''
+    Split final codewords into [data + ecc] of every block
+    '''
+    data = [[] for _ in blocks]
+    ecc = [[] for _ in blocks]
+    index = 0
+    for table, counts in ((data, [block.data_count for block in blocks]),
+            (ecc, [block.total_count - block.data_count for block in blocks])):
+        for i in range(max(counts)):
+            for r, count in enumerate(counts):
+                if i < count:
+                    table[r].append(codewords[index])
+                    index += 1
+    return [d + e for d, e in zip(data, ecc)]
+
+
+class BitReader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def remaining(self):
+        return len(self.data) * 8 - self.pos
+
+    def get(self, length):
+        if length > self.remaining():
+            raise DecodeError('Truncated segment')
+        value = 0
+        for _ in range(length):
+            value = (value << 1) | ((self.data[self.pos >> 3] >> (7 - (self.pos & 7))) & 1)
+            self.pos += 1
+        return value
+
+def parse_segments(data, version):
+    '''
+    util.QRData segments (and util.StructuredAppend header) of the corrected data codewords
+    '''
+    reader = BitReader(data)
+    bits_number = util.bits_number_for_version(version)
+    segments = []
+    while reader.remaining() >= 4:
+        mode = reader.get(4)
+        if mode == 0: # terminator
+            break
+        if mode == constants.STRUCTURED_APPEND_MODE:
+            segments.append(util.StructuredAppend(reader.get(4), reader.get(4) + 1, reader.get(8)))
+            continue
+        if mode not in (constants.NUMERIC_MODE, constants.ALPHANUMERIC_MODE,
+                constants.EIGHT_BIT_BYTE_MODE):
+            raise DecodeError('Unsupported mode {}'.format(mode))
+        count = reader.get(bits_number[mode])
+        if mode == constants.NUMERIC_MODE:
+            chars = []
+            for i in range(0, count, 3):
+                size = min(3, count - i)
+                chars.append('{:0{}d}'.format(reader.get(constants.NUMBER_LENGTH[size]), size))
+            payload = ''.join(chars).encode('ascii')
+        elif mode == constants.ALPHANUMERIC_MODE:
+            chars = []
+            for i in range(0, count, 2):
+                if count - i > 1:
+                    value = reader.get(11)
+                    chars.append(constants.ALPHANUMERIC_NUM[value // 45])
+                    chars.append(constants.ALPHANUMERIC_NUM[value % 45])
+                else:
+                    chars.append(constants.ALPHANUMERIC_NUM[reader.get(6)])
+            payload = bytes(chars)
+        else:
+            payload = bytes(reader.get(8) for _ in range(count))
+        segments.append(util.QRData(payload, mode))
+    return segments
+
+
+def decode(modules, compressed = False):
+    '''
+    Decode a module matrix (list of rows or 2-d array, no border)
+    compressed: symbol made with QRcode(compress = True), data is decompressed
+    '''
+    modules_cnt = len(modules)
+    version = (modules_cnt - 17) // 4
+    if version < 1 or version > 40 or version*4 + 17 != modules_cnt:
+        raise DecodeError('Invalid matrix size {}'.format(modules_cnt))
+    err_corr, mask_pattern = read_format(modules)
+    blocks = util.rs_blocks(version, err_corr)
+
+    errors = 0
+    data = []
+    for block, codewords in zip(blocks, deinterleave(read_codewords(modules, version, mask_pattern), blocks)):
+        errors += rs_correct(codewords, block.total_count - block.data_count)
+        data.extend(codewords[:block.data_count])
+
+    segments = parse_segments(data, version)
+    header = next((segment for segment in segments if isinstance(segment, util.StructuredAppend)), None)
+    segments = [segment for segment in segments if isinstance(segment, util.QRData)]
+    data = b''.join(segment.data for segment in segments)
+    if compressed:
+        data = _decompress(data)
+    return Decoded(version, err_corr, mask_pattern, segments, data, errors, header)
+
+def _decompress(data):
+    import compress
+    try:
+        return compress.decompress(data)
+    except (ValueError, zlib.error) as e:
+        raise DecodeError('Invalid compressed payload: {}'.format(e))
+
+def join(results, compressed = False):
+    '''
+    Data of a complete set of Structured Append symbols (Decoded, any order)
+    compressed: made with QRcode.make_structured(compress = True), data is decompressed
+    '''
+    parts = {}
+    for result in results:
+        header = result.structured_append
+        if header is None:
+            raise DecodeError('Not a Structured Append symbol')
+        parts[header.index] = result
+    first = next(iter(parts.values())).structured_append
+    if sorted(parts) != list(range(first.total)):
+        raise DecodeError('Missing symbols')
+    if any(result.structured_append.parity != first.parity for result in parts.values()):
+        raise DecodeError('Symbols of different sets')
+    data = b''.join(parts[i].data for i in range(first.total))
+    if util.parity(data) != first.parity:
+        raise DecodeError('Parity mismatch')
+    return _decompress(data) if compressed else data
+
+def verify(modules, payload, compressed = False):
+    '''
+    True if modules decode to payload (str or bytes)
+    '''
+    if not isinstance(payload, bytes):
+        payload = payload.encode('utf-8')
+    try:
+        return decode(modules, compressed).data == payload
+    except DecodeError:
+        return False
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+CHANNELS = {0: 1, 2: 3, 4: 2, 6: 4} # PNG color type -> samples per pixel
+
+def read_png_rows(f):
+    '''
+    (width, height, bit_depth, channels, rows) of a non-interlaced PNG (binary file f),
+    8-bit gray/RGB(A) or 1-bit gray; rows: unfiltered scanlines as bytearrays
+    '''
+    if f.read(8) != PNG_SIGNATURE:
+        raise DecodeError('Not a PNG file')
+    idat = []
+    while True:
+        length, kind = struct.unpack('>I4s', f.read(8))
+        chunk = f.read(length)
+        f.read(4) # crc
+        if kind == b'IHDR':
+            width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', chunk)
+        elif kind == b'IDAT':
+            idat.append(chunk)
+        elif kind == b'IEND':
+            break
+    if interlace or color_type not in CHANNELS or (bit_depth != 8 and (color_type, bit_depth) != (0, 1)):
+        raise DecodeError('Unsupported PNG (color type {}, bit depth {})'.format(color_type, bit_depth))
+
+    channels = CHANNELS[color_type]
+    raw = zlib.decompress(b''.join(idat))
+    stride = (width * channels * bit_depth + 7) // 8
+    rows = []
+    prev = bytearray(stride)
+    for y in range(height):
+        start = y * (stride + 1)
+        line = bytearray(raw[start + 1:start + 1 + stride])
+        _unfilter(raw[start], line, prev, channels if bit_depth == 8 else 1)
+        rows.append(line)
+        prev = line
+    return width, height, bit_depth, channels, rows
+
+def read_png(f):
+    '''
+    Module matrix of a grayscale PNG written by render.write_png (binary file f)
+    '''
+    width, height, bit_depth, channels, rows = read_png_rows(f)
+    if channels != 1:
+        raise DecodeError('Only 1/8-bit grayscale PNG is supported')
+    pixels = []
+    for line in rows:
+        if bit_depth == 1:
+            bits = bin(int.from_bytes(line, 'big'))[2:].zfill(len(line) * 8)
+            pixels.append([bit == '0' for bit in bits[:width]])
+        else:
+            pixels.append([value < 128 for value in line])
+    return sample(pixels)
+
+def _unfilter(kind, line, prev, bpp = 1):
+    '''
+    Undo the PNG filter of one scanline in place, bpp bytes per pixel
+    '''
+    if kind == 0:
+        return
+    if kind == 2:
+        line[:] = bytes(map((0xff).__and__, map(add, line, prev)))
+        return
+    for i in range(len(line)):
+        left = line[i - bpp] if i >= bpp else 0
+        if kind == 1:
+            line[i] = (line[i] + left) & 0xff
+        elif kind == 3:
+            line[i] = (line[i] + ((left + prev[i]) >> 1)) & 0xff
+        elif kind == 4:
+            up_left = prev[i - bpp] if i >= bpp else 0
+            p = left + prev[i] - up_left
+            pa, pb, pc = abs(p - left), abs(p - prev[i]), abs(p - up_left)
+            predictor = left if pa <= pb and pa <= pc else prev[i] if pb <= pc else up_left
+            line[i] = (line[i] + predictor) & 0xff
+
+def sample(pixels):
+    '''
+    Module matrix of an axis-aligned, unscaled-by-interpolation dark-is-True pixel grid
+    Box size from the top edge of the upper-left finder pattern (7 modules)
+    '''
+    top = next((y for y, row in enumerate(pixels) if any(row)), None)
+    if top is None:
+        raise DecodeError('No symbol found')
+    row = pixels[top]
+    left = row.index(True)
+    run = 0
+    while left + run < len(row) and row[left + run]:
+        run += 1
+    box_size = run // 7
+    if box_size == 0 or run != 7 * box_size:
+        raise DecodeError('No finder pattern found')
+    right = len(row) - 1 - row[::-1].index(True)
+    modules_cnt = (right - left + 1) // box_size
+    if top + modules_cnt * box_size > len(pixels):
+        raise DecodeError('Symbol cut off at the bottom')
+    half = box_size // 2
+    return [
+        [pixels[top + r*box_size + half][left + c*box_size + half] for c in range(modules_cnt)]
+        for r in range(modules_cnt)
+    ]
+
+def decode_png(f):
+    return decode(read_png(f))
@@ -0,0 +1,95 @@
+'''
+Differential check of the engines in engines.py
+Random payloads over all versions, modes and error correction levels go through every
+available engine; matrices and mask choices (read back from the type info) must be
+identical to the reference engine. Relative throughput is reported per engine.
+Usage: python differential.py [--count 200] [--seed 0]
+'''
+import argparse
+import random
+import time
+
+import constants
+import decoder
+import engines
+import stream
+import util
+import QRcode
+
+
+CHARSETS = {
+    constants.NUMERIC_MODE: '0123456789',
+    constants.ALPHANUMERIC_MODE: constants.ALPHANUMERIC_NUM.decode('ascii'),
+    constants.EIGHT_BIT_BYTE_MODE: 'abcxyz{}":,!é中',
+}
+ERR_CORRS = (constants.ERR_CORR_L, constants.ERR_CORR_M, constants.ERR_CORR_Q, constants.ERR_CORR_H)
+
+
+def max_length(mode, version, err_corr):
+    '''
+    Most characters of mode that fit version (byte mode counted in bytes)
+    '''
+    bits = util.BIT_LIMIT_TABLE[err_corr][version] - 4 - util.bits_number_for_version(version)[mode]
+    length = bits // 8 if mode == constants.EIGHT_BIT_BYTE_MODE else bits * 3 // 10 + 1
+    while length > 0 and stream.data_bits(mode, length) > bits:
+        length -= 1
+    return length
+
+def random_case(rng):
+    '''
+    (payload, version, err_corr, mask_pattern, fit) drawn over all versions and modes
+    '''
+    version = rng.randint(1, 40)
+    err_corr = rng.choice(ERR_CORRS)
+    mode = rng.choice(sorted(CHARSETS))
+    length = rng.randint(1, max(1, max_length(mode, version, err_corr)))
+    payload = ''.join(rng.choice(CHARSETS[mode]) for _ in range(length))
+    if mode == constants.EIGHT_BIT_BYTE_MODE:
+        payload = payload.encode('utf-8')[:length]
+        payload = payload.decode('utf-8', 'ignore').encode('utf-8') or b'a'
+    mask_pattern = rng.choice([None] * 3 + list(range(8)))
+    return payload, version, err_corr, mask_pattern, rng.random() < 0.2
+
+def make(engine, payload, version, err_corr, mask_pattern, fit):
+    q = QRcode.QRcode(version = version, err_corr = err_corr, mask_pattern = mask_pattern, engine = engine)
+    q.add_data(payload)
+    q.make(fit = fit)
+    return q.modules
+
+def run(count = 200, seed = 0, names = None):
+    '''
+    Compare every engine with the reference, return {engine: seconds}
+    Timing is a second pass over the same cases, once per-version tables are warm
+    '''
+    names = names or engines.available()
+    rng = random.Random(seed)
+    cases = [random_case(rng) for _ in range(count)]
+    for i, case in enumerate(cases):
+        results = {engine: make(engine, *case) for engine in names}
+        expected = results['reference']
+        expected_mask = decoder.read_format(expected)[1]
+        for engine, modules in results.items():
+            if modules != expected:
+                raise AssertionError('case {} {!r}: {} matrix differs from reference'.format(i, case[1:], engine))
+            if decoder.read_format(modules)[1] != expected_mask:
+                raise AssertionError('case {} {!r}: {} mask differs from reference'.format(i, case[1:], engine))
+
+    costs = {}
+    for engine in names:
+        start = time.perf_counter()
+        for case in cases:
+            make(engine, *case)
+        costs[engine] = time.perf_counter() - start
+    return costs
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Differential check of QRcode engines')
+    parser.add_argument('--count', type = int, default = 200)
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+
+    costs = run(args.count, args.seed)
+    print('{} cases identical across {}'.format(args.count, ', '.join(costs)))
+    print('engine     codes/s  relative')
+    for engine, cost in costs.items():
+        print('{:9s}  {:7.1f}  {:8.2f}'.format(engine, args.count / cost, costs['reference'] / cost))
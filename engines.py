@@ -0,0 +1,70 @@
+'''
+Engine backends behind QRcode.make (QRcode(engine = ...))
+    reference: QRcode.makeImpl per mask and util.lost_calculator, the original code
+    python:    stream.StreamEncoder, pure Python with reused scratch and one placement pass
+    numpy:     batch.place_group, vectorized placement, masking and scoring
+    auto:      numpy when installed, else python; reference when parallel = True
+None keeps the reference engine, the fast engines are opt-in.
+All engines give the same matrix, see differential.py.
+'''
+import threading
+from functools import lru_cache
+from importlib.util import find_spec
+
+import util
+
+
+ENGINES = ('reference', 'python', 'numpy')
+
+_local = threading.local() # encoders: err_corr -> stream.StreamEncoder, scratch kept per thread
+
+@lru_cache(maxsize = None)
+def available():
+    '''
+    Engines usable with the installed packages
+    '''
+    return tuple(engine for engine in ENGINES if engine != 'numpy' or find_spec('numpy') is not None)
+
+def resolve(engine = None, parallel = None):
+    '''
+    Engine name for an engine option, None -> reference, 'auto' picks from what is installed
+    '''
+    if engine is None:
+        return 'reference'
+    if engine == 'auto':
+        if parallel:
+            return 'reference' # the mask_pool processes belong to the reference engine
+        return 'numpy' if 'numpy' in available() else 'python'
+    if engine not in ENGINES:
+        raise ValueError('Unknown engine {!r}, expected one of {}'.format(engine, ENGINES))
+    if engine not in available():
+        raise ImportError('Engine {!r} needs numpy'.format(engine))
+    return engine
+
+def make(engine, version, err_corr, data_list, mask_pattern = None):
+    '''
+    (modules, final codewords) of data_list at version with a non-reference engine
+    '''
+    if mask_pattern is not None:
+        util.mask_function(mask_pattern) # TypeError as the reference engine
+
+    if engine == 'python':
+        import stream
+        encoders = _local.__dict__.setdefault('encoders', {})
+        if err_corr not in encoders:
+            encoders[err_corr] = stream.StreamEncoder(err_corr)
+        encoder = encoders[err_corr]
+        encoder.mask_pattern = mask_pattern
+        modules = util.copy_mat(encoder.place(version, data_list))
+        return modules, list(encoder.scratch[version].codewords)
+
+    elif engine == 'numpy':
+        import numpy as np
+        import batch
+        buffer = util.put_segments(version, data_list)
+        util.put_padding(buffer, util.rs_blocks(version, err_corr))
+        codewords = batch.codewords_many(np.array([buffer.buffer], np.uint8), version, err_corr)
+        modules = batch.place_group(codewords, version, err_corr, mask_pattern)[0]
+        return modules.tolist(), codewords[0].tolist()
+
+    raise ValueError('No separate path for engine {!r}'.format(engine))
@@ -0,0 +1,183 @@
+'''
+Fountain-coded QR stream for one-way file transfer
+The file is cut into blocks and sent as an endless stream of LT (Luby transform)
+packets, each one the XOR of a pseudo-random set of blocks and each one filling a
+symbol of one fixed version and error correction level. The receiver can start at
+any frame and needs a few more frames than blocks (typically 1.2-1.5 x), in any order.
+
+    frames = fountain.frames(open('report.pdf', 'rb').read(), version = 10)
+    with open('report.png', 'wb') as f:
+        animate.write_apng(frames, f, count = 200, fps = 10)
+
+    receiver = fountain.Decoder()
+    for modules in scanned:
+        if receiver.add(decoder.decode(modules).data):
+            break
+    data = receiver.data()
+'''
+import struct
+from bisect import bisect_left
+from itertools import count as counter
+
+import constants
+import util
+import stream
+
+
+HEADER = struct.Struct('>IHI') # file length, block size, seed
+
+def capacity(version, err_corr):
+    '''
+    Byte mode payload of one symbol
+    '''
+    bits = util.BIT_LIMIT_TABLE[err_corr][version] - 4 \
+        - util.bits_number_for_version(version)[constants.EIGHT_BIT_BYTE_MODE]
+    return bits // 8
+
+def _random(seed):
+    '''
+    xorshift32 stream, the same for sender and receiver whatever the Python version
+    '''
+    state = (seed * 2654435761 + 1) & 0xffffffff or 1
+    while True:
+        state ^= (state << 13) & 0xffffffff
+        state ^= state >> 17
+        state ^= (state << 5) & 0xffffffff
+        yield state
+
+def soliton(blocks, c = 0.1, delta = 0.5):
+    '''
+    Cumulative robust soliton distribution over degrees 1..blocks
+    '''
+    import math
+    r = c * math.log(blocks / delta) * math.sqrt(blocks)
+    spike = max(1, min(blocks, int(blocks / r))) if r > 0 else blocks
+    weights = []
+    for d in range(1, blocks + 1):
+        rho = 1 / blocks if d == 1 else 1 / (d * (d - 1))
+        if d < spike:
+            tau = r / (d * blocks)
+        elif d == spike:
+            tau = r * math.log(r / delta) / blocks if r > delta else 0
+        else:
+            tau = 0
+        weights.append(rho + tau)
+    total = sum(weights)
+    cumulative, acc = [], 0
+    for w in weights:
+        acc += w / total
+        cumulative.append(acc)
+    cumulative[-1] = 1.0
+    return cumulative
+
+def neighbours(seed, blocks, cumulative):
+    '''
+    Block indexes XOR-ed into the packet of seed
+    '''
+    rng = _random(seed)
+    degree = bisect_left(cumulative, next(rng) / 2**32) + 1
+    chosen = []
+    while len(chosen) < degree:
+        index = next(rng) % blocks
+        if index not in chosen:
+            chosen.append(index)
+    return chosen
+
+
+class Encoder:
+    '''
+    LT packets of data, block size chosen to fill one symbol of version/err_corr
+    '''
+    def __init__(self, data, version = 10, err_corr = constants.ERR_CORR_L):
+        self.block_size = capacity(version, err_corr) - HEADER.size
+        if self.block_size < 1:
+            raise ValueError('Version {} is too small for a packet'.format(version))
+        self.length = len(data)
+        self.blocks = max(1, -(-len(data) // self.block_size))
+        padded = data + bytes(self.blocks * self.block_size - len(data))
+        self.data = [
+            int.from_bytes(padded[i*self.block_size:(i + 1)*self.block_size], 'big')
+            for i in range(self.blocks)
+        ]
+        self.cumulative = soliton(self.blocks)
+
+    def packet(self, seed):
+        block = 0
+        for index in neighbours(seed, self.blocks, self.cumulative):
+            block ^= self.data[index]
+        return HEADER.pack(self.length, self.block_size, seed) + block.to_bytes(self.block_size, 'big')
+
+    def packets(self, start = 0):
+        for seed in counter(start):
+            yield self.packet(seed)
+
+
+class Decoder:
+    '''
+    Peeling decoder, add packets in any order until it returns True
+    '''
+    def __init__(self):
+        self.blocks = None
+        self.solved = {}
+        self.pending = [] # [set of unsolved indexes, XOR of their blocks as int]
+        self.seen = set()
+
+    def add(self, packet):
+        length, block_size, seed = HEADER.unpack_from(packet)
+        if self.blocks is None:
+            self.length, self.block_size = length, block_size
+            self.blocks = max(1, -(-length // block_size))
+            self.cumulative = soliton(self.blocks)
+        if seed in self.seen or self.done():
+            return self.done()
+        self.seen.add(seed)
+
+        value = int.from_bytes(packet[HEADER.size:HEADER.size + block_size], 'big')
+        indexes = set()
+        for index in neighbours(seed, self.blocks, self.cumulative):
+            if index in self.solved:
+                value ^= self.solved[index]
+            else:
+                indexes.add(index)
+        if indexes:
+            self.pending.append([indexes, value])
+            self._peel()
+        return self.done()
+
+    def _peel(self):
+        progress = True
+        while progress:
+            progress = False
+            for entry in self.pending:
+                indexes, value = entry
+                if len(indexes) != 1:
+                    continue
+                index = indexes.pop()
+                if index not in self.solved:
+                    self.solved[index] = value
+                    for other in self.pending:
+                        if index in other[0]:
+                            other[0].discard(index)
+                            other[1] ^= value
+                progress = True
+            self.pending = [entry for entry in self.pending if entry[0]]
+
+    def done(self):
+        return self.blocks is not None and len(self.solved) == self.blocks
+
+    def data(self):
+        if not self.done():
+            raise ValueError('{} of {} blocks decoded'.format(len(self.solved), self.blocks))
+        return b''.join(
+            self.solved[i].to_bytes(self.block_size, 'big') for i in range(self.blocks))[:self.length]
+
+
+def frames(data, version = 10, err_corr = constants.ERR_CORR_L, mask_pattern = None, start = 0):
+    '''
+    Endless stream of module matrices, one LT packet each, fixed version (no best_fit)
+    Matrices are reused scratch, see stream.StreamEncoder
+    '''
+    encoder = Encoder(data, version, err_corr)
+    symbols = stream.StreamEncoder(err_corr, version, mask_pattern, fit = False)
+    for packet in encoder.packets(start):
+        yield symbols.encode(util.QRData(packet, constants.EIGHT_BIT_BYTE_MODE))
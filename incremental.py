@@ -0,0 +1,262 @@
+'''
+Incremental encoding of payloads that differ only in a trailing serial number
+Reed-Solomon parity is linear over GF(256):
+    ecc(D') = ecc(D) ^ sum(delta_i * ecc(e_i)) over the changed data codewords i
+so a variant only updates its changed data codewords, the parity of their blocks
+and the modules they are placed on. The eight masked matrices are kept and only
+touched rows/columns are rescored. Output is the same matrix as QRcode.make.
+
+    encoder = incremental.SerialEncoder('SN-000000', constants.ERR_CORR_M)
+    for serial in range(1000):
+        modules = encoder.make('SN-{:06d}'.format(serial))
+'''
+import constants
+import util
+import QRcode
+
+
+GROUP_SIZE = {
+    constants.NUMERIC_MODE: 3,
+    constants.ALPHANUMERIC_MODE: 2,
+    constants.EIGHT_BIT_BYTE_MODE: 1,
+}
+
+def _mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return util.exponents[(util.log[a] + util.log[b]) % 255]
+
+class SerialEncoder:
+    '''
+    Encode a base payload once, then variants of it incrementally
+    serial_start: first byte of the utf-8 payload that may change,
+        None -> where the trailing digits of base begin
+    '''
+    def __init__(self, base, err_corr = constants.ERR_CORR_M, version = None,
+                mask_pattern = None, serial_start = None):
+        self.err_corr = int(err_corr)
+        self.start_version = version
+        self.fixed_mask = mask_pattern
+        if not isinstance(base, bytes):
+            base = base.encode('utf-8')
+        if serial_start is None:
+            serial_start = len(base.rstrip(b'0123456789'))
+        self.serial_start = serial_start
+        self.rebase(base)
+
+    def rebase(self, payload):
+        '''
+        Full encode of payload, every later variant is diffed against the last one
+        '''
+        q = QRcode.QRcode(version = self.start_version, err_corr = self.err_corr)
+        q.add_data(payload)
+        q.best_fit(start = self.start_version)
+        data = q.data_list[0]
+
+        self.payload = data.data
+        self.mode = data.mode
+        self.version = q.version
+        self.modules_cnt = q.version*4 + 17
+        self.blocks = util.rs_blocks(self.version, self.err_corr)
+
+        # bits before the first group holding a serial character are fixed
+        group = GROUP_SIZE.get(self.mode, 1)
+        self.fixed_chars = min(self.serial_start, len(data)) // group * group
+        prefix = util.BitBuffer()
+        prefix.put(self.mode, 4)
+        prefix.put(len(data), util.bits_number_for_version(self.version)[self.mode])
+        if self.fixed_chars:
+            util.QRData(data.data[:self.fixed_chars], self.mode).write(prefix)
+        self.prefix_bits = prefix
+
+        self.data_codewords = self.encode_data(data.data)
+
+        # block layout, parity and final index of every codeword
+        self.block_data = []
+        self.block_ecc = []
+        self.data_index = []
+        self.ecc_index = []
+        offset = 0
+        for block in self.blocks:
+            self.block_data.append(self.data_codewords[offset:offset + block.data_count])
+            self.block_ecc.append(util.ecc_codewords(self.block_data[-1], block.total_count - block.data_count))
+            self.data_index.append([None] * block.data_count)
+            self.ecc_index.append([None] * (block.total_count - block.data_count))
+            offset += block.data_count
+        index = 0
+        for table in (self.data_index, self.ecc_index):
+            for i in range(max(map(len, table))):
+                for r in range(len(table)):
+                    if i < len(table[r]):
+                        table[r][i] = index
+                        index += 1
+        self.unit_ecc = [{} for _ in self.blocks] # block -> data position -> ecc(e_i)
+
+        # unmasked placement and the eight test-mode masked matrices with their penalties
+        q.makeImpl(True, None)
+        self.unmasked = q.modules
+        self.coords = QRcode.placement_coords(self.version)
+        self.masks = [util.mask_function(i) for i in range(8)]
+        self.masked = []
+        self.scores = []
+        for mask_func in self.masks:
+            modules = util.copy_mat(self.unmasked)
+            for r, c in self.coords:
+                if mask_func(r, c):
+                    modules[r][c] = not modules[r][c]
+            self.masked.append(modules)
+            self.scores.append(self.new_score(modules))
+        self.result = None
+
+    def encode_data(self, payload):
+        '''
+        Padded data codewords, only the bits after the fixed prefix are written
+        '''
+        buffer = util.BitBuffer()
+        buffer.buffer = self.prefix_bits.buffer[:]
+        buffer.length = self.prefix_bits.length
+        if len(payload) > self.fixed_chars:
+            util.QRData(payload[self.fixed_chars:], self.mode).write(buffer)
+        util.put_padding(buffer, self.blocks)
+        return buffer.buffer
+
+    def new_score(self, modules):
+        cols = [list(col) for col in zip(*modules)]
+        n = self.modules_cnt
+        score = {
+            'row_1': [util.lost_line_1(row) for row in modules],
+            'col_1': [util.lost_line_1(col) for col in cols],
+            'pair_2': [util.lost_pair_2(modules[r], modules[r + 1]) for r in range(n - 1)],
+            'row_3': [util.lost_row_3(row) for row in modules],
+            'col_3': [util.lost_col_3(col) for col in cols],
+            'dark': sum(map(sum, modules)),
+        }
+        score['lines'] = (sum(score['row_1']) + sum(score['col_1']) + sum(score['pair_2'])
+            + sum(score['row_3']) + sum(score['col_3']))
+        return score
+
+    def lost(self, score):
+        return score['lines'] + util.lost_4(score['dark'], self.modules_cnt)
+
+    def rescore(self, modules, score, rows, cols):
+        '''
+        Rescore the touched rows and columns only
+        '''
+        n = self.modules_cnt
+        lines = score['lines']
+        for r in rows:
+            new_1, new_3 = util.lost_line_1(modules[r]), util.lost_row_3(modules[r])
+            lines += new_1 - score['row_1'][r] + new_3 - score['row_3'][r]
+            score['row_1'][r], score['row_3'][r] = new_1, new_3
+        for r in {p for r in rows for p in (r - 1, r) if 0 <= p < n - 1}:
+            new_2 = util.lost_pair_2(modules[r], modules[r + 1])
+            lines += new_2 - score['pair_2'][r]
+            score['pair_2'][r] = new_2
+        for c in cols:
+            col = [row[c] for row in modules]
+            new_1, new_3 = util.lost_line_1(col), util.lost_col_3(col)
+            lines += new_1 - score['col_1'][c] + new_3 - score['col_3'][c]
+            score['col_1'][c], score['col_3'][c] = new_1, new_3
+        score['lines'] = lines
+
+    def compatible(self, payload):
+        if not isinstance(payload, bytes):
+            payload = payload.encode('utf-8')
+        return (len(payload) == len(self.payload)
+            and payload[:self.serial_start] == self.payload[:self.serial_start]
+            and util.QRData(payload).mode == self.mode), payload
+
+    def make(self, payload):
+        '''
+        Modules of payload, same as QRcode.make; incompatible payloads are rebased
+        '''
+        ok, payload = self.compatible(payload)
+        if not ok:
+            self.rebase(payload)
+        elif payload != self.payload or self.result is None:
+            self.update(payload)
+        if self.result is None:
+            self.result = self.finish()
+        return self.result
+
+    def update(self, payload):
+        '''
+        Apply the codeword delta of payload to the placement and masked matrices
+        '''
+        new_data = self.encode_data(payload)
+        self.payload = payload
+        changed = {} # final codeword index -> new value
+
+        offset = 0
+        for r, block in enumerate(self.blocks):
+            delta_ecc = None
+            for i in range(block.data_count):
+                old, new = self.block_data[r][i], new_data[offset + i]
+                if old == new:
+                    continue
+                self.block_data[r][i] = new
+                changed[self.data_index[r][i]] = new
+                if i not in self.unit_ecc[r]:
+                    unit = [0] * block.data_count
+                    unit[i] = 1
+                    self.unit_ecc[r][i] = util.ecc_codewords(unit, block.total_count - block.data_count)
+                delta = old ^ new
+                if delta_ecc is None:
+                    delta_ecc = [0] * len(self.block_ecc[r])
+                for j, parity in enumerate(self.unit_ecc[r][i]):
+                    delta_ecc[j] ^= _mul(delta, parity)
+            if delta_ecc is not None:
+                for j, d in enumerate(delta_ecc):
+                    if d:
+                        self.block_ecc[r][j] ^= d
+                        changed[self.ecc_index[r][j]] = self.block_ecc[r][j]
+            offset += block.data_count
+
+        if not changed:
+            return
+        self.result = None
+
+        # re-place the modules of changed codewords
+        touched = []
+        for index, value in changed.items():
+            for bit in range(8):
+                r, c = self.coords[index*8 + bit]
+                dark = ((value >> (7 - bit)) & 1) == 1
+                if self.unmasked[r][c] != dark:
+                    self.unmasked[r][c] = dark
+                    touched.append((r, c))
+        if not touched:
+            return
+        rows = {r for r, _ in touched}
+        cols = {c for _, c in touched}
+
+        for modules, score in zip(self.masked, self.scores):
+            for r, c in touched:
+                modules[r][c] = not modules[r][c]
+                score['dark'] += 1 if modules[r][c] else -1
+            self.rescore(modules, score, rows, cols)
+
+    def finish(self):
+        '''
+        Pick the mask and write type/version info
+        '''
+        if self.fixed_mask is None:
+            lost = [self.lost(score) for score in self.scores]
+            mask_pattern = lost.index(min(lost))
+        else:
+            mask_pattern = self.fixed_mask
+        q = QRcode.QRcode(version = self.version, err_corr = self.err_corr)
+        q.modules_cnt = self.modules_cnt
+        q.modules = util.copy_mat(self.masked[mask_pattern])
+        q.setup_type_info(False, mask_pattern)
+        if self.version >= 7:
+            q.setup_version_info(False)
+        self.mask_pattern = mask_pattern
+        return q.modules
+
+    def make_many(self, payloads):
+        '''
+        Yield the modules of each payload
+        '''
+        for payload in payloads:
+            yield self.make(payload)
@@ -0,0 +1,288 @@
+'''
+Resumable batch generation over a SQLite job store
+A job is a table of payloads cut into chunks of ids. Any number of worker processes,
+on any node that sees the database file, lease pending (or expired) chunks, make
+their codes with QRcode.make_many and mark them done. Outputs are written to a
+temporary name and renamed, so a chunk made twice gives the same files. A killed run
+is resumed by starting workers again: done chunks are skipped, leases of dead
+workers expire and are handed out again. Workers renew their lease while they write.
+A payload that cannot be made is recorded in the failures table and its chunk still
+completes; a chunk leased MAX_ATTEMPTS times without completing is marked failed.
+Usage:
+    python jobstore.py create jobs.db cards payloads.txt --out codes --chunk 500
+    python jobstore.py work jobs.db cards --workers 4
+    python jobstore.py status jobs.db cards
+The database uses the default rollback journal, which works on shared file systems
+where WAL does not.
+'''
+import argparse
+from collections import Counter
+import os
+import socket
+import sqlite3
+import time
+import uuid
+
+import constants
+
+
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    name TEXT PRIMARY KEY, out_dir TEXT, err_corr INTEGER, fmt TEXT, box_size INTEGER, border INTEGER);
+CREATE TABLE IF NOT EXISTS payloads (
+    job TEXT, id INTEGER, data BLOB, PRIMARY KEY (job, id));
+CREATE TABLE IF NOT EXISTS chunks (
+    job TEXT, start INTEGER, stop INTEGER, state TEXT, owner TEXT, lease_until REAL,
+    attempts INTEGER DEFAULT 0, PRIMARY KEY (job, start));
+CREATE TABLE IF NOT EXISTS failures (
+    job TEXT, id INTEGER, error TEXT, PRIMARY KEY (job, id));
+'''
+
+
+def connect(path):
+    db = sqlite3.connect(path, timeout = 60, isolation_level = None)
+    db.executescript(SCHEMA)
+    return db
+
+def create(path, name, payloads, out_dir, chunk_size = 500, err_corr = constants.ERR_CORR_M,
+        fmt = 'png', box_size = 10, border = 4):
+    '''
+    Store payloads (iterable of str or bytes) as job name, ids from 0 in order
+    '''
+    db = connect(path)
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        db.execute('INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?)',
+            (name, out_dir, int(err_corr), fmt, box_size, border))
+        total = 0
+        for total, data in enumerate(payloads, 1):
+            if not isinstance(data, bytes):
+                data = data.encode('utf-8')
+            db.execute('INSERT INTO payloads VALUES (?, ?, ?)', (name, total - 1, data))
+        db.executemany('INSERT INTO chunks (job, start, stop, state) VALUES (?, ?, ?, ?)',
+            [(name, start, min(start + chunk_size, total), 'pending') for start in range(0, total, chunk_size)])
+        db.execute('COMMIT')
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+    finally:
+        db.close()
+    return total
+
+def lease(db, name, owner, lease_seconds = LEASE_SECONDS):
+    '''
+    Take a pending or expired chunk, return (start, stop) or None when nothing is left to lease
+    Expired chunks already leased MAX_ATTEMPTS times are marked failed instead
+    '''
+    now = time.time()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        db.execute(
+            "UPDATE chunks SET state = 'failed', owner = NULL, lease_until = NULL WHERE job = ? AND "
+            "(state = 'pending' OR (state = 'leased' AND lease_until < ?)) AND attempts >= ?",
+            (name, now, MAX_ATTEMPTS))
+        row = db.execute(
+            "SELECT start, stop FROM chunks WHERE job = ? AND "
+            "(state = 'pending' OR (state = 'leased' AND lease_until < ?)) ORDER BY start LIMIT 1",
+            (name, now)).fetchone()
+        if row is not None:
+            db.execute(
+                "UPDATE chunks SET state = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1 "
+                "WHERE job = ? AND start = ?", (owner, now + lease_seconds, name, row[0]))
+        db.execute('COMMIT')
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+    return row
+
+def renew(db, name, start, owner, lease_seconds = LEASE_SECONDS):
+    '''
+    Extend the lease of a chunk, False if it was lost
+    '''
+    cursor = db.execute(
+        "UPDATE chunks SET lease_until = ? WHERE job = ? AND start = ? AND owner = ? AND state = 'leased'",
+        (time.time() + lease_seconds, name, start, owner))
+    return cursor.rowcount == 1
+
+def release(db, name, start, owner):
+    '''
+    Hand a chunk back after an error, its attempt is kept
+    '''
+    db.execute("UPDATE chunks SET state = 'pending', owner = NULL, lease_until = NULL "
+        "WHERE job = ? AND start = ? AND owner = ? AND state = 'leased'", (name, start, owner))
+
+def fail(db, name, index, error):
+    db.execute('INSERT OR REPLACE INTO failures VALUES (?, ?, ?)',
+        (name, index, '{}: {}'.format(type(error).__name__, error)))
+
+def complete(db, name, start, owner):
+    '''
+    Checkpoint a chunk, False if its lease was lost (the outputs are still valid)
+    '''
+    cursor = db.execute(
+        "UPDATE chunks SET state = 'done', lease_until = NULL WHERE job = ? AND start = ? AND owner = ?",
+        (name, start, owner))
+    return cursor.rowcount == 1
+
+def reset_leases(path, name):
+    '''
+    Hand out leased chunks again at once, when every worker is known to be dead
+    '''
+    db = connect(path)
+    try:
+        return db.execute("UPDATE chunks SET state = 'pending', owner = NULL, lease_until = NULL "
+            "WHERE job = ? AND state = 'leased'", (name,)).rowcount
+    finally:
+        db.close()
+
+def status(path, name):
+    '''
+    Number of chunks in each state, and of failed payloads
+    '''
+    db = connect(path)
+    try:
+        counts = dict(db.execute('SELECT state, COUNT(*) FROM chunks WHERE job = ? GROUP BY state', (name,)))
+        counts['failed payloads'] = db.execute('SELECT COUNT(*) FROM failures WHERE job = ?', (name,)).fetchone()[0]
+        return counts
+    finally:
+        db.close()
+
+def failures(path, name):
+    '''
+    (id, error) of the payloads that could not be made
+    '''
+    db = connect(path)
+    try:
+        return db.execute('SELECT id, error FROM failures WHERE job = ? ORDER BY id', (name,)).fetchall()
+    finally:
+        db.close()
+
+
+def _write(path, data):
+    temp = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+    with open(temp, 'wb') as f:
+        f.write(data)
+    os.replace(temp, path)
+
+def _make(rows, err_corr, options):
+    '''
+    (id, image or exception) of rows, one by one when the batch fails
+    '''
+    import QRcode
+    try:
+        images = QRcode.make_many([data for _, data in rows], err_corr, **options)
+        return [(index, image) for (index, _), image in zip(rows, images)]
+    except Exception:
+        if len(rows) == 1:
+            raise
+    made = []
+    for row in rows:
+        try:
+            made.extend(_make([row], err_corr, options))
+        except Exception as e:
+            made.append((row[0], e))
+    return made
+
+def work(path, name, owner = None, lease_seconds = LEASE_SECONDS, limit = None):
+    '''
+    Lease and make chunks until none is left (or limit chunks)
+    Return a Counter of chunks made, payloads failed and leases lost to other workers
+    '''
+    if owner is None:
+        owner = '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+    db = connect(path)
+    try:
+        row = db.execute('SELECT out_dir, err_corr, fmt, box_size, border FROM jobs WHERE name = ?',
+            (name,)).fetchone()
+        if row is None:
+            raise KeyError('No job {!r}'.format(name))
+        out_dir, err_corr, fmt, box_size, border = row
+        os.makedirs(out_dir, exist_ok = True)
+
+        counts = Counter(made = 0, failed = 0, lost = 0)
+        while limit is None or counts['made'] < limit:
+            chunk = lease(db, name, owner, lease_seconds)
+            if chunk is None:
+                break
+            start, stop = chunk
+            try:
+                rows = db.execute('SELECT id, data FROM payloads WHERE job = ? AND id >= ? AND id < ? ORDER BY id',
+                    (name, start, stop)).fetchall()
+                made = _make(rows, err_corr, dict(fmt = fmt, box_size = box_size, border = border))
+                renewed = time.time()
+                kept = renew(db, name, start, owner, lease_seconds)
+                for index, image in made:
+                    if not kept:
+                        break
+                    if isinstance(image, Exception):
+                        fail(db, name, index, image)
+                        counts['failed'] += 1
+                    else:
+                        _write(os.path.join(out_dir, '{:08d}.{}'.format(index, fmt)), image)
+                    if time.time() - renewed > lease_seconds / 3:
+                        renewed = time.time()
+                        kept = renew(db, name, start, owner, lease_seconds)
+            except BaseException:
+                release(db, name, start, owner)
+                raise
+            if kept and complete(db, name, start, owner):
+                counts['made'] += 1
+            else:
+                counts['lost'] += 1 # another worker leased it after expiry and makes it again
+        return counts
+    finally:
+        db.close()
+
+def run(path, name, workers = 1, lease_seconds = LEASE_SECONDS):
+    '''
+    work() in workers local processes
+    '''
+    if workers == 1:
+        return work(path, name, lease_seconds = lease_seconds)
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(work, path, name, None, lease_seconds) for _ in range(workers)]
+        return sum((future.result() for future in futures), Counter())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Resumable QR batch over a SQLite job store')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+    create_parser = commands.add_parser('create')
+    create_parser.add_argument('db')
+    create_parser.add_argument('name')
+    create_parser.add_argument('payloads', help = 'text file, one payload per line')
+    create_parser.add_argument('--out', required = True)
+    create_parser.add_argument('--chunk', type = int, default = 500)
+    create_parser.add_argument('--fmt', default = 'png')
+    create_parser.add_argument('--box-size', type = int, default = 10)
+    work_parser = commands.add_parser('work')
+    work_parser.add_argument('db')
+    work_parser.add_argument('name')
+    work_parser.add_argument('--workers', type = int, default = 1)
+    work_parser.add_argument('--lease', type = float, default = LEASE_SECONDS)
+    work_parser.add_argument('--reset-leases', action = 'store_true',
+        help = 'hand out chunks leased by dead workers right away')
+    status_parser = commands.add_parser('status')
+    status_parser.add_argument('db')
+    status_parser.add_argument('name')
+    args = parser.parse_args()
+
+    if args.command == 'create':
+        with open(args.payloads, encoding = 'utf-8') as f:
+            lines = (line.rstrip('\n') for line in f)
+            total = create(args.db, args.name, lines, args.out, args.chunk, fmt = args.fmt, box_size = args.box_size)
+        print('{} payloads'.format(total))
+    elif args.command == 'work':
+        if args.reset_leases:
+            reset_leases(args.db, args.name)
+        start = time.perf_counter()
+        counts = run(args.db, args.name, args.workers, args.lease)
+        print('{} chunks in {:.2f}s, {} payloads failed, {} leases lost'.format(
+            counts['made'], time.perf_counter() - start, counts['failed'], counts['lost']))
+    else:
+        print(status(args.db, args.name))
+        for index, error in failures(args.db, args.name):
+            print('{:8d}  {}'.format(index, error))
@@ -0,0 +1,180 @@
+'''
+Load generator for the web page (app.py or asgi_app.py)
+Drives /result, /image/<fmt> and /bulk at a given concurrency and payload mix,
+reports p50/p95/p99 latency and throughput per route
+
+    python loadgen.py --url http://127.0.0.1:8081 --concurrency 16 --duration 30 \
+        --mix numeric=5,text=3,long=1 --routes result=1,image=3
+
+Interactive latency under bulk load (app.py scheduler), against a p99 SLO:
+    python loadgen.py --concurrency 8 --routes result=1,image=3 --bulk-clients 2 --slo 250
+'''
+import argparse
+import random
+import string
+import threading
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import urlencode
+
+
+PAYLOADS = {
+    'numeric': lambda rnd: ''.join(rnd.choice(string.digits) for _ in range(12)),
+    'alphanumeric': lambda rnd: 'SN-' + ''.join(rnd.choice(string.ascii_uppercase + string.digits) for _ in range(16)),
+    'text': lambda rnd: 'https://example.com/item?id=' + ''.join(rnd.choice(string.ascii_lowercase) for _ in range(20)),
+    'long': lambda rnd: ''.join(rnd.choice(string.ascii_letters + ' ') for _ in range(600)),
+}
+
+
+def parse_weights(text, choices):
+    '''
+    'a=3,b=1' -> ([a, b], [3, 1])
+    '''
+    names, weights = [], []
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        if name not in choices:
+            raise argparse.ArgumentTypeError('Unknown {}, expect one of {}'.format(name, sorted(choices)))
+        names.append(name)
+        weights.append(float(weight or 1))
+    return names, weights
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return float('nan')
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class LoadGenerator:
+    def __init__(self, url, concurrency, mix, routes, formats = ('png',), box_sizes = (4, 8),
+                err_corrs = (0, 1, 2, 3), repeat = 0.0, seed = None, bulk_clients = 0, bulk_size = 200):
+        self.url = url.rstrip('/')
+        self.concurrency = concurrency
+        self.mix = mix
+        self.routes = routes
+        self.formats = formats
+        self.box_sizes = box_sizes
+        self.err_corrs = err_corrs
+        self.repeat = repeat # share of requests reusing an earlier payload (cache hits)
+        self.seed = seed
+        self.bulk_clients = bulk_clients # extra threads sending only /bulk
+        self.bulk_size = bulk_size # payloads per /bulk request
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.sent = 0
+
+    def next_request(self, rnd, seen, routes):
+        if seen and rnd.random() < self.repeat:
+            data, err_corr = rnd.choice(seen)
+        else:
+            data = PAYLOADS[rnd.choices(*self.mix)[0]](rnd)
+            err_corr = rnd.choice(self.err_corrs)
+            seen.append((data, err_corr))
+        route = rnd.choices(*routes)[0]
+        if route == 'result':
+            return route, '{}/result?{}'.format(self.url, urlencode({'data': data, 'err_corr': err_corr})), None
+        if route == 'bulk':
+            body = '\n'.join(PAYLOADS[rnd.choices(*self.mix)[0]](rnd) for _ in range(self.bulk_size))
+            return route, '{}/bulk?{}'.format(self.url, urlencode({'err_corr': err_corr})), body.encode('utf-8')
+        fmt = rnd.choice(self.formats)
+        query = urlencode({'data': data, 'err_corr': err_corr, 'box_size': rnd.choice(self.box_sizes)})
+        return 'image/' + fmt, '{}/image/{}?{}'.format(self.url, fmt, query), None
+
+    def worker(self, index, deadline, budget, routes):
+        rnd = random.Random(None if self.seed is None else self.seed + index)
+        seen = []
+        while time.perf_counter() < deadline:
+            with self.lock:
+                if budget is not None and self.sent >= budget:
+                    return
+                self.sent += 1
+            route, url, body = self.next_request(rnd, seen, routes)
+            request = urllib.request.Request(url, data = body,
+                headers = {'X-Client-Id': 'loadgen-{}'.format(index)})
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout = 300) as response:
+                    response.read()
+                error = None
+            except urllib.error.HTTPError as e:
+                error = str(e.code)
+            except (urllib.error.URLError, OSError) as e:
+                error = type(e).__name__
+            cost = time.perf_counter() - start
+            with self.lock:
+                if error is None:
+                    self.latencies.setdefault(route, []).append(cost)
+                else:
+                    key = (route, error)
+                    self.errors[key] = self.errors.get(key, 0) + 1
+
+    def run(self, duration = None, requests = None):
+        deadline = time.perf_counter() + (duration if duration else float('inf'))
+        threads = [
+            threading.Thread(target = self.worker, args = (i, deadline, requests, self.routes), daemon = True)
+            for i in range(self.concurrency)
+        ] + [
+            threading.Thread(target = self.worker, args = (i, deadline, requests, (['bulk'], [1.0])), daemon = True)
+            for i in range(self.concurrency, self.concurrency + self.bulk_clients)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+    def report(self, elapsed):
+        print('{:14s} {:>8s} {:>9s} {:>9s} {:>9s} {:>9s}'.format(
+            'route', 'ok', 'p50(ms)', 'p95(ms)', 'p99(ms)', 'req/s'))
+        everything = []
+        for route, values in sorted(self.latencies.items()):
+            values.sort()
+            everything.extend(values)
+            print('{:14s} {:8d} {:9.1f} {:9.1f} {:9.1f} {:9.1f}'.format(
+                route, len(values), *(1000 * percentile(values, p) for p in (50, 95, 99)),
+                len(values) / elapsed))
+        everything.sort()
+        print('{:14s} {:8d} {:9.1f} {:9.1f} {:9.1f} {:9.1f}'.format(
+            'all', len(everything), *(1000 * percentile(everything, p) for p in (50, 95, 99)),
+            len(everything) / elapsed))
+        for (route, error), count in sorted(self.errors.items()):
+            print('error {} {}: {}'.format(route, error, count))
+
+    def interactive_p99(self):
+        '''
+        p99 latency in seconds of the result and image routes together
+        '''
+        values = sorted(v for route, values in self.latencies.items() if route != 'bulk' for v in values)
+        return percentile(values, 99)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Load generator for the QR code web page')
+    parser.add_argument('--url', default = 'http://127.0.0.1:8081')
+    parser.add_argument('--concurrency', type = int, default = 8)
+    parser.add_argument('--duration', type = float, default = 10, help = 'seconds')
+    parser.add_argument('--requests', type = int, default = None, help = 'stop after this many requests')
+    parser.add_argument('--mix', default = 'numeric=5,alphanumeric=2,text=3,long=1',
+        type = lambda text: parse_weights(text, PAYLOADS))
+    parser.add_argument('--routes', default = 'result=1,image=3',
+        type = lambda text: parse_weights(text, ('result', 'image', 'bulk')))
+    parser.add_argument('--bulk-clients', type = int, default = 0, help = 'extra clients sending only /bulk')
+    parser.add_argument('--bulk-size', type = int, default = 200, help = 'payloads per /bulk request')
+    parser.add_argument('--slo', type = float, default = None, help = 'interactive p99 objective in ms')
+    parser.add_argument('--formats', default = 'png')
+    parser.add_argument('--repeat', type = float, default = 0.3, help = 'share of repeated payloads')
+    parser.add_argument('--seed', type = int, default = None)
+    args = parser.parse_args()
+
+    generator = LoadGenerator(args.url, args.concurrency, args.mix, args.routes,
+        formats = args.formats.split(','), repeat = args.repeat, seed = args.seed,
+        bulk_clients = args.bulk_clients, bulk_size = args.bulk_size)
+    elapsed = generator.run(args.duration, args.requests)
+    generator.report(elapsed)
+    if args.slo is not None:
+        p99 = 1000 * generator.interactive_p99()
+        print('interactive p99 {:.1f} ms, SLO {:.1f} ms: {}'.format(p99, args.slo, 'met' if p99 <= args.slo else 'MISSED'))
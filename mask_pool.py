@@ -0,0 +1,105 @@
+'''
+Evaluate the eight mask patterns of a symbol in parallel processes
+The unmasked placement is handed over to workers through shared memory
+'''
+import atexit
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import constants
+import util
+
+
+_pool = None
+_workers_coords = {} # version -> data module coordinates, filled in each worker
+
+def _init_worker(start):
+    '''
+    Load the placement coordinates of every version from start on
+    '''
+    import QRcode
+    for version in range(start, 41):
+        _workers_coords[version] = QRcode.placement_coords(version)
+
+def _lost_for_mask(name, version, mask_pattern):
+    '''
+    Apply mask to the shared unmasked placement and score it
+    '''
+    modules_cnt = version*4 + 17
+    shm = shared_memory.SharedMemory(name = name)
+    try:
+        buf = shm.buf
+        modules = [
+            [buf[r*modules_cnt + c] == 1 for c in range(modules_cnt)]
+            for r in range(modules_cnt)
+        ]
+    finally:
+        shm.close()
+
+    if version not in _workers_coords:
+        import QRcode
+        _workers_coords[version] = QRcode.placement_coords(version)
+
+    mask_func = util.mask_function(mask_pattern)
+    for r, c in _workers_coords[version]:
+        if mask_func(r, c):
+            modules[r][c] = not modules[r][c]
+
+    return util.lost_calculator(modules)
+
+def get_pool(workers = None):
+    '''
+    Return the persistent process pool, start it on first use
+    '''
+    global _pool
+    if _pool is None:
+        if workers is None:
+            workers = min(8, os.cpu_count() or 1)
+        _pool = ProcessPoolExecutor(
+            max_workers = workers,
+            initializer = _init_worker,
+            initargs = (constants.PARALLEL_MASK_VERSION,))
+    return _pool
+
+def shutdown():
+    '''
+    Stop the process pool
+    '''
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+atexit.register(shutdown)
+
+def _forget_pool():
+    '''
+    A forked child inherits the pool but not its manager thread, start a new one on use
+    '''
+    global _pool
+    _pool = None
+
+os.register_at_fork(after_in_child = _forget_pool)
+
+def best_mask_pattern(modules, version):
+    '''
+    Find the optimal mask pattern of an unmasked placement
+    modules: mat from QRcode.makeImpl(True, None)
+    '''
+    modules_cnt = len(modules)
+    shm = shared_memory.SharedMemory(create = True, size = modules_cnt * modules_cnt)
+    try:
+        buf = shm.buf
+        for r, row in enumerate(modules):
+            buf[r*modules_cnt:(r + 1)*modules_cnt] = bytes(row)
+
+        pool = get_pool()
+        futures = [pool.submit(_lost_for_mask, shm.name, version, i) for i in range(8)]
+        lost = [future.result() for future in futures]
+    finally:
+        shm.close()
+        shm.unlink()
+
+    # first pattern with the least lost, as in the serial search
+    return lost.index(min(lost))
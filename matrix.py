@@ -0,0 +1,129 @@
+'''
+Byte buffer export of a finished symbol
+SymbolBuffer copies the modules (lists of bools) once into a bytearray of the bordered
+symbol, one byte per module (1 = dark) row by row. Everything after that copy shares
+its bytes: the bare symbol is a strided view, numpy reads it through
+__array_interface__ and the packed writers slice it with memoryview. The buffer
+protocol (bytes(buffer), memoryview(buffer)) needs Python 3.12+ (__buffer__), older
+versions use buffer.memoryview().
+
+    buffer = q.buffer()
+    array = np.asarray(buffer)              # bordered, uint8, shared with buffer
+    bare = np.asarray(buffer.view(False))   # symbol only, same memory
+    with open('code.pbm', 'wb') as f:
+        buffer.write_pbm(f, box_size = 4)
+'''
+
+
+class SymbolBuffer:
+    '''
+    One byte per module of the bordered symbol, row by row, copied from modules once
+    '''
+    def __init__(self, modules, border = 4):
+        size = len(modules)
+        width = size + 2 * border
+        self.data = bytearray(width * width)
+        for r, row in enumerate(modules):
+            start = (r + border) * width + border
+            self.data[start:start + size] = bytes(map(bool, row))
+        self.size = size
+        self.border = border
+        self.width = width
+
+    @property
+    def __array_interface__(self):
+        return self.view(True).__array_interface__
+
+    def __buffer__(self, flags):
+        # Python 3.12+ only, see memoryview
+        return self.memoryview()
+
+    def memoryview(self):
+        '''
+        width x width memoryview of the bordered symbol
+        '''
+        return memoryview(self.data).cast('B', (self.width, self.width))
+
+    def view(self, border = True):
+        return SymbolView(self, border)
+
+    def rows(self, border = True):
+        '''
+        Zero-copy memoryview of every row, one byte per module
+        '''
+        data = memoryview(self.data)
+        if border:
+            return [data[r*self.width:(r + 1)*self.width] for r in range(self.width)]
+        offset = self.border * self.width + self.border
+        return [data[offset + r*self.width:offset + r*self.width + self.size] for r in range(self.size)]
+
+    def packed_rows(self, border = True, box_size = 1):
+        '''
+        Rows packed 8 modules per byte, MSB first, dark = 1, each row padded to a byte
+        Every module replicated into box_size x box_size bits
+        '''
+        one = b'1' * box_size
+        table = bytes.maketrans(b'\x00\x01', b'01') if box_size == 1 else None
+        for row in self.rows(border):
+            if table is not None:
+                bits = bytes(row).translate(table)
+            else:
+                bits = b''.join(one if module else b'0' * box_size for module in row)
+            bits += b'0' * (-len(bits) % 8)
+            line = int(bits, 2).to_bytes(len(bits) // 8, 'big')
+            for _ in range(box_size):
+                yield line
+
+    def packed(self, border = True):
+        '''
+        All rows packed, see packed_rows
+        '''
+        return b''.join(self.packed_rows(border))
+
+    def write_pbm(self, f, border = True, box_size = 1):
+        '''
+        Write binary PBM (P4) to binary file f
+        '''
+        size = (self.width if border else self.size) * box_size
+        f.write('P4\n{} {}\n'.format(size, size).encode('ascii'))
+        for line in self.packed_rows(border, box_size):
+            f.write(line)
+
+    def write_npy(self, f, border = True):
+        '''
+        Write a uint8 .npy array (numpy not needed) to binary file f
+        '''
+        size = self.width if border else self.size
+        header = "{{'descr': '|u1', 'fortran_order': False, 'shape': ({}, {}), }}".format(size, size)
+        header += ' ' * (-(len(header) + 11) % 64) + '\n'
+        f.write(b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little') + header.encode('latin1'))
+        if border:
+            f.write(memoryview(self.data))
+        else:
+            for row in self.rows(False):
+                f.write(row)
+
+
+class SymbolView:
+    '''
+    Bordered or bare symbol of a SymbolBuffer, for numpy.asarray
+    '''
+    def __init__(self, buffer, border = True):
+        self.buffer = buffer
+        self.border = border
+
+    @property
+    def __array_interface__(self):
+        buffer = self.buffer
+        if self.border:
+            shape, offset = (buffer.width, buffer.width), 0
+        else:
+            shape, offset = (buffer.size, buffer.size), buffer.border * buffer.width + buffer.border
+        return {
+            'version': 3,
+            'shape': shape,
+            'typestr': '|u1',
+            'data': memoryview(buffer.data).toreadonly(),
+            'offset': offset,
+            'strides': (buffer.width, 1),
+        }
@@ -0,0 +1,165 @@
+'''
+Minimal metrics in Prometheus text format, no client library needed
+'''
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names, values, extra = ()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    '''
+    Base of all metrics, one value per label set
+    '''
+    kind = None
+
+    def __init__(self, name, documentation, labels = (), registry = None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+        (registry or REGISTRY).register(self)
+
+    def key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError('Expect labels {} for {}'.format(self.labels, self.name))
+        return tuple(labels[name] for name in self.labels)
+
+    def samples(self):
+        '''
+        Yield (suffix, label values, extra labels, value)
+        '''
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in items:
+            yield '', key, (), value
+
+    def expose(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} {}'.format(self.name, self.kind),
+        ]
+        for suffix, key, extra, value in self.samples():
+            lines.append('{}{}{} {}'.format(
+                self.name, suffix, _format_labels(self.labels, key, extra), _format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        '''
+        Mirror a counter kept elsewhere (e.g. functools.lru_cache statistics)
+        '''
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def get(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels = (), buckets = DEFAULT_BUCKETS, registry = None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labels, registry)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts, _, _ = state = self.values[key]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            items = [(key, (counts[:], total, count)) for key, (counts, total, count) in self.values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield '_bucket', key, (('le', _format_value(float(bound))),), cumulative
+            yield '_sum', key, (), total
+            yield '_count', key, (), count
+
+
+class Registry:
+    '''
+    Metrics exposed together, collectors run right before exposition
+    '''
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def on_collect(self, func):
+        self.collectors.append(func)
+        return func
+
+    def expose(self):
+        for func in self.collectors:
+            func()
+        return '\n'.join(metric.expose() for metric in self.metrics) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
@@ -0,0 +1,316 @@
+'''
+Micro QR symbols, M1-M4 (versions 1-4 here), for short payloads
+One finder pattern, timing patterns on row 0 and column 0, one copy of the format
+info, a single RS block and 4 masks scored on the right and bottom edges.
+
+    q = MicroQRcode()
+    q.add_data('01234567')
+    q.make()             # smallest symbol the data fits, M2 here
+    q.render('png')
+make_small returns a MicroQRcode when the data fits one, else a QRcode.
+'''
+import constants
+import render
+import stream
+import util
+
+
+# (version, err_corr) -> (data bits, ecc codewords, symbol number); M1 only detects errors
+MICRO_BLOCKS = {
+    (1, None): (20, 2, 0),
+    (2, constants.ERR_CORR_L): (40, 5, 1),
+    (2, constants.ERR_CORR_M): (32, 6, 2),
+    (3, constants.ERR_CORR_L): (84, 6, 3),
+    (3, constants.ERR_CORR_M): (68, 8, 4),
+    (4, constants.ERR_CORR_L): (128, 8, 5),
+    (4, constants.ERR_CORR_M): (112, 10, 6),
+    (4, constants.ERR_CORR_Q): (80, 14, 7),
+}
+# strongest level first
+MICRO_LEVELS = {
+    1: (None,),
+    2: (constants.ERR_CORR_M, constants.ERR_CORR_L),
+    3: (constants.ERR_CORR_M, constants.ERR_CORR_L),
+    4: (constants.ERR_CORR_Q, constants.ERR_CORR_M, constants.ERR_CORR_L),
+}
+NAMES = ('M1', 'M2', 'M3', 'M4')
+
+cache_micro_mat = {}
+cache_micro_coords = {}
+
+
+def bits_needed(version, data_list):
+    '''
+    Bits of data_list in version, None if a mode or length does not fit the version
+    '''
+    bits = 0
+    for data in data_list:
+        count_bits = constants.MICRO_MODE_SIZE.get(data.mode, (None,) * 4)[version - 1]
+        if count_bits is None or len(data) >= 1 << count_bits:
+            return None
+        bits += version - 1 + count_bits + stream.data_bits(data.mode, len(data))
+    return bits
+
+def fit(data_list, err_corr = None, start = 1):
+    '''
+    Smallest (version, err_corr) holding data_list, None if no Micro QR symbol does
+    err_corr None -> the strongest level of the smallest version
+    '''
+    for version in range(start, 5):
+        bits = bits_needed(version, data_list)
+        if bits is None:
+            continue
+        for level in MICRO_LEVELS[version]:
+            if err_corr is not None and level != err_corr:
+                continue
+            if bits <= MICRO_BLOCKS[version, level][0]:
+                return version, level
+    return None
+
+def put_data(version, err_corr, data_list):
+    '''
+    Data and ecc bits of the symbol as a list of 0/1, in placement order
+    '''
+    data_bits, err_cnt, _ = MICRO_BLOCKS[version, err_corr]
+    buffer = util.BitBuffer()
+    for data in data_list:
+        if version > 1:
+            buffer.put(constants.MICRO_MODE_INDICATORS[data.mode], version - 1)
+        buffer.put(len(data), constants.MICRO_MODE_SIZE[data.mode][version - 1])
+        data.write(buffer)
+    if len(buffer) > data_bits:
+        raise OverflowError('Data overflow for current version.')
+
+    # terminator, zeros to the codeword boundary, then pad codewords
+    # the last data codeword of M1 and M3 has 4 bits, its pad is 0000
+    for _ in range(min(2*version + 1, data_bits - len(buffer))):
+        buffer.set(False)
+    while len(buffer) % 8 and len(buffer) < data_bits:
+        buffer.set(False)
+    for i in range((data_bits - len(buffer)) // 8):
+        buffer.put(constants.PAD1 if i % 2 else constants.PAD0, 8)
+    while len(buffer) < data_bits:
+        buffer.set(False)
+
+    # a 4-bit codeword is its upper nibble for the RS code
+    codewords = buffer.buffer
+    ecc = util.ecc_codewords(codewords, err_cnt)
+    bits = [(codewords[i >> 3] >> (7 - (i & 7))) & 1 for i in range(data_bits)]
+    bits.extend((cw >> i) & 1 for cw in ecc for i in range(7, -1, -1))
+    return bits
+
+
+class MicroQRcode:
+    def __init__(self, version = None, err_corr = None, box_size = 10, border = 2, mask_pattern = None):
+        if box_size < 0 or border < 0:
+            raise ValueError('Expect box size and border > 0.')
+        if version is not None and not 1 <= int(version) <= 4:
+            raise ValueError('Invalid version')
+        if mask_pattern is not None and mask_pattern not in range(4):
+            raise TypeError('Invalid mask pattern {}'.format(mask_pattern))
+        if err_corr is not None and err_corr not in MICRO_LEVELS[4]:
+            raise ValueError('Micro QR has no error correction level {}'.format(err_corr))
+        self.version = version and int(version)
+        self.err_corr = err_corr # None -> strongest that fits, only choice for M1
+        self.box_size = int(box_size)
+        self.border = int(border) # 2 modules of quiet zone are enough for Micro QR
+        self.mask_pattern = mask_pattern
+        self.clear()
+
+    def clear(self):
+        '''
+        Reset all data
+        '''
+        self.modules = None
+        self.modules_cnt = 0
+        self.data_cache = None
+        self.data_list = []
+        self.render_cache = {}
+        self.level = self.err_corr # level of the made symbol
+
+    def add_data(self, data):
+        '''
+        Add data to the symbol
+        '''
+        if isinstance(data, util.QRData):
+            self.data_list.append(data)
+        else:
+            self.data_list.append(util.QRData(data))
+        self.data_cache = None
+        self.render_cache = {}
+
+    @property
+    def name(self):
+        return NAMES[self.version - 1]
+
+    def make(self, fit = True):
+        '''
+        Fit the version (unless fit is False and a version is set), encode, choose the mask
+        '''
+        self.render_cache = {}
+        if fit or self.version is None:
+            self.best_fit(self.version)
+        elif (self.version, self.level) not in MICRO_BLOCKS:
+            self.level = fit_level(self.version, self.err_corr)
+        self.data_cache = put_data(self.version, self.level, self.data_list)
+        if self.mask_pattern is None:
+            self.makeImpl(self.best_mask_pattern())
+        else:
+            self.makeImpl(self.mask_pattern)
+
+    def best_fit(self, start = None):
+        '''
+        Smallest version (from start) and level holding the data
+        '''
+        found = fit(self.data_list, self.err_corr, start or 1)
+        if found is None:
+            raise OverflowError('Data Overflow!')
+        self.version, self.level = found
+
+    def best_mask_pattern(self):
+        '''
+        Mask with the highest score, see 7.8.3.2
+        '''
+        scores = []
+        for mask_pattern in range(4):
+            self.makeImpl(mask_pattern)
+            scores.append(score(self.modules))
+        return scores.index(max(scores))
+
+    def makeImpl(self, mask_pattern):
+        self.setup_template()
+        self.setup_type_info(mask_pattern)
+        self.mapping(self.data_cache, mask_pattern)
+
+    def setup_template(self):
+        '''
+        Finder pattern, separator and timing patterns, data and format modules left None
+        '''
+        self.modules_cnt = self.version*2 + 9
+        if self.version not in cache_micro_mat:
+            size = self.modules_cnt
+            modules = [[None] * size for _ in range(size)]
+            for r in range(8):
+                for c in range(8):
+                    modules[r][c] = (r < 7 and c < 7 and (r in (0, 6) or c in (0, 6)
+                        or (2 <= r <= 4 and 2 <= c <= 4)))
+            for i in range(8, size):
+                modules[0][i] = modules[i][0] = (i % 2 == 0)
+            cache_micro_mat[self.version] = modules
+            format_cells = [(8, c) for c in range(1, 9)] + [(r, 8) for r in range(1, 8)]
+            for r, c in format_cells:
+                modules[r][c] = False
+            cache_micro_coords[self.version] = placement_coords(modules)
+            for r, c in format_cells:
+                modules[r][c] = None
+        self.modules = util.copy_mat(cache_micro_mat[self.version])
+
+    def setup_type_info(self, mask_pattern):
+        '''
+        15 bits of symbol number, mask and BCH code: column 8 upwards of row 8, row 8 from column 8 to 1
+        '''
+        data = (MICRO_BLOCKS[self.version, self.level][2] << 2) | mask_pattern
+        data_BCH = util.BCH_code_generator(data) ^ constants.G15_MASK ^ constants.G15_MICRO_MASK
+        for i in range(8):
+            self.modules[i + 1][8] = ((data_BCH >> i) & 1) == 1
+            self.modules[8][i + 1] = ((data_BCH >> (14 - i)) & 1) == 1
+
+    def mapping(self, bits, mask_pattern):
+        '''
+        Module placement in matrix, no remainder bits in Micro QR
+        '''
+        mask_func = util.mask_function(constants.MICRO_MASKS[mask_pattern])
+        modules = self.modules
+        for (r, c), bit in zip(cache_micro_coords[self.version], bits):
+            modules[r][c] = (bit == 1) != mask_func(r, c)
+
+    def get_mat(self):
+        '''
+        Return the symbol in mat with border
+        '''
+        if self.data_cache is None:
+            self.make()
+        if not self.border:
+            return self.modules
+        size = self.modules_cnt + 2 * self.border
+        margin = [False] * self.border
+        mat = [[False] * size for _ in range(self.border)]
+        mat.extend(margin + row + margin for row in self.modules)
+        mat.extend([False] * size for _ in range(self.border))
+        return mat
+
+    def buffer(self):
+        '''
+        matrix.SymbolBuffer of the bordered symbol, copied from modules once per make
+        '''
+        if self.data_cache is None:
+            self.make()
+        if 'buffer' not in self.render_cache:
+            import matrix
+            self.render_cache['buffer'] = matrix.SymbolBuffer(self.modules, self.border)
+        return self.render_cache['buffer']
+
+    def render(self, fmt = 'png', box_size = None):
+        '''
+        Render the symbol as bytes in fmt (png, svg, eps, pdf), cached per (format, box size)
+        '''
+        box_size = self.box_size if box_size is None else int(box_size)
+        key = (fmt, box_size)
+        if key not in self.render_cache:
+            self.render_cache[key] = render.render_bytes(self, fmt, box_size)
+        return self.render_cache[key]
+
+
+def fit_level(version, err_corr):
+    '''
+    Level of a pinned version: err_corr if the version has it, the strongest for None
+    '''
+    levels = MICRO_LEVELS[version]
+    if err_corr is None:
+        return levels[0]
+    if err_corr not in levels:
+        raise ValueError('{} has no error correction level {}'.format(NAMES[version - 1], err_corr))
+    return err_corr
+
+def placement_coords(modules):
+    '''
+    Empty modules in placement order: 2-column zigzag from the bottom right, up first
+    Column 0 is the timing pattern, so there is no column to skip
+    '''
+    size = len(modules)
+    coords = []
+    upward = True
+    for c in range(size - 1, 0, -2):
+        rows = range(size - 1, -1, -1) if upward else range(size)
+        for r in rows:
+            for c_ in (c, c - 1):
+                if modules[r][c_] is None:
+                    coords.append((r, c_))
+        upward = not upward
+    return coords
+
+def score(modules):
+    '''
+    Dark modules of the right and bottom edges (timing modules excluded)
+    SUM1 * 16 + SUM2 with SUM1 the smaller count; higher is better
+    '''
+    right = sum(1 for row in modules[1:] if row[-1])
+    bottom = sum(1 for module in modules[-1][1:] if module)
+    return right * 16 + bottom if right <= bottom else bottom * 16 + right
+
+def make_small(data, err_corr = None, **options):
+    '''
+    MicroQRcode if data fits M1-M4 at err_corr (None: any level), else a QRcode
+    options: box_size, border (Micro QR default border 2, QR 4)
+    '''
+    if err_corr is None or err_corr in MICRO_LEVELS[4]:
+        q = MicroQRcode(err_corr = err_corr, **options)
+        q.add_data(data)
+        if fit(q.data_list, err_corr) is not None:
+            q.make()
+            return q
+    import QRcode
+    q = QRcode.QRcode(err_corr = constants.ERR_CORR_M if err_corr is None else err_corr, **options)
+    q.add_data(data)
+    q.make()
+    return q
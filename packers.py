@@ -0,0 +1,131 @@
+'''
+Segment packers: the data bits of a segment as one (value, length) int
+    numeric       digits mapped in bulk with bytes.translate, triples combined
+                  arithmetically, 10-bit fields joined from a 1000-entry table
+    alphanumeric  256-entry value LUT, pairs combined in one pass, 11-bit fields
+    byte          the bytes as one int
+Every step is a C-level map/translate/join, one int(..., 2) at the end. Payloads of
+NUMPY_MIN characters or more take a numpy path when numpy is installed.
+Same bits as writing the segment field by field, see util.QRData.write.
+'''
+from importlib.util import find_spec
+from operator import add
+
+import constants
+
+
+NUMPY_MIN = 256 # characters, shorter payloads are faster in pure Python
+_numpy = None
+
+INVALID = 0xff
+
+DIGITS = bytes((c - 0x30) if 0x30 <= c <= 0x39 else INVALID for c in range(256))
+ALPHANUMERIC = bytes(
+    constants.ALPHANUMERIC_NUM.find(c) if c in constants.ALPHANUMERIC_NUM else INVALID for c in range(256))
+
+TIMES_10 = tuple(10 * v for v in range(256))
+TIMES_100 = tuple(100 * v for v in range(256))
+TIMES_45 = tuple(45 * v for v in range(256))
+
+# field value -> its bits as text
+BITS_10 = tuple(format(v, '010b') for v in range(1000))
+BITS_11 = tuple(format(v, '011b') for v in range(45 * 45))
+
+
+def _invalid(data, table, mode):
+    for c in data:
+        if table[c] == INVALID:
+            raise ValueError('{!r} cannot be represented in mode {}'.format(bytes([c]), mode))
+
+def pack_numeric(data):
+    '''
+    (value, length) of digits (bytes), 10 bits per 3 digits, 4 or 7 for the rest
+    '''
+    if len(data) >= NUMPY_MIN and _has_numpy():
+        return _pack_numeric_numpy(data)
+    values = data.translate(DIGITS)
+    if INVALID in values:
+        _invalid(data, DIGITS, constants.NUMERIC_MODE)
+    full = len(values) - len(values) % 3
+    fields = map(add, map(add, map(TIMES_100.__getitem__, values[0:full:3]),
+        map(TIMES_10.__getitem__, values[1:full:3])), values[2:full:3])
+    text = ''.join(map(BITS_10.__getitem__, fields))
+    rest = values[full:]
+    if rest:
+        value = rest[0] if len(rest) == 1 else 10 * rest[0] + rest[1]
+        text += format(value, '04b' if len(rest) == 1 else '07b')
+    return int(text, 2) if text else 0, len(text)
+
+def pack_alphanumeric(data):
+    '''
+    (value, length) of alphanumeric characters (bytes), 11 bits per pair, 6 for the last
+    '''
+    if len(data) >= NUMPY_MIN and _has_numpy():
+        return _pack_alphanumeric_numpy(data)
+    values = data.translate(ALPHANUMERIC)
+    if INVALID in values:
+        _invalid(data, ALPHANUMERIC, constants.ALPHANUMERIC_MODE)
+    full = len(values) & ~1
+    fields = map(add, map(TIMES_45.__getitem__, values[0:full:2]), values[1:full:2])
+    text = ''.join(map(BITS_11.__getitem__, fields))
+    if full < len(values):
+        text += format(values[full], '06b')
+    return int(text, 2) if text else 0, len(text)
+
+def pack_bytes(data):
+    return int.from_bytes(data, 'big'), 8 * len(data)
+
+PACKERS = {
+    constants.NUMERIC_MODE: pack_numeric,
+    constants.ALPHANUMERIC_MODE: pack_alphanumeric,
+    constants.EIGHT_BIT_BYTE_MODE: pack_bytes,
+}
+
+def pack(mode, data):
+    '''
+    (value, length) of the data bits of a segment in mode, anything else packed as bytes
+    '''
+    return PACKERS.get(mode, pack_bytes)(data)
+
+
+def _has_numpy():
+    global _numpy
+    if _numpy is None:
+        _numpy = find_spec('numpy') is not None
+    return _numpy
+
+def _fields_to_int(np, fields, width, tail, tail_width):
+    '''
+    Big-endian concatenation of width-bit fields and an optional tail field
+    '''
+    shifts = np.arange(width - 1, -1, -1, dtype = np.uint16)
+    bits = ((fields[:, None] >> shifts) & 1).astype(np.uint8).ravel()
+    if tail_width:
+        tail_bits = (tail >> np.arange(tail_width - 1, -1, -1)) & 1
+        bits = np.concatenate([bits, tail_bits.astype(np.uint8)])
+    length = len(bits)
+    if not length:
+        return 0, 0
+    value = int.from_bytes(np.packbits(bits).tobytes(), 'big')
+    return value >> (-length % 8), length
+
+def _pack_numeric_numpy(data):
+    import numpy as np
+    values = np.frombuffer(data, np.uint8) - np.uint8(0x30)
+    if (values > 9).any():
+        _invalid(data, DIGITS, constants.NUMERIC_MODE)
+    full = len(values) - len(values) % 3
+    fields = values[:full].reshape(-1, 3).astype(np.uint16) @ np.array([100, 10, 1], np.uint16)
+    rest = values[full:]
+    tail = int(rest[0]) if len(rest) == 1 else int(rest[0]) * 10 + int(rest[1]) if len(rest) else 0
+    return _fields_to_int(np, fields, 10, tail, (0, 4, 7)[len(rest)])
+
+def _pack_alphanumeric_numpy(data):
+    import numpy as np
+    values = np.frombuffer(data.translate(ALPHANUMERIC), np.uint8)
+    if (values == INVALID).any():
+        _invalid(data, ALPHANUMERIC, constants.ALPHANUMERIC_MODE)
+    full = len(values) & ~1
+    fields = values[:full].reshape(-1, 2).astype(np.uint16) @ np.array([45, 1], np.uint16)
+    tail = int(values[full]) if full < len(values) else 0
+    return _fields_to_int(np, fields, 11, tail, 6 if full < len(values) else 0)
@@ -0,0 +1,206 @@
+'''
+Staged encoding pipeline
+    segments -> BitStream -> DataCodewords -> Codewords -> Placement -> Symbol -> Image
+Every stage result is an immutable, hashable named tuple of plain values,
+so it can be cached, pickled and handed over to another process.
+Stage functions are memoized on their (hashable) inputs.
+
+    bits = pipeline.encode(pipeline.segments('QR Code'), constants.ERR_CORR_M)
+    symbol = pipeline.mask(pipeline.place(pipeline.add_ecc(pipeline.pad(bits))))
+    png = pipeline.render(symbol, 'png', box_size = 4)
+'''
+from collections import namedtuple
+from functools import lru_cache
+
+import constants
+import util
+
+
+STAGE_CACHE_SIZE = 1024
+
+
+class Segment(namedtuple('Segment', 'mode data')):
+    '''
+    One mode segment, data in bytes
+    '''
+    __slots__ = ()
+
+    def qr_data(self):
+        return util.QRData(self.data, self.mode)
+
+class BitStream(namedtuple('BitStream', 'version err_corr data length')):
+    '''
+    Segment bits (mode, count, data) for the version, not terminated
+    '''
+    __slots__ = ()
+
+class DataCodewords(namedtuple('DataCodewords', 'version err_corr codewords')):
+    '''
+    Terminated and padded data codewords
+    '''
+    __slots__ = ()
+
+class Codewords(namedtuple('Codewords', 'version err_corr codewords')):
+    '''
+    Final interleaved data and error correction codewords
+    '''
+    __slots__ = ()
+
+class Placement(namedtuple('Placement', 'version err_corr modules')):
+    '''
+    Unmasked matrix, one byte per module row by row, type/version info light
+    '''
+    __slots__ = ()
+
+    def matrix(self):
+        return _matrix(self.modules, self.version)
+
+class Symbol(namedtuple('Symbol', 'version err_corr mask_pattern modules')):
+    '''
+    Finished matrix, one byte per module row by row
+    '''
+    __slots__ = ()
+
+    def matrix(self):
+        return _matrix(self.modules, self.version)
+
+    def get_mat(self, border = 4):
+        '''
+        Matrix with a light border, as QRcode.get_mat
+        '''
+        import render
+        return render.MatrixSource(self.matrix(), border = border).get_mat()
+
+class Image(namedtuple('Image', 'fmt box_size border data')):
+    '''
+    Rendered symbol bytes
+    '''
+    __slots__ = ()
+
+
+def _matrix(modules, version):
+    modules_cnt = version*4 + 17
+    return [
+        [module == 1 for module in modules[r*modules_cnt:(r + 1)*modules_cnt]]
+        for r in range(modules_cnt)
+    ]
+
+def _flatten(mat):
+    return b''.join(bytes(row) for row in mat)
+
+
+def segments(*items):
+    '''
+    Segments of data items (str, bytes or util.QRData), best mode for each
+    '''
+    result = []
+    for item in items:
+        if not isinstance(item, util.QRData):
+            item = util.QRData(item)
+        result.append(Segment(item.mode, item.data))
+    return tuple(result)
+
+@lru_cache(maxsize = STAGE_CACHE_SIZE)
+def encode(segments, err_corr = constants.ERR_CORR_M, version = None):
+    '''
+    Stage 1: segments -> bit stream, version None -> smallest fitting version
+    '''
+    import QRcode
+    q = QRcode.QRcode(version = version, err_corr = err_corr)
+    for segment in segments:
+        q.add_data(segment.qr_data())
+    if version is None:
+        version = q.best_fit()
+    elif version < 1 or version > 40:
+        raise ValueError('Invalid version')
+
+    buffer = util.put_segments(version, q.segments)
+    return BitStream(version, int(err_corr), bytes(buffer.buffer), len(buffer))
+
+@lru_cache(maxsize = STAGE_CACHE_SIZE)
+def pad(bit_stream):
+    '''
+    Stage 2: bit stream -> padded data codewords
+    '''
+    buffer = util.BitBuffer()
+    buffer.buffer = list(bit_stream.data)
+    buffer.length = bit_stream.length
+    util.put_padding(buffer, util.rs_blocks(bit_stream.version, bit_stream.err_corr))
+    return DataCodewords(bit_stream.version, bit_stream.err_corr, bytes(buffer.buffer))
+
+@lru_cache(maxsize = STAGE_CACHE_SIZE)
+def add_ecc(data_codewords):
+    '''
+    Stage 3: data codewords -> interleaved data and error correction codewords
+    '''
+    buffer = util.BitBuffer()
+    buffer.buffer = list(data_codewords.codewords)
+    buffer.length = 8 * len(data_codewords.codewords)
+    blocks = util.rs_blocks(data_codewords.version, data_codewords.err_corr)
+    return Codewords(data_codewords.version, data_codewords.err_corr,
+        bytes(util.put_bytes(buffer, blocks)))
+
+@lru_cache(maxsize = STAGE_CACHE_SIZE)
+def place(codewords):
+    '''
+    Stage 4: codewords -> unmasked matrix
+    '''
+    import QRcode
+    q = QRcode.QRcode(version = codewords.version, err_corr = codewords.err_corr)
+    q.data_cache = list(codewords.codewords)
+    q.makeImpl(True, None)
+    return Placement(codewords.version, codewords.err_corr, _flatten(q.modules))
+
+@lru_cache(maxsize = STAGE_CACHE_SIZE)
+def mask(placement, mask_pattern = None):
+    '''
+    Stage 5: unmasked matrix -> finished symbol, mask_pattern None -> least lost
+    Same choice as QRcode.best_mask_pattern
+    '''
+    import QRcode
+    import mask_pool
+    version = placement.version
+    base = placement.matrix()
+    coords = QRcode.placement_coords(version)
+
+    def apply(mask_pattern):
+        modules = util.copy_mat(base)
+        mask_func = util.mask_function(mask_pattern)
+        for r, c in coords:
+            if mask_func(r, c):
+                modules[r][c] = not modules[r][c]
+        return modules
+
+    if mask_pattern is None:
+        if version >= constants.PARALLEL_MASK_VERSION:
+            mask_pattern = mask_pool.best_mask_pattern(base, version)
+        else:
+            lost = [util.lost_calculator(apply(i)) for i in range(8)]
+            mask_pattern = lost.index(min(lost))
+
+    q = QRcode.QRcode(version = version, err_corr = placement.err_corr)
+    q.modules_cnt = version*4 + 17
+    q.modules = apply(mask_pattern)
+    q.setup_type_info(False, mask_pattern)
+    if version >= 7:
+        q.setup_version_info(False)
+    return Symbol(version, placement.err_corr, mask_pattern, _flatten(q.modules))
+
+
+@lru_cache(maxsize = STAGE_CACHE_SIZE)
+def render(symbol, fmt = 'png', box_size = 10, border = 4):
+    '''
+    Stage 6: symbol -> image bytes in fmt (png, svg, eps, pdf)
+    '''
+    import render as renderers
+    source = renderers.MatrixSource(symbol.matrix(), box_size, border)
+    data = renderers.render_bytes(source, fmt, box_size)
+    return Image(fmt, box_size, border, data)
+
+
+def run(*items, err_corr = constants.ERR_CORR_M, version = None, mask_pattern = None):
+    '''
+    All stages up to the finished symbol
+    '''
+    bit_stream = encode(segments(*items), err_corr, version)
+    return mask(place(add_ecc(pad(bit_stream))), mask_pattern)
@@ -0,0 +1,214 @@
+'''
+Compiled encoder plans for a pinned (version, err_corr, mask_pattern, mode)
+compile_plan does everything that does not depend on the payload once:
+    - block layout and the data capacity
+    - Reed-Solomon remainder tables, one int per (generator, leading factor)
+    - the interleave permutation, folded with the placement order into a gather
+      map: module -> bit of the codeword stream (data blocks then ecc blocks)
+    - the mask, folded into that stream as one int to XOR
+    - the template with type/version info, appended to the stream as constants
+so a call is: pack the bits, one int step per data codeword, one XOR and one gather.
+
+    encode = compile_plan(5, constants.ERR_CORR_M, 3, constants.NUMERIC_MODE)
+    modules = encode('0123456789')
+    png = encode('0123456789', fmt = 'png', box_size = 4)
+Same matrices as QRcode(version, err_corr, mask_pattern = mask_pattern).make(fit = False).
+'''
+from functools import lru_cache
+
+import constants
+import util
+
+
+ZERO_ONE = bytes.maketrans(b'01', b'\x00\x01')
+ONE_ZERO = bytes.maketrans(b'\x00\x01', b'01')
+PADDING = bytes([constants.PAD0, constants.PAD1]) * (util.BIT_LIMIT_TABLE[constants.ERR_CORR_L][40] // 16 + 1)
+
+
+class IntBits:
+    '''
+    util.BitBuffer as one int, for QRData.write
+    '''
+    def __init__(self):
+        self.value = 0
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def put(self, data, length):
+        self.value = (self.value << length) | (data & ((1 << length) - 1))
+        self.length += length
+
+
+@lru_cache(maxsize = None)
+def remainder_table(err_cnt):
+    '''
+    256 ints of err_cnt bytes: generator times each leading factor, without the leading 1
+    '''
+    import QRcode
+    generator = [util.log[g] for g in QRcode.generator_poly(err_cnt)[1:]]
+    table = [0]
+    for factor in range(1, 256):
+        lf = util.log[factor]
+        table.append(int.from_bytes(bytes(util.exponents[(lf + g) % 255] for g in generator), 'big'))
+    return table
+
+def ecc_int(data, table, err_cnt):
+    '''
+    Error correction codewords of data as one int, LFSR division one codeword per step
+    '''
+    shift = 8 * (err_cnt - 1)
+    keep = (1 << (8 * err_cnt)) - 1
+    ecc = 0
+    for codeword in data:
+        ecc = ((ecc << 8) & keep) ^ table[codeword ^ (ecc >> shift)]
+    return ecc
+
+
+class Plan:
+    '''
+    Callable payload -> matrix (or rendered bytes) for one pinned configuration
+    '''
+    def __init__(self, version, err_corr = constants.ERR_CORR_M, mask_pattern = None, mode = None):
+        import QRcode
+        if version < 1 or version > 40:
+            raise ValueError('Invalid version')
+        if mode is not None and mode not in constants.MODE_INDICATORS:
+            raise TypeError('Invalid mode!')
+        if mask_pattern is not None:
+            util.mask_function(mask_pattern) # TypeError as QRcode
+        self.version = version
+        self.err_corr = err_corr
+        self.mask_pattern = mask_pattern
+        self.mode = mode
+        self.modules_cnt = modules_cnt = version*4 + 17
+        self.count_bits = util.bits_number_for_version(version)
+
+        # blocks: (data offset, data count, ecc count, remainder table)
+        self.blocks = []
+        offset = 0
+        for block in util.rs_blocks(version, err_corr):
+            err_cnt = block.total_count - block.data_count
+            self.blocks.append((offset, block.data_count, err_cnt, remainder_table(err_cnt)))
+            offset += block.data_count
+        self.data_cnt = offset
+        total = offset + sum(block[2] for block in self.blocks)
+        self.stream_bits = 8 * total
+
+        # final codeword -> stream codeword
+        data_pos, ecc_pos = [], []
+        for offset, data_cnt, err_cnt, _ in self.blocks:
+            data_pos.append(range(offset, offset + data_cnt))
+        offset = self.data_cnt
+        for _, data_cnt, err_cnt, _ in self.blocks:
+            ecc_pos.append(range(offset, offset + err_cnt))
+            offset += err_cnt
+        source = []
+        for table in (data_pos, ecc_pos):
+            for i in range(max(map(len, table))):
+                for positions in table:
+                    if i < len(positions):
+                        source.append(positions[i])
+
+        # module (row major) -> index into stream bits + constants
+        coords = QRcode.placement_coords(version)
+        q = QRcode.QRcode(version = version, err_corr = err_corr)
+        q.setup_template(True, 0)
+        stream_bit = {}
+        for k, (r, c) in enumerate(coords[:self.stream_bits]):
+            stream_bit[r*modules_cnt + c] = 8*source[k >> 3] + (k & 7)
+        self.gather = []
+        constant_cells = []
+        for r in range(modules_cnt):
+            for c in range(modules_cnt):
+                index = r*modules_cnt + c
+                if index in stream_bit:
+                    self.gather.append(stream_bit[index])
+                else:
+                    self.gather.append(self.stream_bits + len(constant_cells))
+                    constant_cells.append((r, c))
+
+        # per mask: stream mask int, constants with type info (test mode ones for scoring)
+        self.masks = {}
+        masks = range(8) if mask_pattern is None else (mask_pattern,)
+        for m in masks:
+            mask_func = util.mask_function(m)
+            bits = bytearray(self.stream_bits)
+            for k, (r, c) in enumerate(coords[:self.stream_bits]):
+                bits[source[k >> 3]*8 + (k & 7)] = 1 if mask_func(r, c) else 0
+            mask = int(bits.translate(ONE_ZERO), 2)
+            remainder = {(r, c): bool(mask_func(r, c)) for r, c in coords[self.stream_bits:]}
+            tails = []
+            for test in (False, True):
+                q.setup_template(test, m)
+                tails.append(bytes(
+                    remainder[cell] if cell in remainder else q.modules[cell[0]][cell[1]]
+                    for cell in constant_cells))
+            self.masks[m] = (mask, tails[0], tails[1])
+
+    def codeword_bits(self, payload):
+        '''
+        Unmasked codeword stream (data blocks then ecc blocks) as an int
+        '''
+        data = payload if isinstance(payload, util.QRData) else util.QRData(payload, self.mode)
+        bits = IntBits()
+        bits.put(data.mode, 4)
+        bits.put(len(data), self.count_bits[data.mode])
+        data.write(bits)
+
+        capacity = 8 * self.data_cnt
+        if bits.length > capacity:
+            raise OverflowError('Data overflow for current version.')
+        fill = min(capacity - bits.length, 4)
+        fill += -(bits.length + fill) % 8
+        value = bits.value << fill
+        length = (bits.length + fill) // 8
+        codewords = value.to_bytes(length, 'big') + PADDING[:self.data_cnt - length]
+
+        stream = int.from_bytes(codewords, 'big')
+        for offset, data_cnt, err_cnt, table in self.blocks:
+            stream = (stream << (8*err_cnt)) | ecc_int(codewords[offset:offset + data_cnt], table, err_cnt)
+        return stream
+
+    def cells(self, stream, mask_pattern, test = False):
+        '''
+        0/1 per module, row major
+        '''
+        mask, tail, test_tail = self.masks[mask_pattern]
+        bits = format(stream ^ mask, '0{}b'.format(self.stream_bits)).encode('ascii').translate(ZERO_ONE)
+        return bytes(map((bits + (test_tail if test else tail)).__getitem__, self.gather))
+
+    def matrix(self, cells):
+        n = self.modules_cnt
+        return [list(map(bool, cells[r*n:(r + 1)*n])) for r in range(n)]
+
+    def encode(self, payload):
+        '''
+        Matrix of payload, list of rows of bool
+        '''
+        stream = self.codeword_bits(payload)
+        mask_pattern = self.mask_pattern
+        if mask_pattern is None:
+            lost = [util.lost_calculator(self.matrix(self.cells(stream, m, True))) for m in range(8)]
+            mask_pattern = lost.index(min(lost))
+        return self.matrix(self.cells(stream, mask_pattern))
+
+    def __call__(self, payload, fmt = None, box_size = 10, border = 4):
+        '''
+        Matrix of payload, or its bytes rendered in fmt
+        '''
+        modules = self.encode(payload)
+        if fmt is None:
+            return modules
+        import render
+        return render.render_bytes(render.MatrixSource(modules, box_size, border), fmt, box_size)
+
+
+@lru_cache(maxsize = 64)
+def compile_plan(version, err_corr = constants.ERR_CORR_M, mask_pattern = None, mode = None):
+    '''
+    Plan for payloads at a pinned version, error correction level, mask and mode
+    mask_pattern None scores all 8 masks per payload; mode None picks the best mode per payload
+    '''
+    return Plan(version, err_corr, mask_pattern, mode)
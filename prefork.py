@@ -0,0 +1,257 @@
+'''
+Prefork launcher for the web page (app.py)
+The master imports the app, builds every per-version table the workers would
+otherwise build on their first requests (templates, placement coordinates, RS
+generator and parity tables, numpy layouts, Jinja templates), moves that heap to
+the permanent generation with gc.freeze so collections in the workers never write
+to it, then forks the workers. They share one listening socket and inherit the
+warm state copy-on-write.
+
+    python prefork.py --workers 4 --port 8081
+    python prefork.py --workers 4 --lazy          # fork first, every worker warms itself
+    python prefork.py --workers 4 --measure       # ready time, cold latency, private memory
+'''
+import argparse
+import gc
+import json
+import os
+import signal
+import socket
+import sys
+import time
+
+
+ERR_CORRS = (0, 1, 2, 3)
+
+
+def warm(engine = None):
+    '''
+    Build every per-version table, return seconds spent
+    '''
+    start = time.perf_counter()
+    import app
+    import engines
+    import QRcode
+    import util
+
+    engine = engines.resolve(engine)
+    for version in range(1, 41):
+        QRcode.placement_coords(version) # fills cache_qr_mat and cache_coords
+        for err_corr in ERR_CORRS:
+            for block in util.rs_blocks(version, err_corr):
+                util.generator_poly(block.total_count - block.data_count)
+            # parallel = False: no mask_pool processes in the master before fork
+            q = QRcode.QRcode(version = version, err_corr = err_corr, parallel = False, engine = engine)
+            q.add_data('0')
+            q.make(fit = False)
+            q.render('png')
+    for template in ('index.html', 'result.html'):
+        app.app.jinja_env.get_template(template)
+    return time.perf_counter() - start
+
+def memory(pid = 'self'):
+    '''
+    {'rss', 'pss', 'private'} in bytes, from /proc/<pid>/smaps_rollup (Linux)
+    '''
+    fields = {}
+    with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if value.strip().endswith('kB'):
+                fields[name] = int(value.split()[0]) * 1024
+    return {
+        'rss': fields['Rss'],
+        'pss': fields['Pss'],
+        'private': fields['Private_Clean'] + fields['Private_Dirty'],
+    }
+
+def cold_requests():
+    '''
+    One /image/png request per (version, err_corr), numeric payloads filling the version
+    '''
+    from urllib.parse import urlencode
+    import constants
+    import differential
+
+    for version in range(1, 41):
+        for err_corr in ERR_CORRS:
+            length = differential.max_length(constants.NUMERIC_MODE, version, err_corr)
+            yield '/image/png?' + urlencode({'data': '1' * length, 'err_corr': err_corr})
+
+def exercise():
+    '''
+    Serve cold_requests through the app in this process, return latencies in seconds
+    '''
+    import app
+    client = app.app.test_client()
+    latencies = []
+    for url in cold_requests():
+        start = time.perf_counter()
+        response = client.get(url)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError('{} -> {}'.format(url, response.status_code))
+    return latencies
+
+
+class Master:
+    def __init__(self, workers, host = '127.0.0.1', port = 8081, lazy = False, engine = None):
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.lazy = lazy
+        self.engine = engine
+        self.children = {} # pid -> worker index
+        self.stopping = False
+
+    def prepare(self):
+        '''
+        Import (and unless lazy, warm) the app, return seconds spent
+        '''
+        start = time.perf_counter()
+        gc.disable() # no collections while the shared heap is built
+        import app
+        if not self.lazy:
+            warm(self.engine)
+        import mask_pool
+        mask_pool.shutdown() # a pool started by app code would not survive fork
+        gc.freeze()
+        return time.perf_counter() - start
+
+    def fork(self, index, target, *args):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                gc.enable()
+                target(index, *args)
+                code = 0
+            finally:
+                os._exit(code)
+        self.children[pid] = index
+        return pid
+
+    def serve_worker(self, index, sock, ready):
+        from werkzeug.serving import make_server
+        import app
+        server = make_server(self.host, self.port, app.app, threaded = True, fd = sock.fileno())
+        if ready is not None:
+            os.write(ready, b'1')
+            os.close(ready)
+        server.serve_forever()
+
+    def serve(self):
+        '''
+        Fork the workers on a shared socket, respawn any that die, stop on SIGINT/SIGTERM
+        '''
+        start = time.perf_counter()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(128)
+        sock.set_inheritable(True)
+
+        prepare = self.prepare()
+        read, write = os.pipe()
+        for index in range(self.workers):
+            self.fork(index, self.serve_worker, sock, write)
+        os.close(write)
+        for _ in range(self.workers):
+            os.read(read, 1)
+        os.close(read)
+        print('{} {} workers ready on http://{}:{} in {:.2f}s (prepare {:.2f}s)'.format(
+            self.workers, 'lazy' if self.lazy else 'warm', self.host, self.port,
+            time.perf_counter() - start, prepare), flush = True)
+
+        def stop(signum, frame):
+            self.stopping = True
+            for pid in self.children:
+                os.kill(pid, signal.SIGTERM)
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            index = self.children.pop(pid, None)
+            if index is not None and not self.stopping:
+                self.fork(index, self.serve_worker, sock, None)
+        sock.close()
+
+    def measure_worker(self, index, go, results):
+        os.read(go, 1)
+        latencies = exercise()
+        report = dict(memory(), index = index, latencies = latencies)
+        os.write(results, (json.dumps(report) + '\n').encode('ascii'))
+
+    def measure(self):
+        '''
+        Fork the workers, let each serve cold_requests in turn, return (ready seconds, reports)
+        The master keeps its own heap, so private memory of a worker is what it did not share
+        '''
+        start = time.perf_counter()
+        self.prepare()
+        results_read, results_write = os.pipe()
+        gates = []
+        for index in range(self.workers):
+            go_read, go_write = os.pipe()
+            self.fork(index, self.measure_worker, go_read, results_write)
+            os.close(go_read)
+            gates.append(go_write)
+        ready = time.perf_counter() - start
+        os.close(results_write)
+
+        reports = []
+        with os.fdopen(results_read) as results:
+            for gate in gates:
+                os.write(gate, b'1') # one at a time, no contention in the latencies
+                os.close(gate)
+                reports.append(json.loads(results.readline()))
+        for pid in list(self.children):
+            os.waitpid(pid, 0)
+        self.children.clear()
+        return ready, reports
+
+
+def report(lazy, ready, reports):
+    print('{} mode: ready in {:.2f}s'.format('lazy' if lazy else 'warm', ready))
+    print('worker  first(ms)  p99(ms)  total(s)  private(MB)  pss(MB)  rss(MB)')
+    for r in reports:
+        latencies = sorted(r['latencies'])
+        p99 = latencies[min(len(latencies) - 1, int(round(0.99 * (len(latencies) - 1))))]
+        print('{:6d}  {:9.1f}  {:7.1f}  {:8.2f}  {:11.1f}  {:7.1f}  {:7.1f}'.format(
+            r['index'], 1000 * r['latencies'][0], 1000 * p99, sum(latencies),
+            r['private'] / 2**20, r['pss'] / 2**20, r['rss'] / 2**20))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Prefork launcher for the QR code web page')
+    parser.add_argument('--workers', type = int, default = os.cpu_count() or 1)
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8081)
+    parser.add_argument('--engine', default = None)
+    parser.add_argument('--lazy', action = 'store_true', help = 'fork before warming, as the lazy caches do')
+    parser.add_argument('--measure', action = 'store_true',
+        help = 'compare warm and lazy workers on one request per (version, err_corr)')
+    args = parser.parse_args()
+
+    if not args.measure:
+        Master(args.workers, args.host, args.port, args.lazy, args.engine).serve()
+        sys.exit(0)
+
+    # each mode in a fresh interpreter, the first would leave the second warm
+    if 'QRCODE_PREFORK_MODE' not in os.environ:
+        import subprocess
+        for mode in ('lazy', 'warm'):
+            subprocess.run([sys.executable] + sys.argv, check = True,
+                env = dict(os.environ, QRCODE_PREFORK_MODE = mode))
+        sys.exit(0)
+    lazy = os.environ['QRCODE_PREFORK_MODE'] == 'lazy'
+    master = Master(args.workers, lazy = lazy, engine = args.engine)
+    report(lazy, *master.measure())
@@ -0,0 +1,294 @@
+'''
+Vector renderers (SVG, EPS, PDF) built on QRcode.get_mat, and a plain PNG encoder
+Dark modules are merged before output:
+    'rect' -> runs with the same span in consecutive rows become one rectangle
+    'run'  -> horizontal runs of dark modules
+    None   -> one square per module (naive)
+Output is streamed to a binary file object, the border comes from get_mat
+and one module is box_size px (SVG, PNG) or pt (EPS, PDF)
+'''
+import io
+import struct
+import zlib
+
+CHUNK = 512 # shapes per write
+
+
+def row_runs(row):
+    '''
+    Dark runs in one row, yield (start, width)
+    '''
+    x = 0
+    size = len(row)
+    while x < size:
+        if row[x]:
+            start = x
+            while x < size and row[x]:
+                x += 1
+            yield start, x - start
+        else:
+            x += 1
+
+def rectangles(mat):
+    '''
+    Greedy rectangles of dark modules, yield (x, y, width, height)
+    A run is extended downward while the next row has a run with the same span
+    '''
+    opened = {} # (start, width) -> first row
+    for y, row in enumerate(mat):
+        current = set(row_runs(row))
+        for span in [span for span in opened if span not in current]:
+            top = opened.pop(span)
+            yield span[0], top, span[1], y - top
+        for span in row_runs(row):
+            if span not in opened:
+                opened[span] = y
+    for span, top in opened.items():
+        yield span[0], top, span[1], len(mat) - top
+
+def shapes(mat, merge = 'rect'):
+    '''
+    Dark areas of mat in modules, yield (x, y, width, height)
+    '''
+    if merge == 'rect':
+        return rectangles(mat)
+    elif merge == 'run':
+        return ((x, y, w, 1) for y, row in enumerate(mat) for x, w in row_runs(row))
+    elif merge is None:
+        return ((x, y, 1, 1) for y, row in enumerate(mat)
+            for start, w in row_runs(row) for x in range(start, start + w))
+    raise ValueError('Invalid merge {}'.format(merge))
+
+def _stream(f, fmt, shapes):
+    '''
+    Write every shape with fmt, CHUNK shapes per write
+    Return the number of shapes
+    '''
+    count = 0
+    pieces = []
+    for shape in shapes:
+        pieces.append(fmt.format(*shape))
+        count += 1
+        if len(pieces) == CHUNK:
+            f.write(''.join(pieces).encode('ascii'))
+            pieces = []
+    if pieces:
+        f.write(''.join(pieces).encode('ascii'))
+    return count
+
+
+class CountingWriter:
+    '''
+    Count bytes written through to f, PDF needs the offsets
+    '''
+    def __init__(self, f):
+        self.f = f
+        self.offset = 0
+
+    def write(self, data):
+        self.offset += len(data)
+        return self.f.write(data)
+
+
+def write_svg(qr, f, merge = 'rect', box_size = None):
+    '''
+    Write SVG of qr to binary file f, return the number of path segments
+    '''
+    mat = qr.get_mat()
+    box_size = qr.box_size if box_size is None else box_size
+    modules = len(mat)
+    size = modules * box_size
+    f.write((
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{0}" '
+        'viewBox="0 0 {1} {1}" shape-rendering="crispEdges">\n'
+        '<rect width="{1}" height="{1}" fill="#fff"/>\n'
+        '<path fill="#000" d="'
+    ).format(size, modules).encode('ascii'))
+    count = _stream(f, 'M{} {}h{}v{}H{}z', (
+        (x, y, w, h, x) for x, y, w, h in shapes(mat, merge)))
+    f.write(b'"/>\n</svg>\n')
+    return count
+
+def write_eps(qr, f, merge = 'rect', box_size = None):
+    '''
+    Write EPS of qr to binary file f, return the number of rectangles
+    '''
+    mat = qr.get_mat()
+    box_size = qr.box_size if box_size is None else box_size
+    size = len(mat) * box_size
+    f.write((
+        '%!PS-Adobe-3.0 EPSF-3.0\n'
+        '%%BoundingBox: 0 0 {0} {0}\n'
+        '%%EndComments\n'
+        '/r {{rectfill}} bind def\n'
+        '1 setgray 0 0 {0} {0} rectfill 0 setgray\n'
+        '0 {0} translate {1} -{1} scale\n'
+    ).format(size, box_size).encode('ascii'))
+    count = _stream(f, '{} {} {} {} r\n', shapes(mat, merge))
+    f.write(b'showpage\n%%EOF\n')
+    return count
+
+def write_pdf(qr, f, merge = 'rect', box_size = None):
+    '''
+    Write single page PDF of qr to binary file f, return the number of rectangles
+    The content stream length is an indirect object written after the stream
+    '''
+    mat = qr.get_mat()
+    box_size = qr.box_size if box_size is None else box_size
+    size = len(mat) * box_size
+    out = CountingWriter(f)
+    offsets = []
+
+    def begin_obj():
+        offsets.append(out.offset)
+        out.write('{} 0 obj\n'.format(len(offsets)).encode('ascii'))
+
+    out.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    begin_obj()
+    out.write(b'<< /Type /Catalog /Pages 2 0 R >>\nendobj\n')
+    begin_obj()
+    out.write(b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>\nendobj\n')
+    begin_obj()
+    out.write('<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {0} {0}] /Contents 4 0 R >>\nendobj\n'.format(
+        size).encode('ascii'))
+
+    begin_obj()
+    out.write(b'<< /Length 5 0 R >>\nstream\n')
+    start = out.offset
+    out.write('q {0} 0 0 -{0} 0 {1} cm\n'.format(box_size, size).encode('ascii'))
+    count = _stream(out, '{} {} {} {} re\n', shapes(mat, merge))
+    out.write(b'f Q\n')
+    length = out.offset - start
+    out.write(b'endstream\nendobj\n')
+    begin_obj()
+    out.write('{}\nendobj\n'.format(length).encode('ascii'))
+
+    xref = out.offset
+    out.write('xref\n0 {}\n0000000000 65535 f \n'.format(len(offsets) + 1).encode('ascii'))
+    for offset in offsets:
+        out.write('{:010d} 00000 n \n'.format(offset).encode('ascii'))
+    out.write('trailer\n<< /Size {} /Root 1 0 R >>\nstartxref\n{}\n%%EOF\n'.format(
+        len(offsets) + 1, xref).encode('ascii'))
+    return count
+
+class MatrixSource:
+    '''
+    Give a bare module matrix what the writers need from a QRcode
+    modules: list of rows (or 2-D numpy array) without border
+    '''
+    def __init__(self, modules, box_size = 10, border = 4):
+        if hasattr(modules, 'tolist'):
+            modules = modules.tolist()
+        self.modules = modules
+        self.box_size = box_size
+        self.border = border
+
+    def get_mat(self):
+        if not self.border:
+            return self.modules
+        margin = [False] * self.border
+        width = len(self.modules) + 2 * self.border
+        return ([[False] * width for _ in range(self.border)]
+            + [margin + list(row) + margin for row in self.modules]
+            + [[False] * width for _ in range(self.border)])
+
+
+def _png_chunk(f, kind, data):
+    f.write(struct.pack('>I', len(data)))
+    f.write(kind)
+    f.write(data)
+    f.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind))))
+
+def write_png_gray(f, width, height, rows, bit_depth = 8):
+    '''
+    Write grayscale PNG to binary file f
+    rows: height bytes-like scanlines, compressed one by one into IDAT chunks
+    '''
+    f.write(b'\x89PNG\r\n\x1a\n')
+    _png_chunk(f, b'IHDR', struct.pack('>IIBBBBB', width, height, bit_depth, 0, 0, 0, 0))
+    compressor = zlib.compressobj(6)
+    pending = []
+    for row in rows:
+        pending.append(compressor.compress(b'\x00')) # filter type None
+        pending.append(compressor.compress(row))
+        if sum(map(len, pending)) >= 1 << 16:
+            _png_chunk(f, b'IDAT', b''.join(pending))
+            pending = []
+    pending.append(compressor.flush())
+    _png_chunk(f, b'IDAT', b''.join(pending))
+    _png_chunk(f, b'IEND', b'')
+
+def png_rows(mat, box_size):
+    '''
+    1-bit scanlines (dark = 0) of mat, every module replicated into box_size x box_size pixels
+    '''
+    width = len(mat) * box_size
+    padding = '1' * (-width % 8)
+    light, dark = '1' * box_size, '0' * box_size
+    for row in mat:
+        bits = ''.join(dark if module else light for module in row) + padding
+        line = int(bits, 2).to_bytes(len(bits) // 8, 'big')
+        for _ in range(box_size):
+            yield line
+
+def write_png(qr, f, box_size = None):
+    '''
+    Write 1-bit PNG of qr to binary file f
+    Every module is replicated into box_size x box_size pixels, no interpolation
+    '''
+    mat = qr.get_mat()
+    box_size = qr.box_size if box_size is None else box_size
+    width = len(mat) * box_size
+    write_png_gray(f, width, width, png_rows(mat, box_size), bit_depth = 1)
+
+
+VECTOR_WRITERS = {
+    'svg': write_svg,
+    'eps': write_eps,
+    'pdf': write_pdf,
+}
+
+WRITERS = dict(VECTOR_WRITERS, png = write_png)
+
+MIMETYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+    'eps': 'application/postscript',
+    'pdf': 'application/pdf',
+}
+
+def render_bytes(qr, fmt = 'png', box_size = None):
+    '''
+    Render qr in one of WRITERS formats, return bytes
+    '''
+    if fmt not in WRITERS:
+        raise ValueError('Invalid format {}'.format(fmt))
+    if box_size is not None and box_size < 1:
+        raise ValueError('Expect box size > 0.')
+    f = io.BytesIO()
+    WRITERS[fmt](qr, f, box_size = box_size)
+    return f.getvalue()
+
+class Renders:
+    '''
+    Lazy set of renders of one QRcode, keyed by (format, box size)
+    A render is made on first access and cached on the QRcode
+    '''
+    def __init__(self, qr, box_sizes, formats = ('png',)):
+        self.qr = qr
+        self.keys = [(fmt, int(box_size)) for fmt in formats for box_size in box_sizes]
+
+    def __getitem__(self, key):
+        if key not in self.keys:
+            raise KeyError(key)
+        return self.qr.render(*key)
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def items(self):
+        return ((key, self[key]) for key in self.keys)
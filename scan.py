@@ -0,0 +1,456 @@
+'''
+Image reader: every QR code of a grayscale raster in one pass, e.g. a scanned proof sheet
+    binarize   adaptive threshold from integral images over small cells: dark is under
+               the local mean by RATIO; flat areas (local deviation under MIN_STD) take
+               the global Otsu threshold, so large dark modules stay dark
+    finders    dark/light/dark/light/dark runs at 1:1:3:1:1 (the ratio util.lost_count_3
+               penalizes) on all rows and all columns at once, candidates of neighbouring
+               lines grouped; a finder is a row group crossed by a column group
+    symbols    finder triples at about a right angle with arms of about the same length;
+               the version whose timing patterns alternate; the grid is the perspective
+               transform fitted to the finders and the alignment patterns of
+               constants.PATTERN_POSITION; all modules sampled at once, decoder.decode
+
+    for found in scan.scan('sheet.png'):
+        found.result.data, found.result.errors, found.corners
+'''
+import io
+import os
+from collections import namedtuple
+
+import numpy as np
+
+import constants
+import decoder
+
+
+WINDOW_DIVISOR = 8 # threshold window: the shorter image side / WINDOW_DIVISOR
+MIN_WINDOW = 15
+CELLS = 8 # threshold cells across a window
+RATIO = 0.15
+MIN_STD = 10
+MIN_BAND = 0.75 # lines of a finder group, in modules measured along them
+MAX_COS = 0.3 # arms of a finder triple: |cos| of their angle
+MAX_SKEW = 0.25 # and relative length difference
+MIN_TIMING = 0.8 # share of timing modules alternating as they should
+MIN_ALIGNMENT = 23 # of the 25 modules of an alignment pattern
+
+# alignment pattern: (column, row) offsets from its center, dark
+ALIGNMENT = np.array([(i, j) for j in range(-2, 3) for i in range(-2, 3)], np.float64)
+ALIGNMENT_DARK = np.abs(ALIGNMENT).max(1) != 1
+
+
+class Found(namedtuple('Found', 'result corners')):
+    '''
+    result: decoder.Decoded
+    corners: (x, y) in pixels of the symbol corners, top left, top right, bottom right, bottom left
+    '''
+    __slots__ = ()
+
+
+def read_png(f):
+    '''
+    Grayscale pixels (2-d uint8 array) of a PNG read by decoder.read_png_rows
+    '''
+    width, height, bit_depth, channels, rows = decoder.read_png_rows(f)
+    data = np.frombuffer(b''.join(rows), np.uint8).reshape(height, -1)
+    if bit_depth == 1:
+        return np.unpackbits(data, axis = 1)[:, :width] * np.uint8(255)
+    return to_gray(data.reshape(height, width, channels))
+
+def to_gray(image):
+    '''
+    2-d uint8 array of image: a PNG (path, binary file or bytes), a PIL image or an array
+    (gray, RGB or RGBA; bool arrays are dark-is-True matrices)
+    '''
+    if isinstance(image, (str, os.PathLike)):
+        with open(image, 'rb') as f:
+            return read_png(f)
+    if isinstance(image, (bytes, bytearray)):
+        return read_png(io.BytesIO(image))
+    if hasattr(image, 'read'):
+        return read_png(image)
+    if hasattr(image, 'convert'):
+        image = image.convert('L')
+    pixels = np.asarray(image)
+    if pixels.dtype == bool:
+        return np.where(pixels, np.uint8(0), np.uint8(255))
+    if pixels.ndim == 3:
+        if pixels.shape[2] < 3:
+            pixels = pixels[:, :, 0]
+        else:
+            pixels = (pixels[:, :, :3].astype(np.uint32) @ np.array([77, 150, 29], np.uint32)) >> 8
+    if pixels.dtype != np.uint8:
+        pixels = np.clip(pixels, 0, 255).astype(np.uint8)
+    return pixels
+
+
+def otsu(gray):
+    '''
+    Global threshold of gray: dark is under it
+    '''
+    hist = np.bincount(gray.ravel(), minlength = 256).astype(np.float64)
+    weight = np.cumsum(hist)
+    mass = np.cumsum(hist * np.arange(256))
+    total, total_mass = weight[-1], mass[-1]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        between = (total_mass * weight - mass * total) ** 2 / (weight * (total - weight))
+    return int(np.nan_to_num(between, nan = 0, posinf = 0).argmax()) + 1
+
+def _box_sums(padded, window):
+    table = np.zeros((padded.shape[0] + 1, padded.shape[1] + 1))
+    np.cumsum(np.cumsum(padded, 0), 1, out = table[1:, 1:])
+    return table[window:, window:] - table[:-window, window:] - table[window:, :-window] + table[:-window, :-window]
+
+def binarize(gray, window = None, ratio = RATIO, min_std = MIN_STD):
+    '''
+    Dark pixels (2-d bool) of gray: under the mean of the window x window pixels around
+    by ratio, or under the Otsu threshold where their deviation is under min_std
+    Mean and deviation are taken over cells of window / CELLS pixels, one threshold per cell
+    '''
+    gray = to_gray(gray)
+    height, width = gray.shape
+    if window is None:
+        window = max(MIN_WINDOW, min(height, width) // WINDOW_DIVISOR)
+    cell = max(1, window // CELLS)
+    rows, columns = -(-height // cell), -(-width // cell)
+    values = np.pad(gray, ((0, rows*cell - height), (0, columns*cell - width)), mode = 'edge')
+    values = values.astype(np.float32).reshape(rows, cell, columns, cell)
+    radius = window // cell // 2
+    window = 2*radius + 1
+    mean = _box_sums(np.pad(values.mean((1, 3), dtype = np.float64), radius, mode = 'edge'), window) / window**2
+    squares = np.pad((values * values).mean((1, 3), dtype = np.float64), radius, mode = 'edge')
+    deviation = np.sqrt(np.maximum(_box_sums(squares, window) / window**2 - mean * mean, 0))
+    threshold = np.where(deviation < min_std, otsu(gray), mean * (1 - ratio)).astype(np.float32)
+    return gray < threshold.repeat(cell, 0).repeat(cell, 1)[:height, :width]
+
+
+def _ratio(runs):
+    '''
+    (ok, module) of rows of 5 run lengths: 1:1:3:1:1, each run within half a module
+    '''
+    module = runs.sum(1) / 7
+    tolerance = module / 2
+    ok = np.abs(runs[:, 2] - 3*module) < 3*tolerance
+    for k in (0, 1, 3, 4):
+        ok &= np.abs(runs[:, k] - module) < tolerance
+    return ok, module
+
+def _line_candidates(dark):
+    '''
+    (line + 0.5, center, module) of every 1:1:3:1:1 run sequence starting dark along the rows of dark
+    center: middle of the 3-run, module: length of the 5 runs / 7, in pixels
+    '''
+    height, width = dark.shape
+    change = np.empty(dark.shape, bool)
+    change[:, 0] = True
+    np.not_equal(dark[:, 1:], dark[:, :-1], out = change[:, 1:])
+    starts = np.flatnonzero(change)
+    if len(starts) < 5:
+        return np.empty(0), np.empty(0), np.empty(0)
+    lengths = np.diff(starts, append = dark.size)
+    lines = starts // width
+
+    # five runs of one line starting dark; runs alternate, so they are dark/light/dark/light/dark
+    index = np.flatnonzero(dark.ravel()[starts[:-4]] & (lines[:-4] == lines[4:]))
+    runs = np.lib.stride_tricks.sliding_window_view(lengths, 5)[index]
+    ok, module = _ratio(runs)
+    index, runs, module = index[ok], runs[ok], module[ok]
+    center = starts[index + 2] - lines[index]*width + runs[:, 2] / 2
+    return lines[index] + 0.5, center, module
+
+def _groups(lines, centers, modules):
+    '''
+    Candidates (sorted by line) of neighbouring lines with about the same center and module
+    merged, as rows of (line, center, module, count) means
+    '''
+    active, groups = [], []
+    for line, center, module in zip(lines.tolist(), centers.tolist(), modules.tolist()):
+        still = []
+        joined = False
+        for group in active:
+            count = group[3]
+            if line - group[4] > 1 + group[2] / count / 2:
+                groups.append(group)
+                continue
+            still.append(group)
+            if not joined and abs(center - group[1] / count) < module and \
+                    0.67 < module * count / group[2] < 1.5:
+                group[0] += line
+                group[1] += center
+                group[2] += module
+                group[3] += 1
+                group[4] = line
+                joined = True
+        if not joined:
+            still.append([line, center, module, 1, line])
+        active = still
+    groups.extend(active)
+    groups = np.array(groups, np.float64).reshape(-1, 5)
+    groups[:, :3] /= groups[:, 3:4]
+    return groups[:, :4]
+
+def finders(dark):
+    '''
+    (x, y, module) rows of the finder pattern centers of dark, in pixels
+    '''
+    rows = _groups(*_line_candidates(dark)) # y, x, module, count
+    columns = _groups(*_line_candidates(np.ascontiguousarray(dark.T))) # x, y, module, count
+    # lines through the 3x3 center keep the ratio over 3 modules unrotated, about 1.1 measured
+    # modules at 35 degrees; data rarely gives more than one
+    rows = rows[rows[:, 3] >= MIN_BAND * rows[:, 2]]
+    columns = columns[columns[:, 3] >= MIN_BAND * columns[:, 2]]
+    if not len(rows) or not len(columns):
+        return np.empty((0, 3))
+    distance = np.hypot(rows[:, 1, None] - columns[None, :, 0], rows[:, 0, None] - columns[None, :, 1])
+    ratio = rows[:, 2, None] / columns[None, :, 2]
+    distance[(distance >= (rows[:, 2, None] + columns[None, :, 2]) / 2) | (ratio < 0.5) | (ratio > 2)] = np.inf
+    nearest = distance.argmin(1)
+    crossed = np.isfinite(distance[np.arange(len(rows)), nearest])
+
+    # one finder per column group, row groups split by a gap averaged
+    points = {}
+    for row, column in zip(rows[crossed], nearest[crossed].tolist()):
+        x, y, module = columns[column, :3]
+        points.setdefault(column, []).append(((row[1] + x) / 2, (row[0] + y) / 2, (row[2] + module) / 2))
+    points = np.array([np.mean(point, 0) for point in points.values()], np.float64).reshape(-1, 3)
+    return points[_diagonals(dark, points)]
+
+def _center_runs(values, center):
+    '''
+    True if the 5 runs of values around index center (dark) are at 1:1:3:1:1
+    '''
+    if not values[center]:
+        return False
+    starts = np.flatnonzero(values[1:] != values[:-1]) + 1
+    k = np.searchsorted(starts, center, 'right') # run of center
+    if k < 3 or k + 3 > len(starts):
+        return False
+    return bool(_ratio(np.diff(starts[k - 3:k + 3])[None])[0][0])
+
+def _diagonals(dark, points):
+    '''
+    True for (x, y, module) points with 1:1:3:1:1 runs along both diagonals through them
+    Any line through the center of the concentric squares keeps the ratio, whatever the rotation
+    '''
+    if not len(points):
+        return np.zeros(0, bool)
+    reach = int(np.ceil(7 * points[:, 2].max()))
+    steps = np.arange(-reach, reach + 1)
+    ok = np.ones(len(points), bool)
+    for direction in (1, -1):
+        values = _sample(dark, points[:, 0, None] + steps, points[:, 1, None] + direction * steps)
+        ok &= [_center_runs(line, reach) for line in values]
+    return ok
+
+def _triples(points):
+    '''
+    (score, a, b, c) of finder triples that can be the top left (a), top right (b) and
+    bottom left (c) finders of one symbol, best (most square) first
+    '''
+    xy, modules = points[:, :2], points[:, 2]
+    triples = []
+    for a in range(len(points)):
+        arms = xy - xy[a]
+        length = np.hypot(arms[:, 0], arms[:, 1])
+        size = length / modules[a]
+        ratio = modules / modules[a]
+        near = np.flatnonzero((size > 10) & (size < 190) & (ratio > 0.5) & (ratio < 2))
+        if len(near) < 2:
+            continue
+        v, l = arms[near], length[near]
+        cross = v[:, None, 0] * v[None, :, 1] - v[:, None, 1] * v[None, :, 0] # b x c > 0: c clockwise of b
+        cos = (v[:, None, 0] * v[None, :, 0] + v[:, None, 1] * v[None, :, 1]) / (l[:, None] * l[None, :])
+        skew = np.abs(l[:, None] - l[None, :]) / np.maximum(l[:, None], l[None, :])
+        score = np.abs(cos) + skew
+        for i, j in zip(*np.nonzero((cross > 0) & (np.abs(cos) < MAX_COS) & (skew < MAX_SKEW))):
+            triples.append((score[i, j], a, int(near[i]), int(near[j])))
+    triples.sort()
+    return triples
+
+
+def _affine(src, dst):
+    '''
+    3x3 transform taking 3 (column, row) module points to (x, y) pixels
+    '''
+    matrix = np.linalg.solve(np.column_stack([src, np.ones(3)]), dst)
+    return np.vstack([matrix.T, (0, 0, 1)])
+
+def _perspective(src, dst):
+    '''
+    3x3 projective transform taking 4 or more module points to pixels, least squares over 4
+    '''
+    u, v = src[:, 0], src[:, 1]
+    x, y = dst[:, 0], dst[:, 1]
+    one, zero = np.ones(len(src)), np.zeros(len(src))
+    equations = np.vstack([
+        np.column_stack([u, v, one, zero, zero, zero, -u*x, -v*x]),
+        np.column_stack([zero, zero, zero, u, v, one, -u*y, -v*y]),
+    ])
+    h = np.linalg.lstsq(equations, np.concatenate([x, y]), rcond = None)[0]
+    return np.append(h, 1).reshape(3, 3)
+
+def _apply(transform, u, v):
+    '''
+    Pixels (x, y) of module coordinates (u, v), arrays of any shape
+    '''
+    w = transform[2, 0]*u + transform[2, 1]*v + transform[2, 2]
+    return ((transform[0, 0]*u + transform[0, 1]*v + transform[0, 2]) / w,
+        (transform[1, 0]*u + transform[1, 1]*v + transform[1, 2]) / w)
+
+def _sample(dark, x, y):
+    height, width = dark.shape
+    return dark[np.clip(np.floor(y).astype(np.intp), 0, height - 1), np.clip(np.floor(x).astype(np.intp), 0, width - 1)]
+
+def _timing(dark, transform, modules_cnt):
+    '''
+    Share of the timing pattern modules (row 6 and column 6) as they should be
+    '''
+    index = np.arange(8, modules_cnt - 8) + 0.5
+    middle = np.full(len(index), 6.5)
+    expected = (np.arange(8, modules_cnt - 8) % 2) == 0
+    row = _sample(dark, *_apply(transform, index, middle))
+    column = _sample(dark, *_apply(transform, middle, index))
+    return ((row == expected).sum() + (column == expected).sum()) / (2 * len(index))
+
+def _find_alignment(dark, transform, center, radius):
+    '''
+    Pixel center of the alignment pattern expected at module center (u, v), within radius modules; None if not found
+    '''
+    u, v = center
+    origin = np.array(_apply(transform, u, v))
+    step_u = np.array(_apply(transform, u + 1, v)) - origin
+    step_v = np.array(_apply(transform, u, v + 1)) - origin
+    module = max(np.hypot(*step_u), np.hypot(*step_v))
+    reach = radius * module
+    spacing = max(1.0, module / 3)
+    grid = np.arange(-reach, reach + spacing, spacing)
+    positions = (origin + np.stack(np.meshgrid(grid, grid), -1).reshape(-1, 2))
+    offsets = ALIGNMENT[:, :1] * step_u + ALIGNMENT[:, 1:] * step_v
+    points = positions[:, None, :] + offsets[None, :, :]
+    score = (_sample(dark, points[..., 0], points[..., 1]) == ALIGNMENT_DARK).sum(1)
+    best = score.max()
+    if best < MIN_ALIGNMENT:
+        return None
+    candidates = positions[score == best]
+    nearest = candidates[np.hypot(*(candidates - origin).T).argmin()]
+    return candidates[np.hypot(*(candidates - nearest).T) < module].mean(0)
+
+def grid(dark, a, b, c, version):
+    '''
+    Transform of module coordinates to pixels for finder centers a, b, c ((x, y) top left,
+    top right, bottom left): an affine one from the finders, made projective by the
+    alignment patterns found near where it puts them
+    '''
+    modules_cnt = version*4 + 17
+    src = np.array([(3.5, 3.5), (modules_cnt - 3.5, 3.5), (3.5, modules_cnt - 3.5)])
+    dst = np.array([a, b, c], np.float64)
+    transform = _affine(src, dst)
+    positions = constants.PATTERN_POSITION[version]
+    if not positions:
+        return transform
+
+    # bottom right pattern first, far from the finders it shows the perspective most
+    last = positions[-1] + 0.5
+    found = _find_alignment(dark, transform, (last, last), max(3, modules_cnt / 10))
+    if found is None:
+        return transform
+    src = np.vstack([src, (last, last)])
+    dst = np.vstack([dst, found])
+    transform = _perspective(src, dst)
+
+    # then every other pattern, close to where that grid puts them
+    centers = [(c + 0.5, r + 0.5) for r in positions for c in positions
+        if (r, c) != (positions[-1], positions[-1]) and not (min(r, c) == 6 and max(r, c) in (6, positions[-1]))]
+    extra = [(center, _find_alignment(dark, transform, center, 2)) for center in centers]
+    extra = [(center, point) for center, point in extra if point is not None]
+    if extra:
+        src = np.vstack([src, [center for center, _ in extra]])
+        dst = np.vstack([dst, [point for _, point in extra]])
+        transform = _perspective(src, dst)
+    return transform
+
+def _runs(dark, start, end, module):
+    '''
+    Runs along the line start -> end (pixels), runs under half a module merged into their neighbours
+    '''
+    steps = int(np.hypot(*(end - start))) + 1
+    t = np.linspace(0, 1, steps)
+    values = _sample(dark, start[0] + t*(end[0] - start[0]), start[1] + t*(end[1] - start[1]))
+    change = np.flatnonzero(values[1:] != values[:-1]) + 1
+    lengths = np.diff(np.concatenate([[0], change, [steps]]))
+    kept = values[np.concatenate([[0], change])][lengths >= module / 2]
+    return 1 + int(np.count_nonzero(kept[1:] != kept[:-1])) if len(kept) else 0
+
+def read_symbol(dark, a, b, c):
+    '''
+    Found of finders a, b, c ((x, y, module) top left, top right, bottom left), None if it does not decode
+    '''
+    # rows and columns cross a finder rotated by t on 1 / max(|cos t|, |sin t|) of a module
+    top, left = b[:2] - a[:2], c[:2] - a[:2]
+    factor = np.abs(top).max() / np.hypot(*top)
+    module = (a[2] + b[2] + c[2]) / 3 * factor
+    estimate = (np.hypot(*top) + np.hypot(*left)) / 2 / module + 7
+
+    # timing pattern runs between the finders, 3 modules off their centers: the finder
+    # edge, modules 7 to n - 8 (light first and last), the other finder edge
+    down = np.array([-top[1], top[0]]) / np.hypot(*top) * 3 * factor
+    right = np.array([left[1], -left[0]]) / np.hypot(*left) * 3 * factor
+    counted = {_runs(dark, a[:2] + a[2]*down, b[:2] + b[2]*down, module) + 12,
+        _runs(dark, a[:2] + a[2]*right, c[:2] + c[2]*right, module) + 12}
+    counted = sorted((n - 17) // 4 for n in counted if n % 4 == 1 and 21 <= n <= 177)
+    versions = counted + sorted((v for v in range(1, 41) if v not in counted
+        and abs(v*4 + 17 - estimate) <= max(4, 0.15 * estimate)), key = lambda v: abs(v*4 + 17 - estimate))
+
+    # then the timing modules through the grid; unless counted, first through the finders only
+    for version in versions:
+        modules_cnt = version*4 + 17
+        if version not in counted:
+            src = np.array([(3.5, 3.5), (modules_cnt - 3.5, 3.5), (3.5, modules_cnt - 3.5)])
+            if _timing(dark, _affine(src, np.array([a[:2], b[:2], c[:2]])), modules_cnt) < MIN_TIMING:
+                continue
+        transform = grid(dark, a[:2], b[:2], c[:2], version)
+        if _timing(dark, transform, modules_cnt) < MIN_TIMING:
+            continue
+        index = np.arange(modules_cnt) + 0.5
+        x, y = _apply(transform, index[None, :], index[:, None])
+        try:
+            result = decoder.decode(_sample(dark, x, y).tolist())
+        except (ValueError, IndexError): # DecodeError, or garbage that got past Reed-Solomon
+            continue
+        corners = _apply(transform, np.array([0, modules_cnt, modules_cnt, 0]), np.array([0, 0, modules_cnt, modules_cnt]))
+        return Found(result, tuple(zip(corners[0].tolist(), corners[1].tolist())))
+    return None
+
+def _reading_order(found):
+    '''
+    Rows of symbols top to bottom, each left to right
+    '''
+    found = sorted(found, key = lambda f: f.corners[0][1])
+    rows = []
+    for symbol in found:
+        top = symbol.corners[0][1]
+        height = symbol.corners[3][1] - top
+        if rows and top < rows[-1][0] + abs(height) / 2:
+            rows[-1][1].append(symbol)
+        else:
+            rows.append((top, [symbol]))
+    return [symbol for _, row in rows for symbol in sorted(row, key = lambda f: f.corners[0][0])]
+
+def scan(image, window = None):
+    '''
+    Every QR code readable in image (see to_gray) as Found, in reading order
+    window: side of the threshold window in pixels, None -> from the image size
+    '''
+    dark = binarize(image, window)
+    points = finders(dark)
+    used = set()
+    found = []
+    for _, a, b, c in _triples(points):
+        if a in used or b in used or c in used:
+            continue
+        symbol = read_symbol(dark, points[a], points[b], points[c])
+        if symbol is not None:
+            found.append(symbol)
+            used.update((a, b, c))
+    return _reading_order(found)
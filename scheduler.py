@@ -0,0 +1,160 @@
+'''
+Priority scheduler for QRcode generation in the web service
+Work is queued per flow (priority class, client) and dispatched to a fixed set of
+worker threads by weighted fair queuing: every job gets a virtual finish tag
+    start = max(virtual time, finish tag of the flow's previous job)
+    tag = start + cost / weight of its class
+and the eligible queued job with the lowest tag runs next. A client never has more
+than client_cap jobs running, and a job still queued after its deadline is dropped
+(its future raises DeadlineExceeded) instead of being run for nobody.
+Bulk requests are cut into small jobs so interactive work gets in between them.
+'''
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+
+WEIGHTS = {INTERACTIVE: 16, BULK: 1}
+TIMEOUTS = {INTERACTIVE: 2.0, BULK: 120.0} # seconds a job may wait in the queue
+CLIENT_CAP = 2
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Job:
+    __slots__ = ('flow', 'func', 'args', 'deadline', 'tag', 'future')
+
+    def __init__(self, flow, func, args, deadline, tag):
+        self.flow = flow
+        self.func = func
+        self.args = args
+        self.deadline = deadline
+        self.tag = tag
+        self.future = Future()
+
+
+class Scheduler:
+    def __init__(self, workers = None, weights = None, timeouts = None, client_cap = CLIENT_CAP):
+        self.workers = workers or os.cpu_count() or 1
+        self.weights = dict(WEIGHTS, **(weights or {}))
+        self.timeouts = dict(TIMEOUTS, **(timeouts or {}))
+        self.client_cap = client_cap
+        self.lock = threading.Condition()
+        self.queues = {} # (priority, client) -> deque of Job
+        self.finish = {} # (priority, client) -> finish tag of its last queued job
+        self.running = {} # client -> running jobs
+        self.virtual_time = 0.0
+        self.dropped = {} # priority -> jobs dropped at their deadline
+        self.threads = []
+        self.stopped = False
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            self.stopped = False
+            for i in range(self.workers):
+                thread = threading.Thread(target = self.work, name = 'scheduler-{}'.format(i), daemon = True)
+                thread.start()
+                self.threads.append(thread)
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            self.lock.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def submit(self, priority, client, func, *args, cost = 1.0, timeout = None):
+        '''
+        Queue func(*args), return a concurrent.futures.Future
+        '''
+        if priority not in self.weights:
+            raise ValueError('Unknown priority class {!r}'.format(priority))
+        self.start()
+        flow = (priority, client)
+        deadline = time.monotonic() + (self.timeouts[priority] if timeout is None else timeout)
+        with self.lock:
+            start = max(self.virtual_time, self.finish.get(flow, 0.0))
+            tag = start + cost / self.weights[priority]
+            self.finish[flow] = tag
+            job = Job(flow, func, args, deadline, tag)
+            self.queues.setdefault(flow, deque()).append(job)
+            self.lock.notify()
+        return job.future
+
+    def run(self, priority, client, func, *args, cost = 1.0, timeout = None):
+        '''
+        submit and wait for the result
+        '''
+        return self.submit(priority, client, func, *args, cost = cost, timeout = timeout).result()
+
+    def queued(self):
+        '''
+        Number of queued jobs per priority class
+        '''
+        with self.lock:
+            counts = dict.fromkeys(self.weights, 0)
+            for (priority, _), queue in self.queues.items():
+                counts[priority] += len(queue)
+            return counts
+
+    def _next_job(self):
+        '''
+        Lowest-tag eligible job, dropping the expired ones; None if nothing can run. Lock held.
+        '''
+        now = time.monotonic()
+        best = None
+        for flow, queue in list(self.queues.items()):
+            while queue and queue[0].deadline < now:
+                job = queue.popleft()
+                self.dropped[flow[0]] = self.dropped.get(flow[0], 0) + 1
+                job.future.set_exception(DeadlineExceeded('{} job of {} expired in queue'.format(*flow)))
+            if not queue:
+                del self.queues[flow]
+                if self.finish.get(flow, 0.0) <= self.virtual_time:
+                    del self.finish[flow]
+                continue
+            if self.running.get(flow[1], 0) >= self.client_cap:
+                continue
+            if best is None or queue[0].tag < best[0].tag:
+                best = queue
+        if best is None:
+            return None
+        job = best.popleft()
+        if not best:
+            del self.queues[job.flow]
+        self.virtual_time = max(self.virtual_time, job.tag)
+        return job
+
+    def work(self):
+        while True:
+            with self.lock:
+                job = self._next_job()
+                while job is None:
+                    if self.stopped:
+                        return
+                    self.lock.wait(0.05 if self.queues else None)
+                    job = self._next_job()
+                client = job.flow[1]
+                self.running[client] = self.running.get(client, 0) + 1
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    try:
+                        job.future.set_result(job.func(*job.args))
+                    except BaseException as e:
+                        job.future.set_exception(e)
+            finally:
+                with self.lock:
+                    self.running[client] -= 1
+                    if not self.running[client]:
+                        del self.running[client]
+                    self.lock.notify_all()
@@ -0,0 +1,201 @@
+'''
+Sheet renderer: many QR codes laid out on a grid in one page
+Codes are rasterized straight into one preallocated page buffer that is reused
+from page to page, so memory depends on the page size, not on the number of codes
+'''
+import zlib
+
+import numpy as np
+
+import render
+
+
+DARK = 0
+LIGHT = 255
+
+
+def _caption_of(code):
+    if hasattr(code, 'data_list'):
+        return ''.join(data.data.decode('utf-8', 'replace') for data in code.data_list)
+    return None
+
+class Sheet:
+    '''
+    One page of columns x rows cells
+    cell: side of a cell in px, every code is scaled by the largest integer box size fitting in it
+    caption_size: caption font size in pt, 0 -> no captions
+    '''
+    def __init__(self, columns = 4, rows = 6, cell = 300, gutter = 30,
+                caption_size = 8, dpi = 300):
+        if columns < 1 or rows < 1 or cell < 1 or gutter < 0:
+            raise ValueError('Invalid sheet layout.')
+        self.columns = columns
+        self.rows = rows
+        self.cell = cell
+        self.gutter = gutter
+        self.dpi = dpi
+        self.caption_size = caption_size
+        self.caption_height = int(caption_size * dpi / 72 * 1.5) if caption_size else 0
+        self.font = None
+
+        self.width = columns*cell + (columns + 1)*gutter
+        self.height = rows*(cell + self.caption_height) + (rows + 1)*gutter
+        self.pixels = np.full((self.height, self.width), LIGHT, np.uint8)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.pixels.fill(LIGHT)
+        self.count = 0
+
+    def full(self):
+        return self.count == self.columns * self.rows
+
+    def add(self, code, caption = None):
+        '''
+        Place code (QRcode or matrix from get_mat) in the next free cell
+        caption None -> data of a QRcode
+        '''
+        if self.full():
+            raise OverflowError('Sheet is full.')
+        mat = code.get_mat() if hasattr(code, 'get_mat') else code
+        n = len(mat)
+        box = self.cell // n
+        if box < 1:
+            raise ValueError('Cell of {}px is too small for {} modules.'.format(self.cell, n))
+
+        row, column = divmod(self.count, self.columns)
+        top = self.gutter + row*(self.cell + self.caption_height + self.gutter)
+        left = self.gutter + column*(self.cell + self.gutter)
+        offset = (self.cell - n*box) // 2
+
+        # integer replication through a (n, box, n, box) view of the cell, no copy
+        region = self.pixels[top + offset:top + offset + n*box, left + offset:left + offset + n*box]
+        values = np.where(np.asarray(mat, bool), DARK, LIGHT).astype(np.uint8)
+        region.reshape(n, box, n, box)[...] = values[:, None, :, None]
+
+        if caption is None:
+            caption = _caption_of(code)
+        if caption and self.caption_height:
+            self.draw_text(caption, top + self.cell, left)
+
+        self.count += 1
+
+    def draw_text(self, text, top, left):
+        '''
+        Draw text into the caption area of a cell, clipped to the cell width
+        '''
+        from matplotlib import font_manager, ft2font
+        if self.font is None:
+            self.font = ft2font.FT2Font(font_manager.findfont('DejaVu Sans'))
+            self.font.set_size(self.caption_size, self.dpi)
+        self.font.set_text(text, 0.0)
+        self.font.draw_glyphs_to_bitmap(antialiased = True)
+        glyphs = np.asarray(self.font.get_image())
+
+        height = min(glyphs.shape[0], self.caption_height)
+        width = min(glyphs.shape[1], self.cell)
+        left += (self.cell - width) // 2
+        area = self.pixels[top:top + height, left:left + width]
+        np.minimum(area, LIGHT - glyphs[:height, :width], out = area)
+
+    def write_png(self, f):
+        '''
+        Encode the page as PNG to binary file f
+        '''
+        render.write_png_gray(f, self.width, self.height, self.pixels)
+
+    def pdf_image(self):
+        '''
+        Deflated page for a PDF image XObject
+        '''
+        return zlib.compress(self.pixels.tobytes(), 6)
+
+
+def iter_sheets(codes, captions = None, **layout):
+    '''
+    Fill pages with codes, yield the same Sheet object once per page
+    Consume each page before asking for the next one
+    '''
+    sheet = Sheet(**layout)
+    captions = iter(captions) if captions is not None else None
+    for code in codes:
+        sheet.add(code, next(captions) if captions is not None else None)
+        if sheet.full():
+            yield sheet
+            sheet.clear()
+    if len(sheet):
+        yield sheet
+
+def write_png(codes, save_dir, name = 'sheet', captions = None, **layout):
+    '''
+    Write one PNG per page as save_dir/name_<page>.png, return the paths
+    '''
+    import os
+    if not os.path.exists(save_dir):
+        os.mkdir(save_dir)
+
+    paths = []
+    for page, sheet in enumerate(iter_sheets(codes, captions, **layout)):
+        path = os.path.join(save_dir, '{}_{}.png'.format(name, page))
+        with open(path, 'wb') as f:
+            sheet.write_png(f)
+        paths.append(path)
+    return paths
+
+def write_pdf(codes, f, captions = None, **layout):
+    '''
+    Write every page into one PDF streamed to binary file f, return the number of pages
+    '''
+    out = render.CountingWriter(f)
+    offsets = {}
+    pages = []
+
+    def begin_obj(number):
+        offsets[number] = out.offset
+        out.write('{} 0 obj\n'.format(number).encode('ascii'))
+
+    out.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    begin_obj(1)
+    out.write(b'<< /Type /Catalog /Pages 2 0 R >>\nendobj\n')
+
+    number = 2 # the page tree is written last
+    for sheet in iter_sheets(codes, captions, **layout):
+        width = sheet.width * 72 / sheet.dpi
+        height = sheet.height * 72 / sheet.dpi
+        image = sheet.pdf_image()
+        page, content, xobject = number + 1, number + 2, number + 3
+        number = xobject
+        pages.append(page)
+
+        content_data = 'q {:.2f} 0 0 {:.2f} 0 0 cm /Im0 Do Q\n'.format(width, height).encode('ascii')
+        begin_obj(page)
+        out.write((
+            '<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {:.2f} {:.2f}] '
+            '/Resources << /XObject << /Im0 {} 0 R >> >> /Contents {} 0 R >>\nendobj\n'
+        ).format(width, height, xobject, content).encode('ascii'))
+        begin_obj(content)
+        out.write('<< /Length {} >>\nstream\n'.format(len(content_data)).encode('ascii'))
+        out.write(content_data)
+        out.write(b'endstream\nendobj\n')
+        begin_obj(xobject)
+        out.write((
+            '<< /Type /XObject /Subtype /Image /Width {} /Height {} /ColorSpace /DeviceGray '
+            '/BitsPerComponent 8 /Filter /FlateDecode /Length {} >>\nstream\n'
+        ).format(sheet.width, sheet.height, len(image)).encode('ascii'))
+        out.write(image)
+        out.write(b'\nendstream\nendobj\n')
+
+    begin_obj(2)
+    out.write('<< /Type /Pages /Kids [{}] /Count {} >>\nendobj\n'.format(
+        ' '.join('{} 0 R'.format(page) for page in pages), len(pages)).encode('ascii'))
+
+    xref = out.offset
+    out.write('xref\n0 {}\n0000000000 65535 f \n'.format(number + 1).encode('ascii'))
+    for i in range(1, number + 1):
+        out.write('{:010d} 00000 n \n'.format(offsets[i]).encode('ascii'))
+    out.write('trailer\n<< /Size {} /Root 1 0 R >>\nstartxref\n{}\n%%EOF\n'.format(
+        number + 1, xref).encode('ascii'))
+    return len(pages)
@@ -0,0 +1,265 @@
+'''
+Asynchronous output sinks: rendering hands bytes over, a writer thread does the I/O
+    directory   one file per item, directories made once
+    tar / zip   one archive, entries appended
+    pack        one append-only data file + text index (offset length name per line)
+Items go through a bounded queue (rendering blocks when the writer is that far
+behind) and are written in batches; with fsync = True every batch is made durable
+once, not every file. An error of the writer is raised in the producer on the next
+write or on close.
+
+    with sink.open_sink('codes.pack', fsync = True) as out:
+        for i, image in enumerate(QRcode.iter_encode(payloads, fmt = 'png')):
+            out.write('{:08d}.png'.format(i), image)
+'''
+import io
+import os
+import queue
+import tarfile
+import threading
+import time
+import zipfile
+
+
+QUEUE_SIZE = 256 # items waiting for the writer
+BATCH_SIZE = 64 # items per batch
+BATCH_BYTES = 4 << 20
+
+_STOP = object()
+
+
+class DirectoryBackend:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok = True)
+        self.dirs = {path}
+
+    def write_batch(self, items, fsync):
+        files = []
+        for name, data in items:
+            path = os.path.join(self.path, name)
+            directory = os.path.dirname(path)
+            if directory not in self.dirs:
+                os.makedirs(directory, exist_ok = True)
+                self.dirs.add(directory)
+            f = open(path, 'wb')
+            f.write(data)
+            files.append(f)
+        for f in files:
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+            f.close()
+        if fsync:
+            for directory in {os.path.dirname(f.name) for f in files}:
+                fd = os.open(directory, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+    def close(self):
+        pass
+
+
+class _FileBackend:
+    '''
+    Backends writing one file, fsync flushes the file once per batch
+    '''
+    def sync(self, f):
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class TarBackend(_FileBackend):
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.tar = tarfile.open(fileobj = self.file, mode = 'w')
+        self.mtime = time.time()
+
+    def write_batch(self, items, fsync):
+        for name, data in items:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = self.mtime
+            self.tar.addfile(info, io.BytesIO(data))
+        if fsync:
+            self.sync(self.file)
+
+    def close(self):
+        self.tar.close()
+        self.file.close()
+
+
+class ZipBackend(_FileBackend):
+    def __init__(self, path, compression = zipfile.ZIP_STORED):
+        self.file = open(path, 'wb')
+        self.zip = zipfile.ZipFile(self.file, 'w', compression)
+
+    def write_batch(self, items, fsync):
+        for name, data in items:
+            self.zip.writestr(name, data)
+        if fsync:
+            self.sync(self.file)
+
+    def close(self):
+        self.zip.close()
+        self.file.close()
+
+
+class PackBackend(_FileBackend):
+    '''
+    Data appended to path, 'offset length name' lines appended to path + '.idx'
+    The index is written after the data of its batch, so an indexed item is complete
+    '''
+    def __init__(self, path):
+        self.file = open(path, 'ab')
+        self.index = open(path + '.idx', 'a', encoding = 'utf-8')
+        self.offset = self.file.seek(0, os.SEEK_END)
+
+    def write_batch(self, items, fsync):
+        lines = []
+        for name, data in items:
+            self.file.write(data)
+            lines.append('{} {} {}\n'.format(self.offset, len(data), name))
+            self.offset += len(data)
+        self.file.flush()
+        if fsync:
+            self.sync(self.file)
+        self.index.write(''.join(lines))
+        self.index.flush()
+        if fsync:
+            self.sync(self.index)
+
+    def close(self):
+        self.file.close()
+        self.index.close()
+
+
+BACKENDS = {
+    'directory': DirectoryBackend,
+    'tar': TarBackend,
+    'zip': ZipBackend,
+    'pack': PackBackend,
+}
+
+
+class Sink:
+    '''
+    Bounded queue in front of a backend, drained in batches by one writer thread
+    '''
+    def __init__(self, backend, fsync = False, queue_size = QUEUE_SIZE,
+                batch_size = BATCH_SIZE, batch_bytes = BATCH_BYTES):
+        self.backend = backend
+        self.fsync = fsync
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.queue = queue.Queue(queue_size)
+        self.error = None
+        self.written = 0
+        self.batches = 0
+        self.closed = False
+        self.thread = threading.Thread(target = self.run, name = 'sink-writer', daemon = True)
+        self.thread.start()
+
+    def write(self, name, data):
+        '''
+        Queue data to be written as name, blocks while the queue is full
+        '''
+        if self.closed:
+            raise ValueError('write to a closed sink')
+        self.check()
+        self.queue.put((name, bytes(data)))
+
+    def check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def run(self):
+        stop = False
+        while not stop:
+            item = self.queue.get()
+            batch = []
+            size = 0
+            while True:
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+                size += len(item[1])
+                if len(batch) >= self.batch_size or size >= self.batch_bytes:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch and self.error is None:
+                try:
+                    self.backend.write_batch(batch, self.fsync)
+                    self.written += len(batch)
+                    self.batches += 1
+                except BaseException as e:
+                    self.error = e # items after an error are dropped, raised in the producer
+
+    def close(self):
+        '''
+        Write everything queued, close the backend, raise a writer error
+        '''
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(_STOP)
+        self.thread.join()
+        try:
+            self.backend.close()
+        finally:
+            self.check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_sink(target, kind = None, fsync = False, **options):
+    '''
+    Sink writing to target, kind from the extension (.tar, .zip, .pack) unless given
+    Anything else is a directory
+    '''
+    if kind is None:
+        kind = os.path.splitext(target)[1].lstrip('.').lower()
+        if kind not in BACKENDS:
+            kind = 'directory'
+    if kind not in BACKENDS:
+        raise ValueError('Unknown sink {!r}, expected one of {}'.format(kind, tuple(BACKENDS)))
+    return Sink(BACKENDS[kind](target), fsync, **options)
+
+def read_pack(path):
+    '''
+    Yield (name, data) of a pack file in write order
+    '''
+    with open(path, 'rb') as f, open(path + '.idx', encoding = 'utf-8') as index:
+        for line in index:
+            offset, length, name = line.rstrip('\n').split(' ', 2)
+            f.seek(int(offset))
+            yield name, f.read(int(length))
+
+def save_many(payloads, target, err_corr = None, fmt = 'png', names = '{:08d}', fsync = False,
+            box_size = 10, border = 4, **options):
+    '''
+    Render payloads with QRcode.iter_encode into a sink at target, return the number written
+    names: format string of the item index, the extension fmt is added
+    '''
+    import constants
+    import QRcode
+    if err_corr is None:
+        err_corr = constants.ERR_CORR_M
+    count = 0
+    with open_sink(target, fsync = fsync, **options) as out:
+        images = QRcode.iter_encode(payloads, err_corr, fmt = fmt, box_size = box_size, border = border)
+        for index, image in enumerate(images):
+            out.write('{}.{}'.format(names.format(index), fmt), image)
+            count += 1
+    return count
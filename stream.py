@@ -0,0 +1,259 @@
+'''
+Streaming encoder with object reuse
+iter_encode consumes payloads lazily and yields finished matrices (or rendered bytes).
+Bit writer, codeword arrays and the eight candidate matrices are preallocated once
+per version and reused for every payload, so peak memory does not depend on the
+length of the stream. A yielded matrix is scratch: it is valid until the next item,
+pass copy = True to keep it.
+'''
+from bisect import bisect_left
+
+import constants
+import util
+
+
+def data_bits(mode, length):
+    '''
+    Number of data bits of a segment, as QRData.write produces
+    '''
+    if mode == constants.NUMERIC_MODE:
+        return 10 * (length // 3) + (0, 4, 7)[length % 3]
+    elif mode == constants.ALPHANUMERIC_MODE:
+        return 11 * (length // 2) + 6 * (length % 2)
+    return 8 * length
+
+def fit_version(mode, length, err_corr, start = None, extra_bits = 0):
+    '''
+    Same version as QRcode.best_fit, without writing the bits
+    extra_bits: header bits in front of the segment (Structured Append)
+    '''
+    if start is None:
+        start = 1
+    if start < 1 or start > 40:
+        raise ValueError("Invalid version")
+    bits_number = util.bits_number_for_version(start)
+    bits_needed = extra_bits + 4 + bits_number[mode] + data_bits(mode, length)
+    version = bisect_left(util.BIT_LIMIT_TABLE[err_corr], bits_needed, start)
+    if version > 40:
+        raise OverflowError("Data Overflow!")
+    if bits_number is not util.bits_number_for_version(version):
+        return fit_version(mode, length, err_corr, version, extra_bits)
+    return version
+
+
+class BitWriter:
+    '''
+    util.BitBuffer over a preallocated bytearray
+    '''
+    def __init__(self, capacity):
+        self.buffer = bytearray(capacity)
+        self.zeros = bytes(capacity)
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def reset(self):
+        self.buffer[:] = self.zeros
+        self.length = 0
+
+    def set(self, bit = 1):
+        if bit:
+            self.buffer[self.length >> 3] |= 0x80 >> (self.length & 7)
+        self.length += 1
+
+    def put(self, data, length):
+        if not length:
+            return
+        # the bits shifted to end on a byte boundary, OR-ed over the bytes they cover
+        end = self.length + length
+        start = self.length >> 3
+        stop = (end + 7) >> 3
+        if stop > len(self.buffer):
+            raise OverflowError('Data overflow for current version.')
+        chunk = (((data & ((1 << length) - 1))) << (-end & 7)).to_bytes(stop - start, 'big')
+        self.buffer[start] |= chunk[0]
+        self.buffer[start + 1:stop] = chunk[1:]
+        self.length = end
+
+
+class VersionScratch:
+    '''
+    Everything preallocated for one (version, err_corr)
+    '''
+    def __init__(self, version, err_corr):
+        import QRcode
+        self.version = version
+        self.modules_cnt = version*4 + 17
+        self.blocks = util.rs_blocks(version, err_corr)
+        data_total = sum(block.data_count for block in self.blocks)
+        total = sum(block.total_count for block in self.blocks)
+
+        self.bits = BitWriter(data_total)
+        self.codewords = bytearray(total)
+        self.ecc = bytearray(max(block.total_count - block.data_count for block in self.blocks))
+
+        # generator polynomials in log form, without the leading 1
+        self.generators = {}
+        for block in self.blocks:
+            err_cnt = block.total_count - block.data_count
+            self.generators[err_cnt] = [util.log[g] for g in QRcode.generator_poly(err_cnt)[1:]]
+
+        # final index of data codeword / ecc codeword i of every block
+        self.data_index, self.ecc_index = [], []
+        for block in self.blocks:
+            self.data_index.append([0] * block.data_count)
+            self.ecc_index.append([0] * (block.total_count - block.data_count))
+        index = 0
+        for table in (self.data_index, self.ecc_index):
+            for i in range(max(map(len, table))):
+                for positions in table:
+                    if i < len(positions):
+                        positions[i] = index
+                        index += 1
+
+        self.coords = QRcode.placement_coords(version)
+        masks = [util.mask_function(i) for i in range(8)]
+        self.mask_bits = [[bool(mask(r, c)) for mask in masks] for r, c in self.coords]
+
+        q = QRcode.QRcode(version = version, err_corr = err_corr)
+        q.setup_template(True, None)
+        self.candidates = [util.copy_mat(q.modules) for _ in range(8)]
+        for candidate in self.candidates:
+            for r, c in self.coords:
+                candidate[r][c] = False
+        # type/version info modules, False in test mode
+        self.info_cells = [
+            (r, c) for r in range(self.modules_cnt) for c in range(self.modules_cnt)
+            if q.modules[r][c] is False and QRcode.cache_qr_mat[version][r][c] is None]
+        self.info_values = {}
+        for mask_pattern in range(8):
+            q.setup_template(False, mask_pattern)
+            self.info_values[mask_pattern] = [q.modules[r][c] for r, c in self.info_cells]
+        self.dirty = None # candidate holding type/version info of the last item
+
+    def put_ecc(self, data, offset, data_cnt, err_cnt, index):
+        '''
+        Remainder of one block by LFSR division, written straight to the final codewords
+        '''
+        ecc = self.ecc
+        generator = self.generators[err_cnt]
+        exponents = util.exponents
+        log = util.log
+        for j in range(err_cnt):
+            ecc[j] = 0
+        for i in range(offset, offset + data_cnt):
+            factor = data[i] ^ ecc[0]
+            if factor:
+                lf = log[factor]
+                for j in range(err_cnt - 1):
+                    ecc[j] = ecc[j + 1] ^ exponents[(lf + generator[j]) % 255]
+                ecc[err_cnt - 1] = exponents[(lf + generator[err_cnt - 1]) % 255]
+            else:
+                for j in range(err_cnt - 1):
+                    ecc[j] = ecc[j + 1]
+                ecc[err_cnt - 1] = 0
+        codewords = self.codewords
+        for j in range(err_cnt):
+            codewords[index[j]] = ecc[j]
+
+
+class StreamEncoder:
+    '''
+    Encode payloads one by one into reused scratch buffers
+    '''
+    def __init__(self, err_corr = constants.ERR_CORR_M, version = None, mask_pattern = None, fit = True):
+        if not fit and version is None:
+            raise ValueError('A fixed version is needed without fit')
+        self.err_corr = int(err_corr)
+        self.version = version
+        self.fit = fit # False -> always the given version, as QRcode.make(fit = False)
+        self.mask_pattern = mask_pattern
+        self.scratch = {}
+
+    def encode(self, payload):
+        '''
+        Matrix of payload, valid until the next call
+        '''
+        data = payload if isinstance(payload, util.QRData) else util.QRData(payload)
+        if self.fit:
+            version = fit_version(data.mode, len(data), self.err_corr, self.version)
+        else:
+            version = self.version
+        return self.place(version, (data,))
+
+    def place(self, version, data_list):
+        '''
+        Matrix of data_list (util.QRData segments) at version, valid until the next call
+        '''
+        if version not in self.scratch:
+            self.scratch[version] = VersionScratch(version, self.err_corr)
+        s = self.scratch[version]
+
+        # data codewords
+        bits = s.bits
+        bits.reset()
+        bits_number = util.bits_number_for_version(version)
+        for data in data_list:
+            bits.put(data.mode, 4)
+            bits.put(len(data), bits_number[data.mode])
+            data.write(bits)
+        util.put_padding(bits, s.blocks)
+
+        # error correction and interleaving
+        offset = 0
+        codewords = s.codewords
+        for r, block in enumerate(s.blocks):
+            index = s.data_index[r]
+            for i in range(block.data_count):
+                codewords[index[i]] = bits.buffer[offset + i]
+            s.put_ecc(bits.buffer, offset, block.data_count,
+                block.total_count - block.data_count, s.ecc_index[r])
+            offset += block.data_count
+
+        # restore test-mode type/version info left by the last item
+        if s.dirty is not None:
+            for r, c in s.info_cells:
+                s.dirty[r][c] = False
+            s.dirty = None
+
+        # place into the candidates
+        candidates = s.candidates
+        length = len(codewords) * 8
+        masks = range(8) if self.mask_pattern is None else (self.mask_pattern,)
+        for k, (r, c) in enumerate(s.coords):
+            dark = k < length and ((codewords[k >> 3] >> (7 - (k & 7))) & 1) == 1
+            mask_bits = s.mask_bits[k]
+            for m in masks:
+                candidates[m][r][c] = dark != mask_bits[m]
+
+        if self.mask_pattern is None:
+            lost = [util.lost_calculator(candidate) for candidate in candidates]
+            mask_pattern = lost.index(min(lost))
+        else:
+            mask_pattern = self.mask_pattern
+
+        modules = candidates[mask_pattern]
+        for (r, c), value in zip(s.info_cells, s.info_values[mask_pattern]):
+            modules[r][c] = value
+        s.dirty = modules
+        return modules
+
+
+def iter_encode(payloads, err_corr = constants.ERR_CORR_M, version = None, mask_pattern = None,
+                fmt = None, box_size = 10, border = 4, copy = False):
+    '''
+    Yield the matrix (or rendered bytes in fmt) of each payload lazily
+    Matrices are reused scratch unless copy = True
+    '''
+    encoder = StreamEncoder(err_corr, version, mask_pattern)
+    if fmt is not None:
+        import render
+    for payload in payloads:
+        modules = encoder.encode(payload)
+        if fmt is not None:
+            yield render.render_bytes(render.MatrixSource(modules, box_size, border), fmt, box_size)
+        elif copy:
+            yield util.copy_mat(modules)
+        else:
+            yield modules
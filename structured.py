@@ -0,0 +1,112 @@
+'''
+Structured Append: one payload over up to 16 linked symbols
+Every symbol starts with a util.StructuredAppend header (position, total, parity of
+the whole data). The splitter estimates the generation cost of every part count from
+the module area of the fitted versions and picks the cheapest plan, parts are made in
+the mask_pool processes.
+
+    codes = structured.make(open('notes.txt', 'rb').read(), constants.ERR_CORR_M)
+    for i, q in enumerate(codes):
+        q.make_image(name = 'part {}'.format(i))
+'''
+import os
+
+import constants
+import util
+import stream
+
+
+HEADER_BITS = 20 # mode indicator + position + total + parity
+PART_OVERHEAD = 256 # fixed cost of one symbol, in modules
+
+
+def cut(data, count):
+    '''
+    count slices of data of about equal length, never inside a utf-8 character
+    '''
+    bounds = [0]
+    for i in range(1, count):
+        pos = max(bounds[-1], len(data) * i // count)
+        while 0 < pos < len(data) and (data[pos] & 0xc0) == 0x80:
+            pos += 1
+        bounds.append(pos)
+    bounds.append(len(data))
+    return [data[start:end] for start, end in zip(bounds, bounds[1:]) if end > start]
+
+def fit_parts(chunks, err_corr):
+    '''
+    Version of every chunk behind a Structured Append header, None if one does not fit
+    '''
+    versions = []
+    for chunk in chunks:
+        data = util.QRData(chunk)
+        try:
+            versions.append(stream.fit_version(data.mode, len(data), err_corr, extra_bits = HEADER_BITS))
+        except OverflowError:
+            return None
+    return versions
+
+def plan_cost(versions, workers):
+    '''
+    (estimated wall time, total module area) of making the symbols on workers processes
+    Generation time is taken as linear in module area, parts scheduled largest first
+    '''
+    loads = [0] * workers
+    areas = sorted(((version*4 + 17) ** 2 for version in versions), reverse = True)
+    for area in areas:
+        loads[loads.index(min(loads))] += area + PART_OVERHEAD
+    return max(loads), sum(areas)
+
+def split(data, err_corr = constants.ERR_CORR_M, parts = None, workers = 1):
+    '''
+    Chunks of data (bytes), parts None -> the part count of the cheapest plan
+    '''
+    counts = range(1, constants.MAX_STRUCTURED_APPEND + 1) if parts is None else (parts,)
+    best, best_cost = None, None
+    for count in counts:
+        chunks = cut(data, count)
+        if len(chunks) != count:
+            continue
+        versions = fit_parts(chunks, err_corr)
+        if versions is None:
+            continue
+        cost = plan_cost(versions, workers)
+        if best_cost is None or cost < best_cost:
+            best, best_cost = chunks, cost
+    if best is None:
+        raise OverflowError('Data Overflow!')
+    return best
+
+def _make_part(header, chunk, err_corr, options):
+    import QRcode
+    q = QRcode.QRcode(err_corr = err_corr, parallel = False, **options)
+    q.add_data(header)
+    q.add_data(chunk)
+    q.make()
+    return q
+
+def make(data, err_corr = constants.ERR_CORR_M, parts = None, parallel = None, **options):
+    '''
+    QRcode objects of the linked symbols, in order
+    parallel None -> in processes when there is more than one CPU
+    options: QRcode options (box_size, border, mask_pattern, compress)
+    compress = True deflates the whole payload before it is split when that makes it
+    shorter, decoder.join(results, compressed = True) gives it back
+    '''
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    if options.pop('compress', False):
+        import compress
+        data = compress.smallest(data)
+    if parallel is None:
+        parallel = (os.cpu_count() or 1) > 1
+    workers = min(8, os.cpu_count() or 1) if parallel else 1
+
+    chunks = split(data, err_corr, parts, workers)
+    check = util.parity(data)
+    headers = [util.StructuredAppend(i, len(chunks), check) for i in range(len(chunks))]
+    if parallel and len(chunks) > 1:
+        import mask_pool
+        return list(mask_pool.get_pool().map(_make_part, headers, chunks,
+            [err_corr] * len(chunks), [options] * len(chunks)))
+    return [_make_part(header, chunk, err_corr, options) for header, chunk in zip(headers, chunks)]
@@ -1,5 +1,6 @@
 
 import constants
+import packers
 
 
 class RSBlock:
@@ -133,24 +134,8 @@ class QRData:
         return len(self.data)
 
     def write(self, buffer):
-        if self.mode == constants.NUMERIC_MODE:
-            for i in range(0,len(self.data), 3):
-                chars = self.data[i:i+3]
-                bit_length = constants.NUMBER_LENGTH[len(chars)]
-                buffer.put(int(chars), bit_length)
-        elif self.mode == constants.ALPHANUMERIC_MODE:
-            for i in range(0, len(self.data), 2):
-                chars = self.data[i:i+2]
-                if len(chars) > 1:
-                    buffer.put(constants.ALPHANUMERIC_NUM.find(chars[0]) * 45
-                    + constants.ALPHANUMERIC_NUM.find(chars[1]), 11)
-                else:
-                    buffer.put(constants.ALPHANUMERIC_NUM.find(chars[0]),6)
-        else:
-            data = self.data
-            for c in data:
-                buffer.put(c, 8) # utf-8 without simple compression
-        
+        value, length = packers.pack(self.mode, self.data)
+        buffer.put(value, length)
 
     def __repr__(self):
         return repr(self.data)
@@ -169,6 +154,41 @@ class QRData:
 
 
 
+class StructuredAppend:
+    '''
+    Structured Append header, first in the data list of every linked symbol
+    index: 0-based position, total: number of symbols, parity: XOR of all data bytes
+    '''
+    mode = constants.STRUCTURED_APPEND_MODE
+
+    def __init__(self, index, total, parity):
+        if not 0 <= index < total <= constants.MAX_STRUCTURED_APPEND:
+            raise ValueError('Invalid symbol position {} of {}'.format(index, total))
+        self.index = index
+        self.total = total
+        self.parity = parity & 0xff
+
+    def __len__(self):
+        return 0 # no character count indicator
+
+    def write(self, buffer):
+        buffer.put(self.index, 4)
+        buffer.put(self.total - 1, 4)
+        buffer.put(self.parity, 8)
+
+    def __repr__(self):
+        return 'StructuredAppend({}, {}, {:#04x})'.format(self.index, self.total, self.parity)
+
+def parity(data):
+    '''
+    Structured Append parity of data (bytes)
+    '''
+    result = 0
+    for byte in data:
+        result ^= byte
+    return result
+
+
 class BitBuffer:
     '''
     Library to store data by bit
@@ -206,10 +226,26 @@ class BitBuffer:
 
     def put(self, data, length):
         '''
-        put num by bit
+        put the low length bits of num, MSB first
         '''
-        for i in range(length):
-            self.set(((data >> (length-i-1)) & 1) == 1)
+        data &= (1 << length) - 1
+        used = self.length & 7
+        if used:
+            free = 8 - used
+            if length <= free:
+                self.buffer[-1] |= data << (free - length)
+                self.length += length
+                return
+            length -= free
+            self.buffer[-1] |= data >> length
+            data &= (1 << length) - 1
+            self.length += free
+        full, rest = divmod(length, 8)
+        if full:
+            self.buffer.extend((data >> rest).to_bytes(full, 'big'))
+        if rest:
+            self.buffer.append((data & ((1 << rest) - 1)) << (8 - rest))
+        self.length += length
 
 
 def bits_number_for_version(version):
@@ -257,6 +293,15 @@ def put_data(version, err_corr, datalist):
     '''
     Data encodation process
     '''
+    buffer = put_segments(version, datalist)
+    blocks = rs_blocks(version, err_corr=err_corr)
+    put_padding(buffer, blocks)
+    return put_bytes(buffer, blocks)
+
+def put_segments(version, datalist):
+    '''
+    Mode indicator, character count and data bits of every segment
+    '''
     buffer = BitBuffer()
     for data in datalist:
         buffer.put(data.mode, 4)
@@ -266,9 +311,13 @@ def put_data(version, err_corr, datalist):
             raise TypeError('Invalid mode')
         
         data.write(buffer)
+    return buffer
 
+def put_padding(buffer, blocks):
+    '''
+    Terminator and pad codewords up to the data capacity of blocks
+    '''
     # Calculate the maximum bits
-    blocks = rs_blocks(version, err_corr=err_corr)
     max_bit = sum(b.data_count * 8 for b in blocks)
     if len(buffer) > max_bit:
         raise OverflowError('Data overflow for current version.')
@@ -291,7 +340,30 @@ def put_data(version, err_corr, datalist):
         else:
             buffer.put(constants.PAD0, 8)
 
-    return put_bytes(buffer, blocks)
+    return buffer
+
+def generator_poly(err_cnt):
+    '''
+    Coefficients of the generator polynomial for err_cnt error correction codewords
+    '''
+    if err_cnt in constants.rsPoly:
+        return constants.rsPoly[err_cnt]
+    Poly = Polynomial([1], 0)
+    for i in range(err_cnt):
+        Poly = Poly * Polynomial([1, _exp(i)], 0)
+    return Poly.num
+
+def ecc_codewords(data, err_cnt):
+    '''
+    Error correction codewords of one block, as in put_bytes
+    '''
+    Poly = Polynomial(generator_poly(err_cnt), 0)
+    modPoly = Polynomial(list(data), len(Poly) - 1) % Poly
+    ecc = [0] * (len(Poly) - 1)
+    for i in range(len(ecc)):
+        modIndex = len(modPoly) - len(ecc) + i
+        ecc[i] = modPoly[modIndex] if (modIndex >= 0) else 0
+    return ecc
 
 def put_bytes(buffer, rs_blocks):
     '''
@@ -320,12 +392,7 @@ def put_bytes(buffer, rs_blocks):
         offset += data_cnt
 
         # Get error correction Polynomal
-        if err_cnt in constants.rsPoly:
-            Poly = Polynomial(constants.rsPoly[err_cnt], 0)
-        else:
-            Poly = Polynomial([1], 0)
-            for i in range(err_cnt):
-                Poly = Poly * Polynomial([1, _exp(i)], 0)
+        Poly = Polynomial(generator_poly(err_cnt), 0)
 
         rawPoly = Polynomial(data_encode[r], len(Poly) - 1)
 
@@ -352,12 +419,44 @@ def put_bytes(buffer, rs_blocks):
 
     return data
 
+def placement_coords(modules):
+    '''
+    Coordinates of the empty(data) modules in placement order
+    Same upward/downward zigzag as QRcode.mapping, see in 8.7.3
+    '''
+    modules_cnt = len(modules)
+    coords = []
+    increment = -1
+    r = modules_cnt - 1
+
+    for c in range(modules_cnt - 1, 0, -2):
+        if c <= 6:
+            c -= 1
+        col_range = (c, c-1)
+
+        while True:
+            for c_ in col_range:
+                if modules[r][c_] is None:
+                    coords.append((r, c_))
+
+            r += increment
+
+            if r < 0 or modules_cnt <= r:
+                r -= increment
+                increment = -increment
+                break
+
+    return coords
+
 def mask_function(mask_pattern):
     '''
     Give the mask funtion for given pattern 000-111
     According to Table 23
+    None -> no mask
     '''
-    if mask_pattern == 0:
+    if mask_pattern is None:
+        return lambda i, j: False
+    elif mask_pattern == 0:
         return lambda i, j: (i + j) % 2 == 0
     elif mask_pattern == 1:
         return lambda i, j: i % 2 == 0
@@ -514,5 +613,89 @@ def lost_count_4(modules, modules_cnt):
     percent = dark_cnt / modules_cnt / modules_cnt * 100
     return constants.MASK_EVAL_N4 * int(abs(percent-50)) // 5
 
-    
-    
+
+# Penalty of single lines, lost_calculator(modules) equals
+#   sum(lost_line_1) over rows and columns + sum(lost_pair_2) over adjacent rows
+#   + sum(lost_row_3) over rows + sum(lost_col_3) over columns + lost_4
+# so that a few changed rows/columns can be rescored alone
+
+def lost_line_1(line):
+    '''
+    lost_count_1 of one row or column
+    '''
+    points = 0
+    previous_color = line[0]
+    i = 1
+    for module in line[1:]:
+        if module == previous_color:
+            i += 1
+        else:
+            if i >= 5:
+                points += i + constants.MASK_EVAL_N1 - 5
+            i = 1
+            previous_color = module
+    if i >= 5:
+        points += i + constants.MASK_EVAL_N1 - 5
+    return points
+
+def lost_pair_2(row, next_row):
+    '''
+    lost_count_2 of the 2*2 blocks between two adjacent rows
+    '''
+    points = 0
+    previous = None
+    for top, bottom in zip(row, next_row):
+        current = top if top == bottom else None
+        if current is not None and current == previous:
+            points += constants.MASK_EVAL_N2
+        previous = current
+    return points
+
+def lost_row_3(row):
+    '''
+    lost_count_3 of one row
+    '''
+    points = 0
+    for c in range(len(row) - 10):
+        if(
+            not row[c + 1] and row[c + 4]
+            and not row[c + 5] and row[c + 6]
+            and not row[c + 9]
+            and(
+                row[c] and row[c + 2] and row[c + 3]
+                and not row[c + 7] and not row[c + 8] and not row[c + 10]
+            or
+                not row[c] and not row[c + 2] and not row[c + 3]
+                and row[c + 7] and row[c + 8] and row[c + 10]
+            )
+        ):
+            points += constants.MASK_EVAL_N3
+    return points
+
+def lost_col_3(col):
+    '''
+    lost_count_3 of one column, same conditions as the column scan there
+    '''
+    points = 0
+    for r in range(len(col) - 10):
+        if(
+            not col[r + 1] and col[r + 4]
+            and not col[r + 5] and col[r + 6]
+            and not col[r + 9]
+            and(
+                col[r] and col[r + 2] and col[r + 3]
+                and not col[r + 7] and not col[r + 8] and not col[r + 9]
+            or
+                not col[r] and not col[r + 2] and not col[r + 3]
+                and col[r + 7] and col[r + 8] and col[r + 10]
+            )
+        ):
+            points += constants.MASK_EVAL_N3
+    return points
+
+def lost_4(dark_cnt, modules_cnt):
+    '''
+    lost_count_4 from the number of dark modules
+    '''
+    percent = dark_cnt / modules_cnt / modules_cnt * 100
+    return constants.MASK_EVAL_N4 * int(abs(percent-50)) // 5